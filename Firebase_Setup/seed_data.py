@@ -1,11 +1,10 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import argparse
+import os
+import sys
 from datetime import datetime
 
-cred = credentials.Certificate('config\projectKey.json')
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from firestore_writer import add_writer_args, connect, open_writer
 
 ingredients = [
     {"Name": "Chicken", "Quantity": 500, "Unit": "grams", "Optional": False},
@@ -40,67 +39,86 @@ steps = [
 ]
 
 
-recipe_ref = db.collection("Recipe").document()
-
-recipe_ref.set({
-    "Title": "Chicken Curry",
-    "Description": "Traditional homemade Indian chicken curry.",
-    "AuthorID": "user_12345",
-    "AuthorName": "yashaher",
-    "Ingredients": ingredients,
-    "Steps": steps,
-    "TimeRequired": {
-        "PrepTime": 15,
-        "CookTime": 45,
-        "TotalTime": 60
-    },
-    "Difficulty": "Medium",
-    "Statistics": {
-        "ViewCount": 0,
-        "LikeCount": 0,
-        "RatingCount": 0
-    },
-    "CreatedAt": datetime.now()
-})
-
-print("Chicken Curry Recipe Added. ID:", recipe_ref.id)
-
-interaction_ref = db.collection("Interaction").document()
-
-interaction_ref.set({
-    "RecipeId": recipe_ref.id,
-    "UserId": "user_12345",
-    "Type": "rating",
-    "Rating": "5",
-    "Cooknote": "This recipe turned out amazing!",
-    "Username": "yashaher",
-    "RecipeTitle": "Chicken Curry",
-    "CreatedAt": datetime.now()
-})
-
-print("Interaction added. Interaction ID:", interaction_ref.id)
-
-user_ref = db.collection("Users").document()
-
-user_data = {
-    "UserID": user_ref.id,
-    "UserName": "Sample User",
-    "Email": "sampleUser@gmail.com",
-    "MobileNumber": "1234567890",
-    "JoinedAt": datetime.now(),
-    "SkillLevel": "Expert"
-}
-
-user_ref.set(user_data)
-print("User created with ID:", user_ref.id)
-
-activity_ref = user_ref.collection("Activities").document()
-
-activity_ref.set({
-    "InteractionID": interaction_ref.id, 
-    "RecipeName": "Chicken Curry",
-    "Type": "rating",
-    "CreatedAt": datetime.now()
-})
-
-print("Activity added for user:", user_ref.id)
+# the seed recipe with one interaction, user and activity. all four documents
+# go out through one writer, so with the default batch size they are
+# committed together in a single round trip
+def seed(db, writer):
+    recipe_ref = db.collection("Recipe").document()
+
+    writer.set(recipe_ref, {
+        "Title": "Chicken Curry",
+        "Description": "Traditional homemade Indian chicken curry.",
+        "AuthorID": "user_12345",
+        "AuthorName": "yashaher",
+        "Ingredients": ingredients,
+        "Steps": steps,
+        "TimeRequired": {
+            "PrepTime": 15,
+            "CookTime": 45,
+            "TotalTime": 60
+        },
+        "Difficulty": "Medium",
+        "Statistics": {
+            "ViewCount": 0,
+            "LikeCount": 0,
+            "RatingCount": 0
+        },
+        "CreatedAt": datetime.now()
+    })
+
+    print("Chicken Curry Recipe Added. ID:", recipe_ref.id)
+
+    interaction_ref = db.collection("Interaction").document()
+
+    writer.set(interaction_ref, {
+        "RecipeId": recipe_ref.id,
+        "UserId": "user_12345",
+        "Type": "rating",
+        "Rating": "5",
+        "Cooknote": "This recipe turned out amazing!",
+        "Username": "yashaher",
+        "RecipeTitle": "Chicken Curry",
+        "CreatedAt": datetime.now()
+    })
+
+    print("Interaction added. Interaction ID:", interaction_ref.id)
+
+    user_ref = db.collection("Users").document()
+
+    user_data = {
+        "UserID": user_ref.id,
+        "UserName": "Sample User",
+        "Email": "sampleUser@gmail.com",
+        "MobileNumber": "1234567890",
+        "JoinedAt": datetime.now(),
+        "SkillLevel": "Expert"
+    }
+
+    writer.set(user_ref, user_data)
+    print("User created with ID:", user_ref.id)
+
+    activity_ref = user_ref.collection("Activities").document()
+
+    writer.set(activity_ref, {
+        "InteractionID": interaction_ref.id, 
+        "RecipeName": "Chicken Curry",
+        "Type": "rating",
+        "CreatedAt": datetime.now()
+    })
+
+    print("Activity added for user:", user_ref.id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed Firestore with the sample recipe, interaction and user")
+    add_writer_args(parser)
+    args = parser.parse_args(argv)
+
+    db = connect(fake=args.fake)
+    with open_writer(db, args.mode, args.batch_size, args.concurrency, args.max_ops,
+                     label="seed") as writer:
+        seed(db, writer)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,15 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import argparse
+import os
+import sys
 from datetime import datetime
 import random
 
-cred = credentials.Certificate('config/projectKey.json')
-firebase_admin.initialize_app(cred)
+from synthetic_dataset import (
+    difficulty_levels, ingredient_pool, interaction_types, recipe_titles, sample_users, units
+)
 
-db = firestore.client()
-
-
-recipe_titles = [
-    "Paneer Butter Masala", "Mutton Gravy", "Vegetable Biryani", "Egg Curry",
-    "Fish Fry", "Dal Tadka", "Aloo Paratha", "Prawn Masala", "Veg Pulao",
-    "Chicken Biryani", "Masala Dosa", "Chole Bhature", "Rajma Chawal",
-    "Kadai Paneer", "Tandoori Chicken", "Bhindi Masala", "Egg Fried Rice",
-    "Sambar", "Chicken Korma", "Lemon Rice"
-]
-
-ingredient_pool = [
-    "Onion", "Tomato", "Ginger", "Garlic", "Green Chili", "Oil",
-    "Cumin Seeds", "Garam Masala", "Turmeric", "Salt", "Red Chili Powder",
-    "Coriander Powder", "Water", "Butter", "Coriander Leaves",
-    "Chicken", "Paneer", "Mutton", "Rice", "Eggs", "Curd"
-]
-
-units = ["grams", "tsp", "tbsp", "cups", "ml", "pieces"]
-
-difficulty_levels = ["Easy", "Medium", "Hard"]
-
-interaction_types = ["view", "rating", "like", "cooknote"]
-
-sample_users = [
-    {"userID": "user_001", "username": "chefA"},
-    {"userID": "user_002", "username": "chefB"},
-    {"userID": "user_003", "username": "foodlover"},
-    {"userID": "user_004", "username": "kitchenKing"},
-    {"userID": "user_005", "username": "masterChef"}
-]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from firestore_writer import add_writer_args, connect, open_writer
 
 
 def generate_ingredients():
@@ -61,12 +34,13 @@ def generate_steps():
         })
     return steps
 
-def generate_interaction(recipe_id, recipe_title):
+def generate_interaction(db, writer, recipe_id, recipe_title):
     user = random.choice(sample_users)
 
+    # document ids are generated client side, so queuing the write needs no round trip
     interaction_ref = db.collection("Interaction").document()
 
-    interaction_ref.set({
+    writer.set(interaction_ref, {
         "RecipeId": recipe_id,
         "UserId": user["userID"],
         "Type": random.choice(interaction_types),
@@ -77,38 +51,55 @@ def generate_interaction(recipe_id, recipe_title):
         "CreatedAt": datetime.now()
     })
 
-    print("   → Interaction added:", interaction_ref.id)
-
-
-for i in range(20):
-
-    title = random.choice(recipe_titles)
-    author = random.choice(sample_users)
-
-    recipe_ref = db.collection("Recipe").document()
-
-    recipe_ref.set({
-        "Title": title,
-        "Description": f"A delicious recipe for {title}.",
-        "Ingredients": generate_ingredients(),
-        "Steps": generate_steps(),
-        "TimeRequired": {
-            "PrepTime": random.randint(10, 25),
-            "CookTime": random.randint(20, 50),
-            "TotalTime": random.randint(40, 80)
-        },
-        "Difficulty": random.choice(difficulty_levels),
-        "Statistics": {
-            "ViewCount": random.randint(5, 200),
-            "LikeCount": random.randint(0, 80),
-            "RatingCount": random.randint(0, 50)
-        },
-        "CreatedAt": datetime.now(),
-        "AuthorID": author["userID"],
-        "AuthorName": author["username"]
-    })
 
-    print(f"✔ Recipe {i+1} created: {title}")
+def generate(db, writer, recipes=20):
+    for i in range(recipes):
+
+        title = random.choice(recipe_titles)
+        author = random.choice(sample_users)
+
+        recipe_ref = db.collection("Recipe").document()
+
+        writer.set(recipe_ref, {
+            "Title": title,
+            "Description": f"A delicious recipe for {title}.",
+            "Ingredients": generate_ingredients(),
+            "Steps": generate_steps(),
+            "TimeRequired": {
+                "PrepTime": random.randint(10, 25),
+                "CookTime": random.randint(20, 50),
+                "TotalTime": random.randint(40, 80)
+            },
+            "Difficulty": random.choice(difficulty_levels),
+            "Statistics": {
+                "ViewCount": random.randint(5, 200),
+                "LikeCount": random.randint(0, 80),
+                "RatingCount": random.randint(0, 50)
+            },
+            "CreatedAt": datetime.now(),
+            "AuthorID": author["userID"],
+            "AuthorName": author["username"]
+        })
+
+        for _ in range(random.randint(1, 3)):
+            generate_interaction(db, writer, recipe_ref.id, title)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic recipes and interactions to Firestore")
+    parser.add_argument("--recipes", type=float, default=20, help="number of recipes (accepts 1e6 style values)")
+    parser.add_argument("--seed", type=int, help="seed the random generator for a repeatable run")
+    add_writer_args(parser)
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    db = connect(fake=args.fake)
+    with open_writer(db, args.mode, args.batch_size, args.concurrency, args.max_ops,
+                     label="synthetic") as writer:
+        generate(db, writer, int(args.recipes))
+    print(f"✔ {int(args.recipes)} recipes and their interactions written ({writer.count} docs)")
+
 
-    for _ in range(random.randint(1, 3)):
-        generate_interaction(recipe_ref.id, title)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import math
+import os
+import random
+import sys
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from pipeline_io import JsonStreamWriter
+
+
+# offline, seeded generator for recipes.json / interactions.json in the same
+# shape firestore_export writes them. documents are produced one at a time
+# and every cross reference (ids, titles) is derived from the document index,
+# so memory stays flat from 10^4 up to 10^8 documents.
+
+recipe_titles = [
+    "Paneer Butter Masala", "Mutton Gravy", "Vegetable Biryani", "Egg Curry",
+    "Fish Fry", "Dal Tadka", "Aloo Paratha", "Prawn Masala", "Veg Pulao",
+    "Chicken Biryani", "Masala Dosa", "Chole Bhature", "Rajma Chawal",
+    "Kadai Paneer", "Tandoori Chicken", "Bhindi Masala", "Egg Fried Rice",
+    "Sambar", "Chicken Korma", "Lemon Rice"
+]
+
+ingredient_pool = [
+    "Onion", "Tomato", "Ginger", "Garlic", "Green Chili", "Oil",
+    "Cumin Seeds", "Garam Masala", "Turmeric", "Salt", "Red Chili Powder",
+    "Coriander Powder", "Water", "Butter", "Coriander Leaves",
+    "Chicken", "Paneer", "Mutton", "Rice", "Eggs", "Curd"
+]
+
+units = ["grams", "tsp", "tbsp", "cups", "ml", "pieces"]
+
+difficulty_levels = ["Easy", "Medium", "Hard"]
+
+interaction_types = ["view", "rating", "like", "cooknote"]
+
+sample_users = [
+    {"userID": "user_001", "username": "chefA"},
+    {"userID": "user_002", "username": "chefB"},
+    {"userID": "user_003", "username": "foodlover"},
+    {"userID": "user_004", "username": "kitchenKing"},
+    {"userID": "user_005", "username": "masterChef"}
+]
+
+ID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# ratings lean positive, like real review data
+RATING_CDF = list(accumulate([5, 8, 17, 35, 35]))
+# multiplier that spreads popularity ranks over the whole id range
+SPREAD = 2654435761
+
+
+# uniform int in [lo, hi]; rng.randint is several times slower and dominates
+# generation at scale
+def randint(rng, lo, hi):
+    return lo + int(rng.random() * (hi - lo + 1))
+
+
+def pick(rng, items):
+    return items[int(rng.random() * len(items))]
+
+
+# rank in [0, n) from a bounded zipf-like (power law) distribution with
+# exponent `s`, by inverting its continuous cdf; needs no table of size n
+def zipf_rank(u, n, s):
+    if n <= 1:
+        return 0
+    if abs(s - 1.0) < 1e-9:
+        x = n ** u
+    else:
+        x = (1 + u * (n ** (1 - s) - 1)) ** (1 / (1 - s))
+    return min(int(x) - 1, n - 1)
+
+
+class SyntheticDataset:
+
+    def __init__(self, recipes, interactions=None, users=None, seed=0, skew=1.1,
+                 vocabulary=1000, start=datetime(2024, 1, 1, tzinfo=timezone.utc), days=365):
+        self.recipes = recipes
+        self.interactions = recipes * 2 if interactions is None else interactions
+        self.users = users or max(len(sample_users), recipes // 20)
+        self.seed = seed
+        self.skew = skew
+        self.start = start
+        self.span = timedelta(days=days)
+
+        # the hand picked pool is the popular head, numbered names the long tail
+        names = list(ingredient_pool)
+        names += [f"Ingredient {k}" for k in range(len(names), max(vocabulary, len(names)))]
+        self.ingredient_names = names
+        self._ingredient_weights = list(accumulate(1 / (k + 1) ** skew for k in range(len(names))))
+
+    def _digest(self, kind, index):
+        return hashlib.blake2b(f"{self.seed}:{kind}:{index}".encode(), digest_size=16).digest()
+
+    # 20 character ids that look like firestore auto ids
+    def doc_id(self, kind, index):
+        n = int.from_bytes(self._digest(kind, index), "big")
+        chars = []
+        for _ in range(20):
+            n, r = divmod(n, 62)
+            chars.append(ID_ALPHABET[r])
+        return "".join(chars)
+
+    def recipe_title(self, index):
+        return recipe_titles[self._digest("recipe", index)[-1] % len(recipe_titles)]
+
+    def user(self, index):
+        if index < len(sample_users):
+            return sample_users[index]
+        return {"userID": f"user_{index + 1:06d}", "username": f"cook{index + 1}"}
+
+    def created_at(self, index, total):
+        return self.start + self.span * (index / max(total, 1))
+
+    # popular items get low ranks; the rank is scattered over the index range
+    # so popularity does not follow creation order
+    def _popular(self, rng, n):
+        rank = zipf_rank(rng.random(), n, self.skew)
+        return (rank * SPREAD + self.seed) % n if math.gcd(SPREAD, n) == 1 else rank
+
+    def _ingredients(self, rng):
+        weights, total = self._ingredient_weights, self._ingredient_weights[-1]
+        return [
+            {
+                "Name": self.ingredient_names[bisect(weights, rng.random() * total)],
+                "Quantity": randint(rng, 1, 500),
+                "Unit": pick(rng, units),
+                "Optional": rng.random() < 0.5,
+            }
+            for _ in range(randint(rng, 5, 10))
+        ]
+
+    def _steps(self, rng):
+        return [
+            {
+                "StepNumber": i,
+                "Instruction": f"Follow step {i} carefully.",
+                "Duration": f"{randint(rng, 1, 15)} min"
+            }
+            for i in range(1, randint(rng, 6, 15))
+        ]
+
+    def iter_recipes(self):
+        rng = random.Random(f"{self.seed}:recipes")
+        for i in range(self.recipes):
+            author = self.user(self._popular(rng, self.users))
+            title = self.recipe_title(i)
+            prep = randint(rng, 10, 25)
+            cook = randint(rng, 20, 50)
+            yield {
+                "CreatedAt": self.created_at(i, self.recipes).isoformat(),
+                "AuthorName": author["username"],
+                "TimeRequired": {
+                    "CookTime": cook,
+                    "PrepTime": prep,
+                    "TotalTime": prep + cook + randint(rng, 0, 15)
+                },
+                "Difficulty": pick(rng, difficulty_levels),
+                "Description": f"A delicious recipe for {title}.",
+                "Steps": self._steps(rng),
+                "Ingredients": self._ingredients(rng),
+                "Statistics": {
+                    "ViewCount": randint(rng, 5, 200),
+                    "LikeCount": randint(rng, 0, 80),
+                    "RatingCount": randint(rng, 0, 50)
+                },
+                "Title": title,
+                "AuthorID": author["userID"],
+                "id": self.doc_id("recipe", i),
+            }
+
+    def iter_interactions(self):
+        rng = random.Random(f"{self.seed}:interactions")
+        for i in range(self.interactions):
+            recipe = self._popular(rng, self.recipes)
+            user = self.user(self._popular(rng, self.users))
+            yield {
+                "UserId": user["userID"],
+                "Username": user["username"],
+                "CreatedAt": self.created_at(i, self.interactions).isoformat(),
+                "Rating": str(bisect(RATING_CDF, rng.random() * RATING_CDF[-1]) + 1),
+                "Type": pick(rng, interaction_types),
+                "RecipeTitle": self.recipe_title(recipe),
+                "Cooknote": "Amazing taste!" if rng.random() > 0.4 else "",
+                "RecipeId": self.doc_id("recipe", recipe),
+                "id": self.doc_id("interaction", i),
+            }
+
+    # write recipes.<ext> and interactions.<ext> into output_dir
+    def write(self, output_dir="data_extract", fmt="json", report_every=100000):
+        ext = "ndjson" if fmt == "ndjson" else "json"
+        counts = {}
+        for name, docs in (("recipes", self.iter_recipes()), ("interactions", self.iter_interactions())):
+            path = os.path.join(output_dir, f"{name}.{ext}")
+            with JsonStreamWriter(path, fmt, label=name, report_every=report_every) as writer:
+                for doc in docs:
+                    writer.write(doc)
+            counts[name] = writer.count
+        return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic recipes/interactions extract offline")
+    parser.add_argument("--recipes", type=float, default=1e4,
+                        help="number of recipes (accepts 1e6 style values)")
+    parser.add_argument("--interactions", type=float,
+                        help="number of interactions (default: twice the recipes)")
+    parser.add_argument("--users", type=int, help="number of distinct users (default: recipes / 20)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="power law exponent for ingredient, recipe and user popularity")
+    parser.add_argument("--vocabulary", type=int, default=1000, help="number of distinct ingredients")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json")
+    parser.add_argument("--output-dir", default="data_extract")
+    args = parser.parse_args(argv)
+
+    dataset = SyntheticDataset(
+        int(args.recipes),
+        interactions=int(args.interactions) if args.interactions is not None else None,
+        users=args.users, seed=args.seed, skew=args.skew, vocabulary=args.vocabulary,
+    )
+    counts = dataset.write(args.output_dir, args.format)
+    print(f"Synthetic data written to {args.output_dir}/: {counts}")
+
+
+if __name__ == "__main__":
+    main()
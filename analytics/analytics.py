@@ -1,70 +1,121 @@
+import argparse
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import os
 import json
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics_charts import bar_chart, render_charts, scatter_chart
+from analytics_chunked import DEFAULT_CHUNKSIZE, compute_insights_chunked
+from analytics_serving import SERVING_DIR, publish, serving_frames, serving_frames_from_state
+from analytics_sql import DB_PATH, compute_insights_sql, rated_points_sql
+from analytics_state import (CHANGES_DIR, STATE_DIR, AnalyticsState, coerce, rating_stats,
+                             read_changes, top_values, with_rating)
+from pipeline_cache import hash_file
+from pipeline_io import find_artifact, read_json
+
+
+# parquet tables come back already typed; the partition column is dropped
+# so both formats give the same frames
+def read_parquet_table(name):
+    df = pd.read_parquet(os.path.join("data_transform", "parquet", name))
+    return df.drop(columns=["created_date"], errors="ignore")
+
+
+# csv tables may also be stored as .csv.gz / .csv.zst; pandas decompresses
+# them while it parses
+def load_csvs(fmt="csv"):
+    if fmt == "parquet":
+        recipes = read_parquet_table("recipe")
+        ingredients = read_parquet_table("ingredients")
+        steps = read_parquet_table("steps")
+        interactions = read_parquet_table("interactions")
+        return recipes, ingredients, steps, interactions
+
+    recipes = pd.read_csv(find_artifact("data_transform/recipe.csv"))
+    ingredients = pd.read_csv(find_artifact("data_transform/ingredients.csv"))
+    steps = pd.read_csv(find_artifact("data_transform/steps.csv"))
+    interactions = pd.read_csv(find_artifact("data_transform/interactions.csv"))
 
+    # Convert numeric field
+    coerce(recipes, interactions)
 
-def load_csvs():
-    recipes = pd.read_csv("data_transform/recipe.csv")
-    ingredients = pd.read_csv("data_transform/ingredients.csv")
-    steps = pd.read_csv("data_transform/steps.csv")
-    interactions = pd.read_csv("data_transform/interactions.csv")
+    return recipes, ingredients, steps, interactions
 
-    # Convert numeric field
-    recipes["prep_time"] = pd.to_numeric(recipes["prep_time"], errors="coerce")
-    recipes["cook_time"] = pd.to_numeric(recipes["cook_time"], errors="coerce")
-    recipes["total_time"] = pd.to_numeric(recipes["total_time"], errors="coerce")
 
-    interactions["rating"] = pd.to_numeric(interactions["rating"], errors="coerce")
+TABLE_FILES = ["recipe.csv", "ingredients.csv", "steps.csv", "interactions.csv"]
 
-    return recipes, ingredients, steps, interactions
 
+def table_hashes():
+    return {table: hash_file(find_artifact(os.path.join("data_transform", table))) for table in TABLE_FILES}
+
+
+# bring the persisted aggregate state up to date with data_transform/:
+# fold in data_transform/changes/ when the state is exactly the tables those
+# changes start from, otherwise (or with full_rebuild) rebuild it from the
+# full tables
+def update_state(fmt="csv", full_rebuild=False, state_dir=STATE_DIR, changes_dir=CHANGES_DIR):
+    state = None if full_rebuild else AnalyticsState.load(state_dir)
+    manifest = read_json(os.path.join(changes_dir, "manifest.json"))
+    tables = state.meta.get("tables") if state is not None else None
+
+    if state is not None and manifest and tables == manifest["result"]:
+        print("Analytics state already includes the latest changes")
+        return state
+    if state is not None and manifest and tables == manifest["base"]:
+        state.apply(*read_changes(changes_dir))
+        state.meta["tables"] = manifest["result"]
+        print(f"Folded {changes_dir}/ into the analytics state")
+    elif state is not None and fmt == "csv" and tables == table_hashes():
+        return state
+    else:
+        state = AnalyticsState.build(*load_csvs(fmt))
+        state.meta["tables"] = table_hashes() if fmt == "csv" else None
+        print("Rebuilt the analytics state from the full tables")
+    state.save(state_dir)
+    return state
 
-def insights(recipes, ingredients, steps, interactions):
+
+# recipes with their average rating, shared by the insights and the charts
+def rated_recipes(recipes, interactions):
+    return with_rating(recipes, rating_stats(interactions))
+
+
+# ties in the top lists are broken by key, the same way AnalyticsState.derive
+# does, so the full and incremental runs pick the same items
+def compute_insights(recipes, ingredients, steps, interactions, merged=None):
     out = {}
 
     # most common ingredients
-    out["most_common_ingredients"] = (
-        ingredients["name"].value_counts().head(20).to_dict()
-    )
+    out["most_common_ingredients"] = top_values(ingredients["name"].value_counts(), 20)
 
     # average preparation time
     out["avg_prep_time"] = recipes["prep_time"].mean()
 
     out["avg_cook_time"] = recipes["cook_time"].mean()
 
-    out["difficulty_distribution"] = recipes["difficulty"].value_counts().to_dict()
+    out["difficulty_distribution"] = top_values(recipes["difficulty"].value_counts())
 
     # most interacted recipes
-    out["most_interacted"] = (
-        interactions["recipe_id"].value_counts().head(20).to_dict()
-    )
+    out["most_interacted"] = top_values(interactions["recipe_id"].value_counts(), 20)
 
-    avg_ratings = interactions.groupby("recipe_id")["rating"].mean().reset_index()
-    merged = recipes.merge(avg_ratings, on="recipe_id", how="left")
+    ratings = rating_stats(interactions)
+    if merged is None:
+        merged = with_rating(recipes, ratings)
     out["prep_vs_rating_corr"] = merged["prep_time"].corr(merged["rating"])
 
- 
-    ing_ratings = ingredients.merge(
-        interactions[["recipe_id", "rating"]], on="recipe_id", how="left"
-    )
-    ing_ratings["rating"] = pd.to_numeric(
-        ing_ratings["rating"], errors="coerce"
-    )
-
-    ing_score = (
-        ing_ratings.groupby("name")["rating"]
-        .mean()
-        .dropna()
-        .sort_values(ascending=False)
-        .head(20)
-    )
-    out["ingredients_high_rating"] = ing_score.to_dict()
+    # mean rating over (ingredient row, interaction) pairs on the same recipe,
+    # as a weighted aggregate of the per recipe sums; no fan-out join
+    ing_ratings = ingredients[["recipe_id", "name"]].join(ratings, on="recipe_id")
+    ing_totals = ing_ratings.groupby("name")[["rating_sum", "rating_count"]].sum()
+    ing_totals = ing_totals[ing_totals["rating_count"] > 0]
+    out["ingredients_high_rating"] = top_values(ing_totals["rating_sum"] / ing_totals["rating_count"], 20)
 
     # top rated recipes
     top_rated = (
-        merged.sort_values("rating", ascending=False)
+        merged.sort_values(["rating", "recipe_id"], ascending=[False, True], na_position="last")
         .head(10)[["recipe_id", "title", "rating"]]
         .to_dict(orient="records")
     )
@@ -78,18 +129,21 @@ def insights(recipes, ingredients, steps, interactions):
         interactions["cooknote"].notnull()
         & (interactions["cooknote"].str.strip() != "")
     ]
-    out["recipes_most_comments"] = (
-        comments["recipe_id"].value_counts().head(10).to_dict()
-    )
+    out["recipes_most_comments"] = top_values(comments["recipe_id"].value_counts(), 10)
 
     # longest time recipe
     out["longest_total_time"] = (
         recipes[["recipe_id", "title", "total_time"]]
-        .sort_values("total_time", ascending=False)
+        .sort_values(["total_time", "recipe_id"], ascending=[False, True], na_position="last")
         .head(10)
         .to_dict(orient="records")
     )
 
+    return out
+
+
+# write the insights to analytics/ as csv + json
+def save_insights(out):
     # save into csv
     os.makedirs("analytics", exist_ok=True)
     pd.Series(out["most_common_ingredients"]).to_csv(
@@ -103,37 +157,85 @@ def insights(recipes, ingredients, steps, interactions):
     with open("analytics/analytics_summary.json", "w", encoding="utf-8") as f:
         json.dump(out, f, indent=2, default=str)
 
-    return out
 
+def insights(recipes, ingredients, steps, interactions, merged=None):
+    out = compute_insights(recipes, ingredients, steps, interactions, merged)
+    save_insights(out)
+    return out
 
-# chart generation using scatter plot
-def generate_charts(recipes, ingredients, interactions, out):
-    os.makedirs("analytics/charts", exist_ok=True)
-
-    recipes["difficulty"].value_counts().plot(
-        kind="bar", title="Difficulty Distribution"
-    )
-    plt.tight_layout()
-    plt.savefig("analytics/charts/difficulty_distribution.png")
-    plt.clf()
-
-    top_ing = pd.Series(out["most_common_ingredients"])
-    top_ing.head(15).plot(kind="bar", title="Top Ingredients")
-    plt.tight_layout()
-    plt.savefig("analytics/charts/top_ingredients.png")
-    plt.clf()
-
-    avg_ratings = interactions.groupby("recipe_id")["rating"].mean().reset_index()
-    merged = recipes.merge(avg_ratings, on="recipe_id", how="left")
 
-    merged.plot.scatter(x="prep_time", y="rating", title="Prep Time vs Rating")
-    plt.tight_layout()
-    plt.savefig("analytics/charts/prep_vs_rating.png")
-    plt.clf()
+# chart generation: difficulty and top ingredient bars plus the prep time vs
+# rating scatter, each redrawn only when its data changed (see
+# analytics_charts). `merged` (recipes with their average rating) is computed
+# from the interactions when not given; only its prep_time and rating are
+# plotted
+def generate_charts(recipes, ingredients, interactions, out, merged=None, workers=1):
+    if merged is None:
+        merged = rated_recipes(recipes, interactions)
+
+    charts = [
+        bar_chart("difficulty_distribution", "Difficulty Distribution",
+                  pd.Series(out["difficulty_distribution"], dtype="float64")),
+        bar_chart("top_ingredients", "Top Ingredients",
+                  pd.Series(out["most_common_ingredients"], dtype="float64").head(15)),
+        scatter_chart("prep_vs_rating", "Prep Time vs Rating",
+                      merged["prep_time"], merged["rating"], "prep_time", "rating"),
+    ]
+    return render_charts(charts, workers=workers)
 
 
 if __name__ == "__main__":
-    recipes, ingredients, steps, interactions = load_csvs()
-    out = insights(recipes, ingredients, steps, interactions)
-    generate_charts(recipes, ingredients, interactions, out)
+    parser = argparse.ArgumentParser(description="Run analytics over the transformed tables")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="read data_transform/*.csv or the typed data_transform/parquet tables")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep aggregates in analytics/state and fold in data_transform/changes "
+                             "(from transform --changes) instead of recomputing everything")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="rebuild analytics/state from the full tables")
+    parser.add_argument("--chunked", action="store_true",
+                        help="stream the tables in chunks with running aggregates instead of "
+                             "loading them into memory")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="rows per chunk for --chunked")
+    parser.add_argument("--sketch-size", type=int,
+                        help="with --chunked, count ingredients with an approximate heavy hitter "
+                             "summary of this many counters")
+    parser.add_argument("--db", nargs="?", const=DB_PATH, metavar="PATH",
+                        help="run the insights as sql against the database data_load/load_to_sqlite.py "
+                             f"writes (default {DB_PATH})")
+    parser.add_argument("--chart-workers", type=int, default=1,
+                        help="render charts on this many worker processes (0 = one per cpu)")
+    parser.add_argument("--publish", action="store_true",
+                        help=f"also publish the results as a snapshot for analytics_serving.py "
+                             f"under {SERVING_DIR}/")
+    args = parser.parse_args()
+    if args.publish and (args.db or args.chunked):
+        parser.error("--publish needs the full tables or the --incremental state")
+
+    if args.db:
+        out = compute_insights_sql(args.db)
+        save_insights(out)
+        generate_charts(None, None, None, out, merged=rated_points_sql(args.db),
+                        workers=args.chart_workers)
+    elif args.chunked:
+        out, points = compute_insights_chunked(args.chunksize, args.format, args.sketch_size)
+        save_insights(out)
+        generate_charts(None, None, None, out, merged=points, workers=args.chart_workers)
+    elif args.incremental or args.full_rebuild:
+        state = update_state(args.format, full_rebuild=args.full_rebuild)
+        out = state.derive()
+        save_insights(out)
+        merged = state.merged()
+        generate_charts(merged, None, None, out, merged=merged, workers=args.chart_workers)
+        if args.publish:
+            publish(out, *serving_frames_from_state(state))
+    else:
+        recipes, ingredients, steps, interactions = load_csvs(args.format)
+        merged = rated_recipes(recipes, interactions)
+        out = insights(recipes, ingredients, steps, interactions, merged)
+        generate_charts(recipes, ingredients, interactions, out, merged=merged,
+                        workers=args.chart_workers)
+        if args.publish:
+            publish(out, *serving_frames(recipes, ingredients, steps, interactions))
     print("Analytics complete. Summary saved to analytics/analytics_summary.json")
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from pipeline_cache import hash_file
+from pipeline_io import read_json, write_json_atomic
+
+
+# chart rendering without pyplot: every chart is an explicit Figure drawn
+# on the Agg canvas, so charts can be rendered from threads or worker
+# processes. a chart is only redrawn when the hash of its data (and of this
+# file) differs from the one recorded for its last render. scatter charts
+# with more than SCATTER_MAX_POINTS points are drawn as a density grid
+# binned up front, so render time and the data sent to a worker stay bounded.
+
+CHART_DIR = "analytics/charts"
+HASHES_FILE = "chart_hashes.json"
+SCATTER_MAX_POINTS = 50000
+DENSITY_BINS = (60, 40)
+
+
+def bar_chart(name, title, series):
+    return {"name": name, "kind": "bar", "title": title,
+            "labels": [str(k) for k in series.index], "values": series.to_numpy(dtype="float64")}
+
+
+def scatter_chart(name, title, x, y, xlabel, ylabel):
+    both = x.notna() & y.notna()
+    x = x[both].to_numpy(dtype="float64")
+    y = y[both].to_numpy(dtype="float64")
+    chart = {"name": name, "title": title, "xlabel": xlabel, "ylabel": ylabel}
+    if len(x) <= SCATTER_MAX_POINTS:
+        return {**chart, "kind": "scatter", "x": x, "y": y}
+    counts, xedges, yedges = np.histogram2d(x, y, bins=DENSITY_BINS)
+    return {**chart, "kind": "density", "counts": counts, "xedges": xedges, "yedges": yedges,
+            "points": len(x)}
+
+
+def chart_hash(chart, code_hash=None):
+    h = hashlib.blake2b(digest_size=16)
+    h.update((code_hash or hash_file(os.path.abspath(__file__))).encode())
+    for key in sorted(chart):
+        value = chart[key]
+        h.update(key.encode())
+        if isinstance(value, np.ndarray):
+            h.update(str((value.dtype, value.shape)).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        else:
+            h.update(json.dumps(value).encode())
+    return h.hexdigest()
+
+
+def _draw(ax, chart):
+    if chart["kind"] == "bar":
+        positions = np.arange(len(chart["labels"]))
+        ax.bar(positions, chart["values"])
+        ax.set_xticks(positions, chart["labels"], rotation=90)
+    elif chart["kind"] == "scatter":
+        ax.scatter(chart["x"], chart["y"])
+        ax.set_xlabel(chart["xlabel"])
+        ax.set_ylabel(chart["ylabel"])
+    else:
+        from matplotlib.colors import LogNorm
+        counts = np.ma.masked_equal(chart["counts"].T, 0)
+        mesh = ax.pcolormesh(chart["xedges"], chart["yedges"], counts, norm=LogNorm())
+        ax.figure.colorbar(mesh, ax=ax, label="recipes")
+        ax.set_xlabel(chart["xlabel"])
+        ax.set_ylabel(chart["ylabel"])
+    title = chart["title"]
+    if chart["kind"] == "density":
+        title += f" ({chart['points']} points, binned)"
+    ax.set_title(title)
+
+
+# draw one chart into `path`; runs in worker processes
+def render(chart, path):
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    _draw(fig.add_subplot(), chart)
+    fig.tight_layout()
+    tmp = path + ".tmp"
+    fig.savefig(tmp, format="png")
+    os.replace(tmp, path)
+    return path
+
+
+# render the charts whose data changed since their last render, on up to
+# `workers` spawned processes. each worker pays an interpreter + matplotlib
+# start-up, which outweighs a few bounded charts, so the default is to draw
+# in this process. the png's own hash is recorded too, so a chart replaced
+# behind our back (e.g. restored from the stage cache) is redrawn. returns
+# the names of the charts that were drawn
+def render_charts(charts, out_dir=CHART_DIR, workers=1):
+    os.makedirs(out_dir, exist_ok=True)
+    hashes_path = os.path.join(out_dir, HASHES_FILE)
+    previous = read_json(hashes_path) or {}
+    code_hash = hash_file(os.path.abspath(__file__))
+
+    rendered, due = {}, []
+    for chart in charts:
+        path = os.path.join(out_dir, f"{chart['name']}.png")
+        data = chart_hash(chart, code_hash)
+        last = previous.get(chart["name"]) or {}
+        if last.get("data") == data and os.path.exists(path) and last.get("png") == hash_file(path):
+            continue
+        rendered[chart["name"]] = data
+        due.append((chart, path))
+
+    workers = min(len(due), workers or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            for future in [pool.submit(render, chart, path) for chart, path in due]:
+                future.result()
+    else:
+        for chart, path in due:
+            render(chart, path)
+
+    for chart, path in due:
+        previous[chart["name"]] = {"data": rendered[chart["name"]], "png": hash_file(path)}
+    write_json_atomic(hashes_path, previous)
+    return list(rendered)
@@ -0,0 +1,317 @@
+import functools
+import heapq
+import itertools
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from analytics_state import coerce, top_values, with_rating
+from pipeline_io import find_artifact
+
+
+# out-of-core insights: every table is streamed in chunks of `chunksize`
+# rows, reading only the columns the insights use, and folded into running
+# aggregates. what stays resident is per recipe (rating sum/count,
+# interaction, comment and step counts), per ingredient name, a few top-k
+# heaps and a fixed size sample of points for the scatter chart, so memory
+# follows the number of recipes and chunksize, not the size of the files.
+
+DEFAULT_CHUNKSIZE = 250000
+SAMPLE_POINTS = 100000
+
+# ids and keys are held as arrow strings (far smaller than python str
+# objects); numbers are read as text and coerced like load_csvs does, so
+# malformed values become NaN instead of failing the read
+KEY = "string[pyarrow]"
+COLUMNS = {
+    "recipe": {"recipe_id": KEY, "title": object, "prep_time": object, "cook_time": object,
+               "total_time": object, "difficulty": KEY},
+    "ingredients": {"recipe_id": KEY, "name": KEY},
+    "steps": {"recipe_id": KEY},
+    "interactions": {"recipe_id": KEY, "rating": object, "cooknote": object},
+}
+CSV_FILES = {"recipe": "recipe.csv", "ingredients": "ingredients.csv",
+             "steps": "steps.csv", "interactions": "interactions.csv"}
+
+
+def read_chunks(table, chunksize=DEFAULT_CHUNKSIZE, fmt="csv"):
+    columns = COLUMNS[table]
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(os.path.join("data_transform", "parquet", table), partitioning="hive")
+        # each date partition is a small file; batches are coalesced so a
+        # chunk holds about `chunksize` rows either way
+        batches, size = [], 0
+        for batch in dataset.to_batches(columns=list(columns), batch_size=chunksize):
+            batches.append(batch)
+            size += batch.num_rows
+            if size >= chunksize:
+                yield pa.Table.from_batches(batches).to_pandas()
+                batches, size = [], 0
+        if batches:
+            yield pa.Table.from_batches(batches).to_pandas()
+        return
+    yield from pd.read_csv(find_artifact(os.path.join("data_transform", CSV_FILES[table])),
+                           usecols=list(columns), dtype=columns, chunksize=chunksize)
+
+
+# per key sums over a stream of partial groupby results. partials are
+# buffered and collapsed into the total once they outgrow it, so every row
+# is re-aggregated a bounded number of times
+class RunningSums:
+
+    def __init__(self, empty, min_pending=100000):
+        self.total = empty
+        self.min_pending = min_pending
+        self._pending = []
+        self._pending_rows = 0
+
+    def add(self, partial):
+        if not len(partial):
+            return
+        self._pending.append(partial)
+        self._pending_rows += len(partial)
+        if self._pending_rows >= max(len(self.total), self.min_pending):
+            self._collapse()
+
+    def _collapse(self):
+        if self._pending:
+            parts = [self.total] + self._pending if len(self.total) else self._pending
+            self.total = pd.concat(parts).groupby(level=0).sum()
+        self._pending, self._pending_rows = [], 0
+
+    def result(self):
+        self._collapse()
+        return self.total
+
+
+# misra-gries summary of the most frequent values: at most `capacity`
+# counters, each short of the true count by at most rows / (capacity + 1).
+# chunk counts are merged in as summaries, which keeps that bound
+class HeavyHitters:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype="int64")
+        self.rows = 0
+
+    def add(self, values):
+        counts = values.value_counts()
+        self.rows += int(counts.sum())
+        merged = self.counts.add(counts, fill_value=0)
+        if len(merged) > self.capacity:
+            cut = merged.nlargest(self.capacity + 1).iloc[-1]
+            merged = merged[merged > cut] - cut
+        self.counts = merged.astype("int64")
+
+    def error_bound(self):
+        return self.rows // (self.capacity + 1)
+
+
+# orders its value the other way round, so a min-heap of (value, _Reversed(key))
+# drops the largest key first among equal values
+@functools.total_ordering
+class _Reversed:
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+# the k rows with the largest `column`, kept in a min-heap while chunks
+# stream past. ties are broken by the smallest `key`; rows without a value
+# only fill the list when fewer than k rows have one, smallest key first
+# (as a sort on (column desc, key) with missing values last puts them)
+class TopK:
+
+    def __init__(self, k, column, fields, key="recipe_id"):
+        self.k = k
+        self.column = column
+        self.fields = fields
+        self.key = key
+        self.heap = []
+        self.missing = []
+        self._seq = itertools.count()
+
+    def _push(self, heap, entry):
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def add(self, chunk):
+        values = chunk[self.column]
+        # only a chunk's own top k can make it into the heaps
+        head = chunk[values.notna()].sort_values([self.column, self.key], ascending=[False, True]).head(self.k)
+        for record in head[self.fields].to_dict(orient="records"):
+            self._push(self.heap, (record[self.column], _Reversed(record[self.key]), -next(self._seq), record))
+        rest = chunk[values.isna()].sort_values(self.key).head(self.k)
+        for record in rest[self.fields].to_dict(orient="records"):
+            self._push(self.missing, (_Reversed(record[self.key]), -next(self._seq), record))
+
+    def result(self):
+        top = [entry[-1] for entry in sorted(self.heap, reverse=True)]
+        missing = [entry[-1] for entry in sorted(self.missing, reverse=True)]
+        return top + missing[:self.k - len(top)]
+
+
+# pearson correlation from running co-moments; chunks are merged with
+# chan's pairwise update so the result does not drift on long streams
+class RunningCorr:
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = self.mean_y = 0.0
+        self.sxx = self.syy = self.sxy = 0.0
+
+    def add(self, x, y):
+        both = x.notna() & y.notna()
+        x = x[both].to_numpy(dtype="float64")
+        y = y[both].to_numpy(dtype="float64")
+        n = len(x)
+        if not n:
+            return
+        mean_x, mean_y = x.mean(), y.mean()
+        dx, dy = x - mean_x, y - mean_y
+        total = self.n + n
+        delta_x, delta_y = mean_x - self.mean_x, mean_y - self.mean_y
+        weight = self.n * n / total
+        self.sxx += dx @ dx + delta_x * delta_x * weight
+        self.syy += dy @ dy + delta_y * delta_y * weight
+        self.sxy += dx @ dy + delta_x * delta_y * weight
+        self.mean_x += delta_x * n / total
+        self.mean_y += delta_y * n / total
+        self.n = total
+
+    def result(self):
+        if self.n < 2 or self.sxx <= 0 or self.syy <= 0:
+            return float("nan")
+        return self.sxy / math.sqrt(self.sxx * self.syy)
+
+
+# a uniform sample of rows: every row gets a random key and the `size`
+# smallest keys are kept across chunks
+class Sample:
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.rows = None
+
+    def add(self, frame):
+        frame = frame.assign(_key=self.rng.random(len(frame)))
+        if self.rows is not None:
+            frame = pd.concat([self.rows, frame])
+        self.rows = frame.nsmallest(self.size, "_key") if len(frame) > self.size else frame
+
+    def result(self):
+        if self.rows is None:
+            return pd.DataFrame()
+        return self.rows.sort_index().drop(columns="_key").reset_index(drop=True)
+
+
+def _empty(**dtypes):
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+
+
+def _mean(total, count):
+    return total / count if count else float("nan")
+
+
+# same keys as compute_insights. returns the insights and a sample of
+# (prep_time, rating) points for the charts. with `sketch_size`,
+# most_common_ingredients comes from a HeavyHitters summary of that many
+# counters instead of an exact count per name. `rows`, when given, is
+# filled with the number of rows read per table
+def compute_insights_chunked(chunksize=DEFAULT_CHUNKSIZE, fmt="csv", sketch_size=None,
+                             sample_points=SAMPLE_POINTS, rows=None):
+    rows = {} if rows is None else rows
+
+    def chunks(table):
+        rows[table] = 0
+        for chunk in read_chunks(table, chunksize, fmt):
+            rows[table] += len(chunk)
+            yield chunk
+
+    stats = RunningSums(_empty(rating_sum="float64", rating_count="int64",
+                               interactions="int64", comments="int64"))
+    for chunk in chunks("interactions"):
+        coerce(interactions=chunk)
+        rated = chunk["rating"].notna()
+        cooknote = chunk["cooknote"]
+        commented = cooknote.notnull() & (cooknote.astype(str).str.strip() != "")
+        stats.add(pd.DataFrame({
+            "recipe_id": chunk["recipe_id"],
+            "rating_sum": chunk["rating"].where(rated, 0.0),
+            "rating_count": rated.astype("int64"),
+            "interactions": 1,
+            "comments": commented.astype("int64"),
+        }).groupby("recipe_id").sum())
+    stats = stats.result()
+    ratings = stats[["rating_sum", "rating_count"]]
+
+    steps = RunningSums(pd.Series(dtype="int64"))
+    for chunk in chunks("steps"):
+        steps.add(chunk["recipe_id"].value_counts())
+    steps = steps.result()
+
+    names = RunningSums(pd.Series(dtype="int64")) if sketch_size is None else HeavyHitters(sketch_size)
+    ing_ratings = RunningSums(_empty(rating_sum="float64", rating_count="int64"))
+    for chunk in chunks("ingredients"):
+        names.add(chunk["name"].value_counts() if sketch_size is None else chunk["name"])
+        joined = chunk.join(ratings, on="recipe_id")
+        ing_ratings.add(joined.groupby("name")[["rating_sum", "rating_count"]].sum())
+    ing_ratings = ing_ratings.result()
+
+    prep = cook = 0.0
+    prep_n = cook_n = 0
+    difficulty = RunningSums(pd.Series(dtype="int64"))
+    corr = RunningCorr()
+    top_rated = TopK(10, "rating", ["recipe_id", "title", "rating"])
+    longest = TopK(10, "total_time", ["recipe_id", "title", "total_time"])
+    sample = Sample(sample_points)
+    for chunk in chunks("recipe"):
+        coerce(recipes=chunk)
+        chunk = with_rating(chunk, ratings)
+        prep += chunk["prep_time"].sum()
+        prep_n += int(chunk["prep_time"].count())
+        cook += chunk["cook_time"].sum()
+        cook_n += int(chunk["cook_time"].count())
+        difficulty.add(chunk["difficulty"].value_counts())
+        corr.add(chunk["prep_time"], chunk["rating"])
+        top_rated.add(chunk)
+        longest.add(chunk)
+        sample.add(chunk[["prep_time", "rating"]])
+
+    out = {}
+    counts = names.result() if sketch_size is None else names.counts
+    out["most_common_ingredients"] = top_values(counts, 20)
+    out["avg_prep_time"] = _mean(prep, prep_n)
+    out["avg_cook_time"] = _mean(cook, cook_n)
+    out["difficulty_distribution"] = top_values(difficulty.result())
+    out["most_interacted"] = top_values(stats["interactions"], 20)
+    out["prep_vs_rating_corr"] = corr.result()
+
+    rated = ing_ratings[ing_ratings["rating_count"] > 0]
+    out["ingredients_high_rating"] = top_values(rated["rating_sum"] / rated["rating_count"], 20)
+
+    out["top_rated_recipes"] = top_rated.result()
+    out["steps_count_distribution"] = steps.astype("int64").describe().to_dict()
+    comments = stats["comments"]
+    out["recipes_most_comments"] = top_values(comments[comments > 0], 10)
+    out["longest_total_time"] = longest.result()
+
+    if sketch_size is not None:
+        print(f"most_common_ingredients counts are approximate "
+              f"(each at most {names.error_bound()} below the true count)")
+    return out, sample.result()
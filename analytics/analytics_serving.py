@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics_state import RECIPE_COLUMNS, STAT_COLUMNS, rating_stats
+from pipeline_io import read_json, write_json_atomic
+
+
+# a local http/json service over the analytics outputs. analytics.py
+# --publish (or run_pipeline.py --publish) writes a snapshot: the insights
+# plus per recipe and per ingredient stats, in a fresh version directory
+# under SERVING_DIR, and only then points current.json at it. the server
+# loads the snapshot named by current.json into memory, with the recipes
+# presorted by rating, and answers from there; parameterized answers are
+# kept in an lru cache per snapshot. a watcher thread polls current.json
+# and swaps in a new snapshot with a single reference assignment, so a
+# request sees either the old snapshot or the new one, never a mix, and
+# the server keeps answering while the new one loads.
+
+SERVING_DIR = "analytics/serving"
+CURRENT_FILE = "current.json"
+KEEP_VERSIONS = 2
+CACHE_SIZE = 1024
+MAX_K = 1000
+POLL_INTERVAL = 1.0
+
+
+# per recipe: the recipe columns, rating sum/count, interactions, comments
+# and steps; per ingredient name: rows and the rating sum/count of the
+# (ingredient row, interaction) pairs on the same recipe. the same shapes
+# AnalyticsState keeps, computed straight from the tables
+def serving_frames(recipes, ingredients, steps, interactions):
+    ratings = rating_stats(interactions)
+    cooknote = interactions["cooknote"]
+    commented = cooknote.notnull() & (cooknote.astype(str).str.strip() != "")
+    stats = pd.DataFrame({
+        "rating_sum": ratings["rating_sum"],
+        "rating_count": ratings["rating_count"],
+        "interactions": interactions.groupby("recipe_id").size(),
+        "comments": commented.groupby(interactions["recipe_id"]).sum(),
+        "steps": steps.groupby("recipe_id").size(),
+    })
+    recipe_rows = recipes.drop_duplicates("recipe_id", keep="last").set_index("recipe_id")[RECIPE_COLUMNS]
+
+    ing = ingredients[["recipe_id", "name"]].dropna(subset=["name"]).join(ratings, on="recipe_id")
+    names = pd.DataFrame({
+        "rows": ing.groupby("name").size(),
+        "w_sum": ing.groupby("name")["rating_sum"].sum(),
+        "w_count": ing.groupby("name")["rating_count"].sum(),
+    })
+    return _recipe_frame(recipe_rows, stats), _names_frame(names)
+
+
+# the same frames from a persisted AnalyticsState (analytics.py --incremental)
+def serving_frames_from_state(state):
+    return _recipe_frame(state.recipes, state.stats), _names_frame(state.names)
+
+
+# both frames come out in key order with fixed columns, whichever path built them
+def _recipe_frame(recipe_rows, stats):
+    stats = stats.reindex(recipe_rows.index)[STAT_COLUMNS].fillna(0)
+    frame = recipe_rows.join(stats).astype({c: "int64" for c in STAT_COLUMNS if c != "rating_sum"})
+    frame.index.name = "recipe_id"
+    return frame.sort_index().reset_index()
+
+
+def _names_frame(names):
+    names = names[["rows", "w_sum", "w_count"]].fillna(0).astype({"rows": "int64", "w_count": "int64"})
+    names.index.name = "name"
+    return names.sort_index().reset_index()
+
+
+def _frames_hash(*frames):
+    h = hashlib.blake2b(digest_size=8)
+    for frame in frames:
+        h.update(",".join(frame.columns).encode())
+        h.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+# write a snapshot and make it current. the version is a hash of its
+# contents, so publishing unchanged outputs is a no-op. older versions past
+# the last KEEP_VERSIONS are removed
+def publish(out, recipes, names, serving_dir=SERVING_DIR):
+    summary = json.dumps(_clean(out), default=str)
+    version = hashlib.blake2b(summary.encode(), digest_size=8).hexdigest() + _frames_hash(recipes, names)
+    current_path = os.path.join(serving_dir, CURRENT_FILE)
+    current = read_json(current_path) or {}
+    if current.get("version") == version:
+        print(f"Serving snapshot {version} is already current")
+        return version
+
+    version_dir = os.path.join(serving_dir, version)
+    tmp = version_dir + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, "summary.json"), "w", encoding="utf-8") as f:
+        f.write(summary)
+    recipes.to_parquet(os.path.join(tmp, "recipes.parquet"), index=False)
+    names.to_parquet(os.path.join(tmp, "ingredients.parquet"), index=False)
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.replace(tmp, version_dir)
+
+    history = [v for v in current.get("history", []) if v != version] + [version]
+    write_json_atomic(current_path, {
+        "version": version,
+        "published_at": datetime.now(timezone.utc).isoformat(),
+        "history": history[-KEEP_VERSIONS:],
+    })
+    for old in history[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(serving_dir, old), ignore_errors=True)
+    print(f"Published serving snapshot {version} to {serving_dir}/")
+    return version
+
+
+# NaN / inf become null, so every answer is strict json
+def _clean(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {str(k): _clean(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(v) for v in value]
+    if hasattr(value, "item"):
+        return _clean(value.item())
+    return value
+
+
+def _records(frame):
+    return _clean(frame.to_dict(orient="records"))
+
+
+class QueryError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _k(value, default):
+    if value is None:
+        return default
+    try:
+        k = int(value)
+    except ValueError:
+        raise QueryError(400, f"k must be an integer, got {value!r}") from None
+    if not 1 <= k <= MAX_K:
+        raise QueryError(400, f"k must be between 1 and {MAX_K}")
+    return k
+
+
+# one published snapshot, held in memory with the orderings the queries
+# need precomputed. answers are json bytes, memoized per snapshot
+class Snapshot:
+
+    RECIPE_FIELDS = ["recipe_id", "title", "difficulty", "rating", "rating_count"]
+
+    def __init__(self, version, summary, recipes, names, cache_size=CACHE_SIZE):
+        self.version = version
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        recipes = recipes.assign(rating=(recipes["rating_sum"] / recipes["rating_count"])
+                                 .where(recipes["rating_count"] > 0))
+        self.by_rating = recipes.sort_values(["rating", "recipe_id"], ascending=[False, True],
+                                             na_position="last", kind="mergesort")
+        # groupby keeps the rating order inside every difficulty
+        self.by_difficulty = {d: g for d, g in self.by_rating.groupby("difficulty", sort=False)}
+        self.recipes = recipes.set_index("recipe_id")
+        names = names.assign(score=(names["w_sum"] / names["w_count"]).where(names["w_count"] > 0))
+        self.by_count = names.sort_values(["rows", "name"], ascending=[False, True], kind="mergesort")
+        self.by_score = (names[names["w_count"] > 0]
+                         .sort_values(["score", "name"], ascending=[False, True], kind="mergesort"))
+        self.summary = json.dumps(_clean(summary)).encode()
+        self.difficulty = json.dumps(_clean(summary.get("difficulty_distribution", {}))).encode()
+        self.query = lru_cache(maxsize=cache_size)(self._query)
+
+    @classmethod
+    def load(cls, serving_dir=SERVING_DIR, version=None, cache_size=CACHE_SIZE):
+        version = version or (read_json(os.path.join(serving_dir, CURRENT_FILE)) or {}).get("version")
+        if version is None:
+            return None
+        version_dir = os.path.join(serving_dir, version)
+        with open(os.path.join(version_dir, "summary.json"), "r", encoding="utf-8") as f:
+            summary = json.load(f)
+        return cls(version, summary,
+                   pd.read_parquet(os.path.join(version_dir, "recipes.parquet")),
+                   pd.read_parquet(os.path.join(version_dir, "ingredients.parquet")),
+                   cache_size)
+
+    def top_rated(self, k=10, difficulty=None):
+        frame = self.by_rating if difficulty is None else self.by_difficulty.get(difficulty, self.by_rating[:0])
+        return _records(frame.head(k)[self.RECIPE_FIELDS])
+
+    def ingredients(self, k=20, order="count"):
+        if order == "count":
+            return _records(self.by_count.head(k)[["name", "rows"]].rename(columns={"rows": "count"}))
+        if order == "rating":
+            return _records(self.by_score.head(k)[["name", "score", "w_count"]]
+                            .rename(columns={"score": "rating", "w_count": "ratings"}))
+        raise QueryError(400, f"order must be count or rating, got {order!r}")
+
+    def recipe(self, recipe_id):
+        if recipe_id not in self.recipes.index:
+            raise QueryError(404, f"no recipe {recipe_id!r}")
+        row = self.recipes.loc[recipe_id]
+        return _clean({"recipe_id": recipe_id, **row.drop("rating_sum").to_dict()})
+
+    # (route, normalized params) -> json bytes; the lru cache sits on this
+    def _query(self, route, *params):
+        if route == "top-rated":
+            return json.dumps(self.top_rated(*params)).encode()
+        if route == "ingredients":
+            return json.dumps(self.ingredients(*params)).encode()
+        return json.dumps(self.recipe(*params)).encode()
+
+    def answer(self, path, query):
+        parts = [unquote(p) for p in path.strip("/").split("/") if p]
+        route = parts[0] if parts else ""
+        if route == "summary" and len(parts) == 1:
+            return self.summary
+        if route == "difficulty" and len(parts) == 1:
+            return self.difficulty
+        if route == "top-rated" and len(parts) == 1:
+            return self.query(route, _k(query.get("k"), 10), query.get("difficulty"))
+        if route == "ingredients" and len(parts) == 1:
+            return self.query(route, _k(query.get("k"), 20), query.get("order", "count"))
+        if route == "recipes" and len(parts) == 2:
+            return self.query(route, parts[1])
+        raise QueryError(404, f"unknown path {path!r}")
+
+
+# holds the current snapshot; refresh() loads a newer one beside it and
+# swaps the reference, so readers never wait on a load
+class SnapshotStore:
+
+    def __init__(self, serving_dir=SERVING_DIR, cache_size=CACHE_SIZE):
+        self.serving_dir = serving_dir
+        self.cache_size = cache_size
+        self.snapshot = None
+        self.swaps = 0
+        self._reload = threading.Lock()
+
+    def refresh(self):
+        with self._reload:
+            current = read_json(os.path.join(self.serving_dir, CURRENT_FILE)) or {}
+            version = current.get("version")
+            if version is None or (self.snapshot is not None and self.snapshot.version == version):
+                return False
+            start = time.perf_counter()
+            self.snapshot = Snapshot.load(self.serving_dir, version, self.cache_size)
+            self.swaps += 1
+            print(f"Serving snapshot {version} (loaded in {time.perf_counter() - start:.2f}s)")
+            return True
+
+    # poll current.json until `stop` is set; a snapshot that fails to load
+    # is logged and the previous one keeps serving
+    def watch(self, stop, interval=POLL_INTERVAL):
+        while not stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Could not load the new serving snapshot: {e}", file=sys.stderr)
+
+
+class ServingHandler(BaseHTTPRequestHandler):
+
+    # keep-alive; headers and body go out as separate writes, so nagle
+    # would hold the body back for the client's delayed ack
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    store = None
+    access_log = False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        snapshot = self.store.snapshot
+        if url.path.rstrip("/") == "/health":
+            status, body = 200, json.dumps({
+                "status": "ok" if snapshot is not None else "empty",
+                "version": snapshot.version if snapshot else None,
+                "loaded_at": snapshot.loaded_at if snapshot else None,
+                "swaps": self.store.swaps,
+                "cache": snapshot.query.cache_info()._asdict() if snapshot else None,
+            }).encode()
+        elif snapshot is None:
+            status, body = 503, json.dumps({"error": "nothing published yet"}).encode()
+        else:
+            try:
+                status, body = 200, snapshot.answer(url.path, query)
+            except QueryError as e:
+                status, body = e.status, json.dumps({"error": str(e)}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if snapshot is not None:
+            self.send_header("X-Snapshot-Version", snapshot.version)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.access_log:
+            super().log_message(format, *args)
+
+
+def serve(host="127.0.0.1", port=8080, serving_dir=SERVING_DIR, cache_size=CACHE_SIZE,
+          poll_interval=POLL_INTERVAL, access_log=False):
+    store = SnapshotStore(serving_dir, cache_size)
+    store.refresh()
+    handler = type("Handler", (ServingHandler,), {"store": store, "access_log": access_log})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    stop = threading.Event()
+    watcher = threading.Thread(target=store.watch, args=(stop, poll_interval), daemon=True)
+    watcher.start()
+    print(f"Serving {serving_dir}/ on http://{host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the published analytics snapshot over http/json")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--serving-dir", default=SERVING_DIR)
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE,
+                        help="parameterized answers kept per snapshot (lru)")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help="seconds between checks for a newly published snapshot")
+    parser.add_argument("--access-log", action="store_true", help="log every request to stderr")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.serving_dir, args.cache_size, args.poll_interval, args.access_log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import math
+import sqlite3
+
+import pandas as pd
+
+from data_load.load_to_sqlite import DB_PATH
+
+
+# the insights as sql over the database data_load/load_to_sqlite.py writes.
+# aggregation happens in sqlite, using its indexes on recipe_id and name;
+# only the per recipe step counts come back to pandas, for describe().
+# ties in the top lists are broken by key
+
+# per recipe rating sum / count, the basis of every average rating below
+RATINGS = """
+    WITH ratings AS (
+        SELECT recipe_id, SUM(rating) AS rating_sum, COUNT(rating) AS rating_count
+        FROM interactions WHERE recipe_id IS NOT NULL GROUP BY recipe_id
+    )
+"""
+
+RATED_RECIPES = RATINGS + """
+    , rated AS (
+        SELECT r.recipe_id, r.title, r.prep_time, r.total_time,
+               CASE WHEN g.rating_count > 0 THEN g.rating_sum / g.rating_count END AS rating
+        FROM recipes r LEFT JOIN ratings g ON g.recipe_id = r.recipe_id
+    )
+"""
+
+QUERIES = {
+    "most_common_ingredients": """
+        SELECT name, COUNT(*) AS n FROM ingredients WHERE name IS NOT NULL
+        GROUP BY name ORDER BY n DESC, name LIMIT 20
+    """,
+    "difficulty_distribution": """
+        SELECT difficulty, COUNT(*) AS n FROM recipes WHERE difficulty IS NOT NULL
+        GROUP BY difficulty ORDER BY n DESC, difficulty
+    """,
+    "most_interacted": """
+        SELECT recipe_id, COUNT(*) AS n FROM interactions WHERE recipe_id IS NOT NULL
+        GROUP BY recipe_id ORDER BY n DESC, recipe_id LIMIT 20
+    """,
+    # weighted over the per recipe sums instead of joining every interaction
+    "ingredients_high_rating": RATINGS + """
+        SELECT i.name, SUM(g.rating_sum) / SUM(g.rating_count) AS score
+        FROM ingredients i JOIN ratings g ON g.recipe_id = i.recipe_id
+        WHERE i.name IS NOT NULL
+        GROUP BY i.name HAVING SUM(g.rating_count) > 0
+        ORDER BY score DESC, i.name LIMIT 20
+    """,
+    "recipes_most_comments": """
+        SELECT recipe_id, COUNT(*) AS n FROM interactions
+        WHERE recipe_id IS NOT NULL AND TRIM(cooknote, ' ' || char(9, 10, 11, 12, 13)) != ''
+        GROUP BY recipe_id ORDER BY n DESC, recipe_id LIMIT 10
+    """,
+}
+
+AVERAGES = "SELECT AVG(prep_time), AVG(cook_time) FROM recipes"
+
+# co-moments around the means (two passes), which keeps the correlation
+# as accurate as pandas' corr
+CORRELATION = RATED_RECIPES + """
+    , points AS (
+        SELECT prep_time AS x, rating AS y FROM rated
+        WHERE prep_time IS NOT NULL AND rating IS NOT NULL
+    ), means AS (
+        SELECT COUNT(*) AS n, AVG(x) AS mx, AVG(y) AS my FROM points
+    )
+    SELECT n, SUM((x - mx) * (x - mx)), SUM((y - my) * (y - my)), SUM((x - mx) * (y - my))
+    FROM points, means
+"""
+
+TOP_RATED = RATED_RECIPES + """
+    SELECT recipe_id, title, rating FROM rated
+    ORDER BY rating IS NULL, rating DESC, recipe_id LIMIT 10
+"""
+
+LONGEST = """
+    SELECT recipe_id, title, total_time FROM recipes
+    ORDER BY total_time IS NULL, total_time DESC, recipe_id LIMIT 10
+"""
+
+# total_time is stored as REAL; load_csvs reads it as integers when every
+# value is a whole number, and so should the longest_total_time records
+WHOLE_TOTAL_TIMES = """
+    SELECT COUNT(*) = 0 FROM recipes
+    WHERE total_time IS NULL OR total_time != CAST(total_time AS INTEGER)
+"""
+
+POINTS = RATED_RECIPES + "SELECT prep_time, rating FROM rated ORDER BY recipe_id"
+
+STEP_COUNTS = "SELECT COUNT(*) FROM steps WHERE recipe_id IS NOT NULL GROUP BY recipe_id"
+
+
+def _nan(v):
+    return float("nan") if v is None else v
+
+
+def _pearson(n, sxx, syy, sxy):
+    if not n or n < 2 or not sxx or not syy:
+        return float("nan")
+    return sxy / math.sqrt(sxx * syy)
+
+
+# rows as dicts; the last column is the (nullable) metric
+def _records(cursor):
+    columns = [c[0] for c in cursor.description]
+    return [{**dict(zip(columns, row)), columns[-1]: _nan(row[-1])} for row in cursor]
+
+
+# same keys as compute_insights
+def compute_insights_sql(db_path=DB_PATH):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        out = {key: dict(conn.execute(sql).fetchall()) for key, sql in QUERIES.items()}
+        prep, cook = conn.execute(AVERAGES).fetchone()
+        steps = pd.Series([n for (n,) in conn.execute(STEP_COUNTS)], dtype="int64")
+        longest = _records(conn.execute(LONGEST))
+        if conn.execute(WHOLE_TOTAL_TIMES).fetchone()[0]:
+            longest = [dict(r, total_time=int(r["total_time"])) for r in longest]
+
+        return {
+            "most_common_ingredients": out["most_common_ingredients"],
+            "avg_prep_time": _nan(prep),
+            "avg_cook_time": _nan(cook),
+            "difficulty_distribution": out["difficulty_distribution"],
+            "most_interacted": out["most_interacted"],
+            "prep_vs_rating_corr": _pearson(*conn.execute(CORRELATION).fetchone()),
+            "ingredients_high_rating": out["ingredients_high_rating"],
+            "top_rated_recipes": _records(conn.execute(TOP_RATED)),
+            "steps_count_distribution": steps.describe().to_dict(),
+            "recipes_most_comments": out["recipes_most_comments"],
+            "longest_total_time": longest,
+        }
+    finally:
+        conn.close()
+
+
+# (prep_time, rating) per recipe, for the scatter chart
+def rated_points_sql(db_path=DB_PATH):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(POINTS, conn).astype("float64")
+    finally:
+        conn.close()
@@ -0,0 +1,247 @@
+import json
+import os
+import shutil
+
+import pandas as pd
+
+
+# mergeable partial aggregates behind the insights. a full rebuild and a run
+# that folds in data_transform/changes/ both go through AnalyticsState.apply,
+# and every metric is derived from the state the same way, so the two give
+# identical results. ties in the top-k lists are broken by key.
+
+STATE_DIR = "analytics/state"
+CHANGES_DIR = "data_transform/changes"
+
+RECIPE_COLUMNS = ["title", "prep_time", "cook_time", "total_time", "difficulty"]
+COUNT_COLUMNS = ["rating_count", "interactions", "comments", "steps"]
+STAT_COLUMNS = ["rating_sum"] + COUNT_COLUMNS
+
+# how each row of a change file moves the aggregates
+SIGNS = {"insert": 1, "update": 1, "delete": -1, "previous": -1}
+
+
+# the numeric parsing load_csvs applies
+def coerce(recipes=None, interactions=None):
+    if recipes is not None:
+        for col in ("prep_time", "cook_time", "total_time"):
+            recipes[col] = pd.to_numeric(recipes[col], errors="coerce")
+    if interactions is not None:
+        interactions["rating"] = pd.to_numeric(interactions["rating"], errors="coerce")
+
+
+# per recipe id: sum and count of the parsed ratings. everything that needs
+# a recipe's average rating starts from this instead of joining interactions
+def rating_stats(interactions):
+    return (interactions.groupby("recipe_id")["rating"].agg(["sum", "count"])
+            .rename(columns={"sum": "rating_sum", "count": "rating_count"}))
+
+
+# recipes (in their own order) with an average "rating" column from rating_stats
+def with_rating(recipes, stats):
+    stats = stats.reindex(recipes["recipe_id"])
+    rating = (stats["rating_sum"] / stats["rating_count"]).where(stats["rating_count"] > 0)
+    merged = recipes.copy()
+    merged["rating"] = rating.to_numpy()
+    return merged
+
+
+def _signs(df):
+    if "change" not in df:
+        return pd.Series(1, index=df.index, dtype="int64")
+    return df["change"].map(SIGNS).fillna(0).astype("int64")
+
+
+# largest values first, ties broken by key, as a plain dict
+def top_values(series, n=None):
+    frame = pd.DataFrame({"key": series.index, "value": series.to_numpy()})
+    frame = frame.sort_values(["value", "key"], ascending=[False, True], kind="mergesort")
+    if n is not None:
+        frame = frame.head(n)
+    return dict(zip(frame["key"].tolist(), frame["value"].tolist()))
+
+
+def _empty_index(name):
+    return pd.Index([], dtype=object, name=name)
+
+
+class AnalyticsState:
+
+    def __init__(self, recipes=None, stats=None, pairs=None, names=None, meta=None):
+        # one row per recipe: the recipe columns the insights read
+        self.recipes = recipes if recipes is not None else pd.DataFrame(
+            {c: pd.Series(dtype=object) for c in RECIPE_COLUMNS}, index=_empty_index("recipe_id"))
+        # per recipe id: rating sum/count, interactions, comments, steps
+        self.stats = stats if stats is not None else pd.DataFrame(
+            {c: pd.Series(dtype="float64" if c == "rating_sum" else "int64") for c in STAT_COLUMNS},
+            index=_empty_index("recipe_id"))
+        # how many ingredient rows of each name every recipe has
+        self.pairs = pairs if pairs is not None else pd.Series(
+            dtype="int64", name="count",
+            index=pd.MultiIndex.from_arrays([[], []], names=["recipe_id", "name"]))
+        # per ingredient name: row count and the rating sum/count of the
+        # (ingredient row, interaction) pairs on the same recipe
+        self.names = names if names is not None else pd.DataFrame(
+            {"rows": pd.Series(dtype="int64"), "w_sum": pd.Series(dtype="float64"),
+             "w_count": pd.Series(dtype="int64")}, index=_empty_index("name"))
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, recipes, ingredients, steps, interactions):
+        state = cls()
+        state.apply(recipes, ingredients, steps, interactions)
+        return state
+
+    # fold in a batch of rows. frames may carry a "change" column
+    # (insert / update / delete / previous, as written by transform --changes);
+    # without one every row is an insert
+    def apply(self, recipes=None, ingredients=None, steps=None, interactions=None):
+        d_stats = pd.DataFrame(columns=STAT_COLUMNS, dtype="float64")
+
+        if interactions is not None and len(interactions):
+            sign = _signs(interactions)
+            rated = interactions["rating"].notna()
+            cooknote = interactions["cooknote"]
+            commented = cooknote.notna() & (cooknote.astype(str).str.strip() != "")
+            d_stats = pd.DataFrame({
+                "recipe_id": interactions["recipe_id"],
+                "rating_sum": interactions["rating"].where(rated, 0.0) * sign,
+                "rating_count": rated.astype("int64") * sign,
+                "interactions": sign,
+                "comments": commented.astype("int64") * sign,
+            }).groupby("recipe_id").sum()
+
+        if steps is not None and len(steps):
+            d_steps = steps.assign(steps=_signs(steps)).groupby("recipe_id")["steps"].sum()
+            d_stats = d_stats.add(d_steps.to_frame(), fill_value=0)
+        d_stats = d_stats.reindex(columns=STAT_COLUMNS).fillna(0)
+
+        if ingredients is not None and len(ingredients):
+            # new ingredient rows pair with the ratings their recipe has so far
+            ing = ingredients.assign(sign=_signs(ingredients)).dropna(subset=["name"])
+            current = self.stats.reindex(ing["recipe_id"])
+            d_names = pd.DataFrame({
+                "name": ing["name"].to_numpy(),
+                "rows": ing["sign"].to_numpy(),
+                "w_sum": current["rating_sum"].fillna(0).to_numpy() * ing["sign"].to_numpy(),
+                "w_count": current["rating_count"].fillna(0).to_numpy() * ing["sign"].to_numpy(),
+            }).groupby("name").sum()
+            self.names = self.names.add(d_names, fill_value=0)
+            d_pairs = ing.groupby(["recipe_id", "name"])["sign"].sum()
+            self.pairs = self.pairs.add(d_pairs, fill_value=0)
+            self.pairs = self.pairs[self.pairs != 0].astype("int64").rename("count")
+
+        # rating changes reach every ingredient row of the recipe
+        d_rating = d_stats[["rating_sum", "rating_count"]]
+        d_rating = d_rating[(d_rating != 0).any(axis=1)]
+        if len(d_rating):
+            pairs = self.pairs[self.pairs.index.get_level_values("recipe_id").isin(d_rating.index)]
+            if len(pairs):
+                delta = d_rating.reindex(pairs.index.get_level_values("recipe_id"))
+                counts = pairs.to_numpy()
+                d_names = pd.DataFrame({
+                    "name": pairs.index.get_level_values("name"),
+                    "w_sum": delta["rating_sum"].to_numpy() * counts,
+                    "w_count": delta["rating_count"].to_numpy() * counts,
+                }).groupby("name").sum()
+                self.names = self.names.add(d_names, fill_value=0)
+
+        if len(d_stats):
+            stats = self.stats.add(d_stats, fill_value=0)[STAT_COLUMNS]
+            stats = stats[(stats[COUNT_COLUMNS] != 0).any(axis=1)]
+            self.stats = stats.astype({c: "int64" for c in COUNT_COLUMNS})
+        self.names = self.names[self.names["rows"] != 0].astype({"rows": "int64", "w_count": "int64"})
+
+        if recipes is not None and len(recipes):
+            change = recipes["change"] if "change" in recipes else pd.Series("insert", index=recipes.index)
+            gone = recipes.loc[change == "delete", "recipe_id"]
+            rows = (recipes[change.isin(["insert", "update"])]
+                    .drop_duplicates("recipe_id", keep="last")
+                    .set_index("recipe_id")[RECIPE_COLUMNS])
+            kept = self.recipes.drop(index=pd.Index(gone).append(rows.index), errors="ignore")
+            self.recipes = pd.concat([kept, rows]) if len(kept) else rows
+
+    # recipes with their average rating, in recipe id order
+    def merged(self):
+        return with_rating(self.recipes.sort_index().reset_index(), self.stats)
+
+    def derive(self):
+        merged = self.merged()
+        stats = self.stats.sort_index()
+        out = {}
+
+        out["most_common_ingredients"] = top_values(self.names["rows"], 20)
+        out["avg_prep_time"] = merged["prep_time"].mean()
+        out["avg_cook_time"] = merged["cook_time"].mean()
+        out["difficulty_distribution"] = top_values(merged["difficulty"].value_counts())
+        out["most_interacted"] = top_values(stats["interactions"][stats["interactions"] > 0], 20)
+        out["prep_vs_rating_corr"] = merged["prep_time"].corr(merged["rating"])
+
+        names = self.names[self.names["w_count"] > 0]
+        out["ingredients_high_rating"] = top_values(names["w_sum"] / names["w_count"], 20)
+
+        out["top_rated_recipes"] = (
+            merged.sort_values(["rating", "recipe_id"], ascending=[False, True], na_position="last")
+            .head(10)[["recipe_id", "title", "rating"]]
+            .to_dict(orient="records")
+        )
+
+        steps = stats["steps"][stats["steps"] > 0]
+        out["steps_count_distribution"] = steps.describe().to_dict()
+        out["recipes_most_comments"] = top_values(stats["comments"][stats["comments"] > 0], 10)
+        out["longest_total_time"] = (
+            merged[["recipe_id", "title", "total_time"]]
+            .sort_values(["total_time", "recipe_id"], ascending=[False, True], na_position="last")
+            .head(10)
+            .to_dict(orient="records")
+        )
+        return out
+
+    # written to a fresh directory that replaces the old one, so a crash
+    # never leaves half of a state behind
+    def save(self, state_dir=STATE_DIR):
+        tmp = state_dir + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        self.recipes.reset_index().to_parquet(os.path.join(tmp, "recipes.parquet"), index=False)
+        self.stats.reset_index().to_parquet(os.path.join(tmp, "stats.parquet"), index=False)
+        self.pairs.reset_index().to_parquet(os.path.join(tmp, "pairs.parquet"), index=False)
+        self.names.reset_index().to_parquet(os.path.join(tmp, "names.parquet"), index=False)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+
+        old = state_dir + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(state_dir):
+            os.replace(state_dir, old)
+        os.replace(tmp, state_dir)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, state_dir=STATE_DIR):
+        if not os.path.exists(os.path.join(state_dir, "meta.json")):
+            return None
+        with open(os.path.join(state_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        def read(name, index):
+            return pd.read_parquet(os.path.join(state_dir, f"{name}.parquet")).set_index(index)
+
+        return cls(
+            recipes=read("recipes", "recipe_id"),
+            stats=read("stats", "recipe_id"),
+            pairs=read("pairs", ["recipe_id", "name"])["count"],
+            names=read("names", "name"),
+            meta=meta,
+        )
+
+
+# data_transform/changes/<table>.csv as frames, in the order apply() takes them
+def read_changes(changes_dir=CHANGES_DIR):
+    tables = []
+    for table in ("recipe.csv", "ingredients.csv", "steps.csv", "interactions.csv"):
+        path = os.path.join(changes_dir, table)
+        tables.append(pd.read_csv(path) if os.path.exists(path) else None)
+    recipes, ingredients, steps, interactions = tables
+    coerce(recipes, interactions)
+    return recipes, ingredients, steps, interactions
@@ -0,0 +1,126 @@
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+
+# drives the analytics serving layer (analytics/analytics_serving.py) from
+# a few client threads over keep-alive connections, with a mix of cached
+# summary reads and parameterized queries, and prints throughput, latency
+# percentiles, errors and the snapshot versions seen. publishing a new
+# snapshot while it runs shows the hot swap: the versions change and the
+# error count stays at zero
+
+DIFFICULTIES = [None, "Easy", "Medium", "Hard"]
+
+
+def get(conn, path):
+    conn.request("GET", path)
+    response = conn.getresponse()
+    body = response.read()
+    return response.status, response.getheader("X-Snapshot-Version"), body
+
+
+def request_mix(rng, recipe_ids, max_k):
+    roll = rng.random()
+    if roll < 0.35:
+        difficulty = rng.choice(DIFFICULTIES)
+        path = f"/top-rated?k={rng.randint(1, max_k)}"
+        return path + (f"&difficulty={difficulty}" if difficulty else "")
+    if roll < 0.6:
+        return f"/ingredients?k={rng.randint(1, max_k)}&order={rng.choice(['count', 'rating'])}"
+    if roll < 0.85 and recipe_ids:
+        return f"/recipes/{quote(rng.choice(recipe_ids), safe='')}"
+    return rng.choice(["/summary", "/difficulty"])
+
+
+def client(host, port, deadline, seed, recipe_ids, max_k, latencies, errors, versions, lock):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    mine, failed, seen = [], 0, {}
+    while time.perf_counter() < deadline:
+        path = request_mix(rng, recipe_ids, max_k)
+        start = time.perf_counter()
+        try:
+            status, version, _ = get(conn, path)
+        except (OSError, http.client.HTTPException):
+            failed += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            continue
+        mine.append(time.perf_counter() - start)
+        if status != 200:
+            failed += 1
+        seen[version] = seen.get(version, 0) + 1
+    conn.close()
+    with lock:
+        latencies.extend(mine)
+        errors.append(failed)
+        for version, n in seen.items():
+            versions[version] = versions.get(version, 0) + n
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run(url, threads=8, duration=10.0, max_k=100, seed=0):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    status, _, body = get(conn, f"/top-rated?k={min(1000, max_k * 10)}")
+    conn.close()
+    if status != 200:
+        raise SystemExit(f"{url} answered {status}: {body.decode()}")
+    recipe_ids = [r["recipe_id"] for r in json.loads(body)]
+
+    latencies, errors, versions, lock = [], [], {}, threading.Lock()
+    deadline = time.perf_counter() + duration
+    workers = [threading.Thread(target=client, args=(host, port, deadline, seed + i, recipe_ids, max_k,
+                                                     latencies, errors, versions, lock))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    report = {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "requests_per_sec": len(latencies) / elapsed if elapsed > 0 else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "versions": versions,
+    }
+    print(f"{report['requests']} requests in {elapsed:.1f}s on {threads} threads: "
+          f"{report['requests_per_sec']:.0f} req/s, p50 {report['p50_ms']:.2f} ms, "
+          f"p95 {report['p95_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms, {report['errors']} errors")
+    print("Snapshot versions seen:", ", ".join(f"{v} ({n})" for v, n in versions.items()))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the analytics serving layer")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--max-k", type=int, default=100,
+                        help="k is drawn from 1..max-k, which sets how many distinct queries there are")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    report = run(args.url, args.threads, args.duration, args.max_k, args.seed)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
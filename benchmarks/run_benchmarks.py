@@ -0,0 +1,245 @@
+import argparse
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Firebase_Setup", "synthetic_data_generation"))
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from pipeline_io import read_json, write_json_atomic
+from pipeline_metrics import peak_rss_bytes
+
+
+# times transform, validator and analytics on seeded synthetic data at one or
+# more scales. each step runs in a fresh process so its peak rss is its own.
+# results are written as json; a saved baseline can be compared against later
+
+WORK_DIR = os.path.join("benchmarks", ".work")
+BASELINE_DIR = os.path.join("benchmarks", "baselines")
+RESULTS_PATH = os.path.join("benchmarks", "results", "latest.json")
+STEPS = ["transform", "validate", "analytics"]
+# steps that only run when asked for with --steps
+EXTRA_STEPS = ["analytics_chunked", "codecs"]
+# (label, compression, json indent) per artifact encoding the codecs step compares
+CODECS = [("indented", None, 2), ("compact", None, None), ("gzip", "gzip", None), ("zstd", "zstd", None)]
+
+
+def extract_path(name):
+    ndjson = os.path.join("data_extract", f"{name}.ndjson")
+    return ndjson if os.path.exists(ndjson) else os.path.join("data_extract", f"{name}.json")
+
+
+def run_transform():
+    from data_transform import transform_to_csv
+    counts = transform_to_csv.transform(extract_path("recipes"), extract_path("interactions"))
+    return counts["recipe_docs"] + counts["interaction_docs"]
+
+
+def run_validate():
+    from data_validation import validator
+    report = validator.validate_recipes()
+    return report["summary"]["total_recipes"]
+
+
+def run_analytics():
+    from analytics import analytics
+    tables = analytics.load_csvs()
+    recipes, ingredients, steps, interactions = tables
+    out = analytics.compute_insights(*tables)
+    analytics.save_insights(out)
+    analytics.generate_charts(recipes, ingredients, interactions, out)
+    return sum(len(table) for table in tables)
+
+
+def run_analytics_chunked():
+    from analytics import analytics
+    rows = {}
+    out, points = analytics.compute_insights_chunked(rows=rows)
+    analytics.save_insights(out)
+    analytics.generate_charts(None, None, None, out, merged=points)
+    return sum(rows.values())
+
+
+def _size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+# rewrite the extracts in every encoding of CODECS under codecs/<label>/,
+# then time reading them back, transforming them into csvs of the same codec
+# and loading those csvs. sizes are bytes on disk; the rewrite time includes
+# parsing the source extracts, which is the same for every encoding
+def run_codecs():
+    from analytics import analytics
+    from data_transform import transform_to_csv
+    from pipeline_io import CODEC_EXTENSIONS, JsonStreamWriter, iter_json_docs
+
+    sources = {name: os.path.abspath(extract_path(name)) for name in ("recipes", "interactions")}
+    root = os.getcwd()
+    codecs, rows = {}, 0
+    for label, compression, indent in CODECS:
+        work_dir = os.path.join(root, "codecs", label)
+        os.makedirs(work_dir, exist_ok=True)
+        os.chdir(work_dir)
+        ext = CODEC_EXTENSIONS.get(compression, "")
+        extracts = {name: os.path.join("data_extract", f"{name}.json{ext}") for name in sources}
+        tables = [os.path.join("data_transform", table + ext) for table in transform_to_csv.TABLES]
+        result = {}
+
+        start = time.perf_counter()
+        for name, source in sources.items():
+            with JsonStreamWriter(extracts[name], label=name, report_every=0, indent=indent) as writer:
+                for doc in iter_json_docs(source):
+                    writer.write(doc)
+        result["extract_rewrite_seconds"] = time.perf_counter() - start
+        result["extract_bytes"] = _size(extracts.values())
+
+        start = time.perf_counter()
+        docs = sum(1 for path in extracts.values() for _ in iter_json_docs(path))
+        result["extract_read_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        transform_to_csv.transform(extracts["recipes"], extracts["interactions"], compression=compression)
+        result["transform_seconds"] = time.perf_counter() - start
+        result["csv_bytes"] = _size(tables)
+
+        start = time.perf_counter()
+        rows += sum(len(table) for table in analytics.load_csvs())
+        result["load_csvs_seconds"] = time.perf_counter() - start
+
+        codecs[label] = result
+        rows += docs
+    os.chdir(root)
+    return rows, {"codecs": codecs}
+
+
+STEP_FUNCS = {"transform": run_transform, "validate": run_validate, "analytics": run_analytics,
+              "analytics_chunked": run_analytics_chunked, "codecs": run_codecs}
+
+
+# runs in the child process, inside the scale's work dir so every stage finds
+# its inputs at the usual relative paths. a step returns its row count, or the
+# row count and extra fields for its result
+def measure(step, work_dir):
+    os.chdir(work_dir)
+    wall, cpu = time.perf_counter(), time.process_time()
+    rows = STEP_FUNCS[step]()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    rows, details = rows if isinstance(rows, tuple) else (rows, {})
+    return {
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "rows": rows,
+        "rows_per_sec": rows / wall if wall > 0 else None,
+        "peak_rss_bytes": peak_rss_bytes(),
+        **details,
+    }
+
+
+def prepare(scale, seed, fmt):
+    from synthetic_dataset import SyntheticDataset
+
+    work_dir = os.path.join(WORK_DIR, f"{scale}-seed{seed}-{fmt}")
+    marker = os.path.join(work_dir, "dataset.json")
+    # generated data is deterministic, so it is reused across runs
+    if read_json(marker) != {"scale": scale, "seed": seed, "format": fmt}:
+        print(f"Generating {scale} recipes (seed {seed})...")
+        SyntheticDataset(scale, seed=seed).write(os.path.join(work_dir, "data_extract"), fmt)
+        write_json_atomic(marker, {"scale": scale, "seed": seed, "format": fmt})
+    return os.path.abspath(work_dir)
+
+
+def run(scales, seed=0, steps=STEPS, fmt="json"):
+    results = []
+    for scale in scales:
+        work_dir = prepare(scale, seed, fmt)
+        for step in steps:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(measure, step, work_dir).result()
+            result = {"scale": scale, "step": step, **result}
+            results.append(result)
+            print(f"[{scale}] {step}: {result['wall_seconds']:.2f}s, "
+                  f"{result['rows_per_sec'] or 0:.0f} rows/sec, "
+                  f"peak rss {(result['peak_rss_bytes'] or 0) / (1024 * 1024):.0f} MB")
+            for label, codec in result.get("codecs", {}).items():
+                print(f"    {label:>8}: extract {codec['extract_bytes'] / (1024 * 1024):.1f} MB, "
+                      f"read {codec['extract_read_seconds']:.2f}s; "
+                      f"csv {codec['csv_bytes'] / (1024 * 1024):.1f} MB, "
+                      f"transform {codec['transform_seconds']:.2f}s, "
+                      f"load {codec['load_csvs_seconds']:.2f}s")
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+# compare wall time and peak rss per (scale, step); a step counts as a
+# regression when it got slower or bigger by more than `tolerance`
+def compare(current, baseline, tolerance=0.2):
+    base = {(r["scale"], r["step"]): r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        old = base.get((r["scale"], r["step"]))
+        if old is None:
+            continue
+        for metric in ("wall_seconds", "peak_rss_bytes"):
+            if not old.get(metric) or r.get(metric) is None:
+                continue
+            ratio = r[metric] / old[metric]
+            flag = "REGRESSION" if ratio > 1 + tolerance else ""
+            print(f"[{r['scale']}] {r['step']} {metric}: {old[metric]:.6g} -> {r[metric]:.6g} "
+                  f"({ratio:.2f}x) {flag}")
+            if flag:
+                regressions.append((r["scale"], r["step"], metric, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark transform, validator and analytics on synthetic data")
+    parser.add_argument("--scales", nargs="+", type=float, default=[1e4],
+                        help="number of recipes per run, e.g. 1e4 1e5 1e6")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--steps", nargs="+", choices=STEPS + EXTRA_STEPS, default=STEPS)
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                        help="layout of the generated extracts")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--save-baseline", metavar="NAME",
+                        help="also store the results as benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME",
+                        help="compare against benchmarks/baselines/NAME.json, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown or memory growth before a step is flagged (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    report = run([int(s) for s in args.scales], args.seed, args.steps, args.format)
+    write_json_atomic(args.output, report)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        write_json_atomic(path, report)
+        print(f"Baseline saved to {path}")
+
+    if args.compare:
+        baseline = read_json(os.path.join(BASELINE_DIR, f"{args.compare}.json"))
+        if baseline is None:
+            parser.error(f"no baseline named {args.compare}")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against baseline {args.compare}")
+            return 1
+        print(f"No regressions against baseline {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
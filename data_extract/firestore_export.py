@@ -1,12 +1,43 @@
-import json
+import argparse
+import shutil
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from google.cloud.firestore_v1 import DocumentSnapshot
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
+from google.cloud import firestore as gcloud_firestore
 import os
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_io import (CODEC_EXTENSIONS, JsonStreamWriter, find_artifact, iter_json_docs, read_json,
+                         write_json_atomic)
+
+
+STATE_PATH = "data_extract/export_state.json"
+SHARD_DIR = "data_extract/.shards"
+
+# firestore auto ids use these characters; listed in the order firestore sorts them
+AUTO_ID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+_state_lock = threading.Lock()
+
+# (output name, firestore collection, watermark field)
+# users are keyed on JoinedAt, so incremental runs only pick up new users;
+# activities added to existing users need a --full-refresh
+EXPORTS = [
+    ("recipes", "Recipe", "CreatedAt"),
+    ("interactions", "Interaction", "CreatedAt"),
+    ("users", "Users", "JoinedAt"),
+]
+
 
 def get_db():
+    # the firestore emulator does not need a service account
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        return gcloud_firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-etl"))
     if not firebase_admin._apps:
         cred_path = os.path.join("config", "projectKey.json")
         cred = credentials.Certificate(cred_path)
@@ -14,6 +45,17 @@ def get_db():
     return firestore.client()
 
 
+# same credentials as get_db, for the asyncio reader (stream_transform.py)
+def get_async_db():
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        return gcloud_firestore.AsyncClient(project=os.environ.get("GCLOUD_PROJECT", "demo-etl"))
+    if not firebase_admin._apps:
+        cred_path = os.path.join("config", "projectKey.json")
+        cred = credentials.Certificate(cred_path)
+        firebase_admin.initialize_app(cred)
+    return firestore_async.client()
+
+
 # convert documentsnapshot into json
 def doc_to_json(doc: DocumentSnapshot):
     data = doc.to_dict() or {}
@@ -25,56 +67,326 @@ def doc_to_json(doc: DocumentSnapshot):
     return data
 
 
-# export the recipe schema
-def export_recipes(output_path="data_extract/recipes.json"):
-    db = get_db()
-    recipes = []
+# user document together with its Activities subcollection
+# (one extra round trip per user, kept as the "nested" activities mode)
+def user_to_json(user_doc: DocumentSnapshot):
+    u = doc_to_json(user_doc)
+    activities = []
+    for act in user_doc.reference.collection("Activities").stream():
+        activities.append(doc_to_json(act))
+
+    u["Activities"] = activities
+    return u
+
+
+# every Activities document from one collection group query, tagged with
+# the id of the user document it lives under
+def iter_activities(db):
+    for act in db.collection_group("Activities").stream():
+        a = doc_to_json(act)
+        a["UserID"] = act.reference.parent.parent.id
+        yield a
+
+
+# activities grouped by user id, for joining back onto users in memory
+def load_activities(db):
+    by_user = defaultdict(list)
+    for a in iter_activities(db):
+        user_id = a.pop("UserID")
+        by_user[user_id].append(a)
+    return by_user
+
+
+# snapshot -> json converter for users, depending on how activities are read
+def user_converter(db, activities="bulk"):
+    if activities == "nested":
+        return user_to_json
+    if activities == "flat":
+        return doc_to_json
+
+    by_user = load_activities(db)
+
+    def convert(user_doc):
+        u = doc_to_json(user_doc)
+        u["Activities"] = by_user.get(user_doc.id, [])
+        return u
+
+    return convert
+
+
+def to_json_docs(collection, snapshots, convert=None):
+    if convert is None:
+        convert = user_to_json if collection == "Users" else doc_to_json
+    return (convert(doc) for doc in snapshots)
+
+
+# highest (watermark field, doc id) seen so far; the doc id breaks ties
+# between documents written in the same instant
+class Watermark:
+
+    def __init__(self, field, mark=None):
+        self.field = field
+        self.mark = mark
+        self._key = self._mark_key(mark) if mark else None
+
+    @staticmethod
+    def _mark_key(mark):
+        return datetime.fromisoformat(mark["value"]), mark["id"]
+
+    def newer(self, doc):
+        value = doc.get(self.field)
+        if not value:
+            return False
+        return self._key is None or (datetime.fromisoformat(value), doc["id"]) > self._key
 
-    for doc in db.collection("Recipe").stream():
-        recipe = doc_to_json(doc)
-        recipes.append(recipe)
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:     # write data into json file
-        json.dump(recipes, f, indent=2, ensure_ascii=False)
+    def update(self, doc):
+        if self.newer(doc):
+            value = doc[self.field]
+            self._key = datetime.fromisoformat(value), doc["id"]
+            self.mark = {"field": self.field, "value": value, "id": doc["id"]}
 
-    print("Exported recipes:", len(recipes))
+    def track(self, docs):
+        for doc in docs:
+            self.update(doc)
+            yield doc
+
+
+# documents newer than the saved mark, ordered by (field, doc id);
+# documents without the watermark field never match an order_by query
+def query_since(db, collection, field, mark):
+    query = db.collection(collection).order_by(field).order_by("__name__")
+    if mark:
+        query = query.start_after({
+            field: datetime.fromisoformat(mark["value"]),
+            "__name__": mark["id"],
+        })
+    return query.stream()
+
+
+# write the delta after the existing extract; docs already in the extract are
+# skipped so re-running after a crash between extract and state save is safe
+def merge_into_extract(new_docs, output_path, fmt=None, label="docs", indent=2):
+    existing_ids = set()
+    added = 0
+    with JsonStreamWriter(output_path, fmt=fmt, label=label, indent=indent) as writer:
+        if os.path.exists(output_path):
+            for doc in iter_json_docs(output_path):
+                existing_ids.add(doc.get("id"))
+                writer.write(doc)
+        for doc in new_docs:
+            if doc.get("id") in existing_ids:
+                continue
+            writer.write(doc)
+            added += 1
+    return added
+
+
+# write each document to disk as soon as it arrives instead of collecting a list
+def write_docs(docs, output_path, fmt=None, label="docs", indent=2):
+    with JsonStreamWriter(output_path, fmt=fmt, label=label, indent=indent) as writer:
+        for doc in docs:
+            writer.write(doc)
+    return writer.count
+
+
+# split the document id space into key ranges; auto ids are uniformly random,
+# so even splits over the first two characters give evenly sized shards.
+# the first and last ranges are open so ids outside the alphabet still land somewhere
+def shard_bounds(shards):
+    space = len(AUTO_ID_ALPHABET) ** 2
+    points = []
+    for i in range(1, shards):
+        k = i * space // shards
+        point = AUTO_ID_ALPHABET[k // len(AUTO_ID_ALPHABET)] + AUTO_ID_ALPHABET[k % len(AUTO_ID_ALPHABET)]
+        if point not in points:
+            points.append(point)
+    bounds = [None] + points + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# read one __name__ range into its own ndjson shard file
+def read_shard(db, collection, lo, hi, path, convert=None):
+    query = db.collection(collection).order_by("__name__")
+    if lo:
+        query = query.start_at({"__name__": lo})
+    if hi:
+        query = query.end_before({"__name__": hi})
+    with JsonStreamWriter(path, fmt="ndjson", report_every=0) as writer:
+        for doc in to_json_docs(collection, query.stream(), convert):
+            writer.write(doc)
+    return writer.count
+
+
+# read all shards of a collection on the shared pool, then yield their
+# documents in key-range order so the merged output is deterministic
+def iter_sharded(db, name, collection, shards, pool, convert=None):
+    shard_dir = os.path.join(SHARD_DIR, name)
+    paths = [os.path.join(shard_dir, f"part-{i:05d}.ndjson") for i in range(len(shards))]
+    futures = [pool.submit(read_shard, db, collection, lo, hi, path, convert)
+               for (lo, hi), path in zip(shards, paths)]
+    try:
+        for future in futures:
+            future.result()
+        for path in paths:
+            yield from iter_json_docs(path)
+    finally:
+        for future in futures:
+            future.cancel()
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        # the last collection to finish removes the shard root as well
+        try:
+            os.rmdir(SHARD_DIR)
+        except OSError:
+            pass
+
+
+# export one collection; with a state dict the watermark is read and updated.
+# with a pool and more than one shard, full exports read key ranges in parallel.
+# incremental exports stay on a single cursor, since the watermark query is
+# already ordered by the watermark field and only returns the delta
+def export_collection(name, collection, field, output_path, fmt=None,
+                      incremental=False, state=None, db=None, shards=1, pool=None, convert=None,
+                      indent=2):
+    db = db or get_db()
+    saved = (state or {}).get(name)
+    if saved and (saved.get("output") != output_path or not os.path.exists(output_path)):
+        saved = None
+
+    if incremental and saved:
+        watermark = Watermark(field, saved)
+        docs = watermark.track(to_json_docs(collection, query_since(db, collection, field, saved), convert))
+        count = merge_into_extract(docs, output_path, fmt, name, indent)
+        print(f"Exported {name}: {count} new since {saved['value']}")
+    else:
+        watermark = Watermark(field)
+        if pool is not None and shards > 1:
+            docs = iter_sharded(db, name, collection, shard_bounds(shards), pool, convert)
+        else:
+            docs = to_json_docs(collection, db.collection(collection).stream(), convert)
+        count = write_docs(watermark.track(docs), output_path, fmt, name, indent)
+        print(f"Exported {name}:", count)
+
+    if state is not None and watermark.mark:
+        with _state_lock:
+            state[name] = dict(watermark.mark, output=output_path)
+    return count
+
+
+# export the recipe schema
+def export_recipes(output_path="data_extract/recipes.json", fmt=None):
+    return export_collection("recipes", "Recipe", "CreatedAt", output_path, fmt)
 
 
 # export interaction schema
-def export_interactions(output_path="data_extract/interactions.json"):
-    db = get_db()
-    interactions = []
+def export_interactions(output_path="data_extract/interactions.json", fmt=None):
+    return export_collection("interactions", "Interaction", "CreatedAt", output_path, fmt)
 
-    for doc in db.collection("Interaction").stream():
-        interactions.append(doc_to_json(doc))
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(interactions, f, indent=2, ensure_ascii=False)
+# export users schema; with activities="flat" the users no longer carry their
+# activities, so those are written to activities_path as rows of their own
+def export_users(output_path="data_extract/users.json", fmt=None, activities="bulk",
+                 activities_path="data_extract/activities.json", db=None):
+    db = db or get_db()
+    if activities == "flat":
+        export_activities(activities_path, fmt, db)
+    return export_collection("users", "Users", "JoinedAt", output_path, fmt, db=db,
+                             convert=user_converter(db, activities))
 
-    print("Exported interactions:", len(interactions))
 
+# export every activity as its own row with the owning UserID,
+# streamed straight from the collection group query
+def export_activities(output_path="data_extract/activities.json", fmt=None, db=None, indent=2):
+    db = db or get_db()
+    count = write_docs(iter_activities(db), output_path, fmt, "activities", indent)
 
-# export users schema
-def export_users(output_path="data_extract/users.json"):
-    db = get_db()
-    users = []
+    print("Exported activities:", count)
+    return count
 
-    for user_doc in db.collection("Users").stream():
-        u = doc_to_json(user_doc)
-        activities = []
-        for act in user_doc.reference.collection("Activities").stream():
-            activities.append(doc_to_json(act))
 
-        u["Activities"] = activities
-        users.append(u)
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2, ensure_ascii=False)
+# data_extract/<name>.json|ndjson, plus .gz / .zst for a compressed extract
+def output_path_for(name, fmt, compression=None):
+    ext = "ndjson" if fmt == "ndjson" else "json"
+    return f"data_extract/{name}.{ext}" + CODEC_EXTENSIONS.get(compression, "")
+
+
+# run every export; the state file is rewritten atomically after each
+# collection so it never points past data that is not on disk yet.
+# with workers > 1 the three collections extract concurrently and their
+# shard reads share one bounded pool of `workers` threads.
+# activities: "bulk" joins one collection group read onto the users,
+# "flat" writes activities.json and leaves users without the nested list,
+# "nested" reads each user's subcollection separately. compression ("gzip" /
+# "zstd") compresses the extracts as they stream out; compact drops the
+# indentation of json arrays
+def export_all(fmt="json", incremental=False, full_refresh=False, state_path=STATE_PATH,
+               db=None, workers=1, shards=1, activities="bulk", compression=None, compact=False):
+    db = db or get_db()
+    state = None
+    if incremental or full_refresh:
+        state = {} if full_refresh else read_json(state_path, {})
+
+    indent = None if compact else 2
+
+    def run(name, collection, field, pool=None):
+        convert = None
+        if collection == "Users":
+            if activities == "flat":
+                export_activities(output_path_for("activities", fmt, compression), fmt, db, indent)
+            convert = user_converter(db, activities)
+        count = export_collection(name, collection, field, output_path_for(name, fmt, compression), fmt,
+                                  incremental=incremental and not full_refresh, state=state,
+                                  db=db, shards=shards, pool=pool, convert=convert, indent=indent)
+        if state is not None:
+            with _state_lock:
+                write_json_atomic(state_path, state)
+        return count
+
+    if workers <= 1:
+        return {name: run(name, collection, field) for name, collection, field in EXPORTS}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            ThreadPoolExecutor(max_workers=len(EXPORTS)) as collections:
+        futures = {name: collections.submit(run, name, collection, field, pool)
+                   for name, collection, field in EXPORTS}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export Firestore collections to data_extract/")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                        help="json writes a pretty json array, ndjson writes one document per line")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--incremental", action="store_true",
+                      help="only fetch documents newer than the saved watermark and merge them in")
+    mode.add_argument("--full-refresh", action="store_true",
+                      help="re-export everything and reset the saved watermarks")
+    parser.add_argument("--state", default=STATE_PATH, help="watermark state file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="threads for parallel reads; > 1 also extracts the collections concurrently")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="__name__ key ranges to read each collection in")
+    parser.add_argument("--activities", choices=["bulk", "flat", "nested"], default="bulk",
+                        help="bulk: one collection group read joined onto users; "
+                             "flat: separate activities file; nested: one read per user")
+    parser.add_argument("--compression", choices=sorted(CODEC_EXTENSIONS),
+                        help="compress the extracts while they are written (recipes.json.gz, ...)")
+    parser.add_argument("--compact", action="store_true",
+                        help="write json arrays without indentation")
+    parser.add_argument("--fake-source", metavar="DIR",
+                        help="read from an in-process fake firestore loaded from the extracts in DIR")
+    args = parser.parse_args(argv)
+
+    db = None
+    if args.fake_source:
+        import fake_firestore
+        db = fake_firestore.from_extracts(
+            *(find_artifact(os.path.join(args.fake_source, f"{name}.json")) for name, _, _ in EXPORTS)
+        )
+
+    export_all(args.format, args.incremental, args.full_refresh, args.state,
+               db=db, workers=args.workers, shards=args.shards, activities=args.activities,
+               compression=args.compression, compact=args.compact)
 
-    print("Exported users:", len(users))
 
 if __name__ == "__main__":
-    export_recipes()
-    export_interactions()
-    export_users()
+    main()
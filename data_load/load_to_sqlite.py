@@ -0,0 +1,237 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_cache import hash_file
+from pipeline_io import find_artifact, open_artifact, read_json
+
+
+# loads the transformed tables into a local sqlite database, keyed on the
+# stable ids the transform derives. rows are upserted in large executemany
+# batches inside a single transaction, so readers see either the previous
+# load or the new one. a full load also deletes rows that are gone from the
+# csvs; --changes applies data_transform/changes/ instead when the database
+# holds exactly the tables those changes start from.
+
+DB_PATH = "data_load/recipes.db"
+BATCH_SIZE = 10000
+
+# table -> (csv file, [(column, sql type)]); the first column is the key
+SCHEMA = {
+    "recipes": ("recipe.csv", [
+        ("recipe_id", "TEXT"), ("title", "TEXT"), ("description", "TEXT"),
+        ("prep_time", "REAL"), ("cook_time", "REAL"), ("total_time", "REAL"),
+        ("difficulty", "TEXT"), ("author_id", "TEXT"), ("author_name", "TEXT"),
+        ("view_count", "INTEGER"), ("like_count", "INTEGER"), ("rating_count", "INTEGER"),
+        ("created_at", "TEXT"),
+    ]),
+    "ingredients": ("ingredients.csv", [
+        ("ingredient_id", "TEXT"), ("recipe_id", "TEXT"), ("name", "TEXT"),
+        ("quantity", "TEXT"), ("unit", "TEXT"), ("optional", "TEXT"),
+    ]),
+    "steps": ("steps.csv", [
+        ("step_id", "TEXT"), ("recipe_id", "TEXT"), ("step_number", "INTEGER"),
+        ("instruction", "TEXT"), ("duration_seconds", "INTEGER"), ("duration_raw", "TEXT"),
+    ]),
+    "interactions": ("interactions.csv", [
+        ("interaction_id", "TEXT"), ("recipe_id", "TEXT"), ("user_id", "TEXT"),
+        ("username", "TEXT"), ("type", "TEXT"), ("rating", "REAL"),
+        ("cooknote", "TEXT"), ("recipe_title", "TEXT"), ("created_at", "TEXT"),
+    ]),
+}
+
+INDEXES = {
+    "recipes": ["author_id", "created_at"],
+    "ingredients": ["recipe_id", "name"],
+    "steps": ["recipe_id"],
+    "interactions": ["recipe_id", "user_id", "created_at"],
+}
+
+
+def _real(v):
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(v) else v
+
+
+def _integer(v):
+    v = _real(v)
+    return int(v) if v is not None and v.is_integer() else v
+
+
+def _text(v):
+    return v or None
+
+
+CONVERTERS = {"TEXT": _text, "REAL": _real, "INTEGER": _integer}
+
+
+def create_indexes(conn, table):
+    for column in INDEXES[table]:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})")
+
+
+def drop_indexes(conn, table):
+    for column in INDEXES[table]:
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table}_{column}")
+
+
+def create_schema(conn):
+    for table, (_, columns) in SCHEMA.items():
+        key = columns[0][0]
+        cols = ", ".join(f"{name} {kind}" for name, kind in columns)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols}, PRIMARY KEY ({key}))")
+        create_indexes(conn, table)
+    conn.execute("CREATE TABLE IF NOT EXISTS load_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def connect(db_path=DB_PATH):
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+    create_schema(conn)
+    return conn
+
+
+def _upsert_sql(table):
+    columns = [name for name, _ in SCHEMA[table][1]]
+    key = columns[0]
+    updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT ({key}) DO UPDATE SET {updates}")
+
+
+# (change, typed tuple) per csv row, in the table's column order; change is
+# None unless the file is a change file
+def _iter_rows(path, table):
+    columns = SCHEMA[table][1]
+    with open_artifact(path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        positions = [(header.index(name), CONVERTERS[kind]) for name, kind in columns]
+        change = header.index("change") if "change" in header else None
+        for row in reader:
+            values = tuple(convert(row[i]) for i, convert in positions)
+            yield (row[change] if change is not None else None), values
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# upsert every row of the csv and delete the rows it no longer has. an
+# empty table is filled without its secondary indexes, which are built
+# afterwards in one pass
+def load_table(conn, table, path):
+    key = SCHEMA[table][1][0][0]
+    upsert = _upsert_sql(table)
+    rows = (values for _, values in _iter_rows(path, table))
+    if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None:
+        drop_indexes(conn, table)
+        count = 0
+        for batch in _batches(rows):
+            conn.executemany(upsert, batch)
+            count += len(batch)
+        create_indexes(conn, table)
+        return {"rows": count, "deleted": 0}
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS loaded_ids (id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM loaded_ids")
+    count = 0
+    for batch in _batches(rows):
+        conn.executemany(upsert, batch)
+        conn.executemany("INSERT OR IGNORE INTO loaded_ids VALUES (?)", [(row[0],) for row in batch])
+        count += len(batch)
+    deleted = conn.execute(f"DELETE FROM {table} WHERE {key} NOT IN (SELECT id FROM loaded_ids)").rowcount
+    return {"rows": count, "deleted": deleted}
+
+
+# insert/update rows are upserted, delete rows removed; "previous" rows
+# (the old version of an update) are not needed here
+def apply_changes(conn, table, path):
+    key = SCHEMA[table][1][0][0]
+    upsert = _upsert_sql(table)
+    counts = {"upserted": 0, "deleted": 0}
+    for batch in _batches(_iter_rows(path, table)):
+        rows = [values for change, values in batch if change in ("insert", "update")]
+        gone = [(values[0],) for change, values in batch if change == "delete"]
+        conn.executemany(upsert, rows)
+        conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", gone)
+        counts["upserted"] += len(rows)
+        counts["deleted"] += len(gone)
+    return counts
+
+
+# content hashes of the csvs the database was last loaded from
+def _loaded_tables(conn):
+    row = conn.execute("SELECT value FROM load_meta WHERE key = 'tables'").fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _set_loaded_tables(conn, tables):
+    conn.execute("INSERT OR REPLACE INTO load_meta VALUES ('tables', ?)", (json.dumps(tables),))
+
+
+def load(input_dir="data_transform", db_path=DB_PATH, changes=False):
+    start = time.perf_counter()
+    conn = connect(db_path)
+    paths = {csv_name: find_artifact(os.path.join(input_dir, csv_name)) for csv_name, _ in SCHEMA.values()}
+    tables = {csv_name: hash_file(path) for csv_name, path in paths.items()}
+    manifest = read_json(os.path.join(input_dir, "changes", "manifest.json")) if changes else None
+    current = _loaded_tables(conn)
+    summary = {}
+    try:
+        with conn:
+            if current == tables:
+                print(f"{db_path} is already up to date")
+                return summary
+            if manifest and current == manifest["base"]:
+                for table, (csv_name, _) in SCHEMA.items():
+                    summary[table] = apply_changes(conn, table, os.path.join(input_dir, "changes", csv_name))
+                _set_loaded_tables(conn, manifest["result"])
+            else:
+                for table, (csv_name, _) in SCHEMA.items():
+                    summary[table] = load_table(conn, table, paths[csv_name])
+                _set_loaded_tables(conn, tables)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    for table, counts in summary.items():
+        print(f"Loaded {table}: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+    print(f"Database written to {db_path} in {elapsed:.2f}s")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the transformed tables into a local SQLite database")
+    parser.add_argument("--input-dir", default="data_transform")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--changes", action="store_true",
+                        help="apply <input-dir>/changes/ (from transform --changes) when the "
+                             "database holds the tables they start from; otherwise do a full load")
+    args = parser.parse_args(argv)
+    load(args.input_dir, args.db, args.changes)
+
+
+if __name__ == "__main__":
+    main()
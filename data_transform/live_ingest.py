@@ -0,0 +1,499 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_extract.firestore_export import Watermark, doc_to_json, get_db, query_since
+from data_transform.transform_to_csv import (INGREDIENT_HEADER, INTERACTION_HEADER, RECIPE_HEADER,
+                                             STEP_HEADER, TABLES, interaction_row, recipe_rows)
+from data_validation.validator import RULES, compile_rules, iter_messages, unique_recipes
+from firestore_writer import RETRYABLE
+from pipeline_io import compression_for, find_artifact, read_json, write_json_atomic
+from pipeline_metrics import METRICS_DIR, write_live_prometheus
+
+
+# long running ingestion: Recipe and Interaction are followed with
+# on_snapshot listeners (or polled, for clients without listeners such as
+# the in-process fake), new documents are cut into micro-batches by size or
+# age, turned into rows with the same code as transform_to_csv.py, checked
+# with the validator's rules and appended to the csvs. once all four csvs
+# hold a batch, a checkpoint file records their sizes and hashes and the
+# newest (CreatedAt, id) appended. a restart cuts the csvs back to the last
+# checkpoint, dropping the rows of a batch that was only partly written, and
+# resumes from its marks. the outputs are append only, so edits and deletes
+# of existing documents are counted but left for the next batch export
+
+BATCH_SIZE = 500
+MAX_WAIT = 2.0
+POLL_INTERVAL = 1.0
+RECENT_BATCHES = 20
+INVALID_PATH = "data_validation/live_invalid_records.ndjson"
+CHECKPOINT_FILE = "live_checkpoint.json"
+HASH_BUFFER = 1024 * 1024
+
+# (kind, firestore collection, watermark field, csv it appends to)
+SOURCES = [
+    ("recipes", "Recipe", "CreatedAt", "recipe.csv"),
+    ("interactions", "Interaction", "CreatedAt", "interactions.csv"),
+]
+
+# recipe rules see a batch's recipes with their ingredients and steps;
+# interaction rules see a batch's interactions keyed by their recipe ids
+RECIPE_PLAN = compile_rules([rule for rule in RULES if rule.table != "interactions"])
+INTERACTION_PLAN = compile_rules([rule for rule in RULES if rule.table == "interactions"])
+
+
+# newest (CreatedAt, id) per source among the rows already in the csvs, for
+# csvs without a checkpoint (written by a batch transform). rows whose
+# created_at does not parse are counted and left out
+def csv_marks(output_dir="data_transform"):
+    marks = {}
+    for kind, _, field, table in SOURCES:
+        watermark = Watermark(field)
+        path = os.path.join(output_dir, table)
+        unparsed = 0
+        if os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                column = next(reader, ["created_at"]).index("created_at")
+                for row in reader:
+                    try:
+                        watermark.update({"id": row[0], field: row[column]})
+                    except (ValueError, IndexError):
+                        unparsed += 1
+        if unparsed:
+            print(f"{path}: {unparsed} rows without a readable created_at left out of the start mark")
+        marks[kind] = watermark.mark
+    return marks
+
+
+# blake2b of the first `size` bytes of a file (all of it when size is None);
+# returns the running hash, which appends keep updating, and the bytes read
+def _hash_prefix(path, size=None):
+    h = hashlib.blake2b(digest_size=16)
+    read = 0
+    with open(path, "rb") as f:
+        while size is None or read < size:
+            block = f.read(HASH_BUFFER if size is None else min(HASH_BUFFER, size - read))
+            if not block:
+                break
+            h.update(block)
+            read += len(block)
+    return h, read
+
+
+# changes arrive on `events` as (kind, change type, document, arrival time)
+
+# on_snapshot listener on the documents at or after the mark. the first
+# snapshot replays everything the query matches, so documents not past the
+# mark are dropped; later ADDED documents are taken even when their CreatedAt
+# is older than ones already seen. returns the watch, to unsubscribe
+def listen(db, kind, collection, field, mark, events):
+    start = Watermark(field, mark)
+    query = db.collection(collection)
+    if mark:
+        query = query.where(field, ">=", datetime.fromisoformat(mark["value"]))
+
+    def on_snapshot(snapshots, changes, read_time):
+        received = time.time()
+        for change in changes:
+            doc = doc_to_json(change.document)
+            if change.type.name == "ADDED" and not start.newer(doc):
+                continue
+            events.put((kind, change.type.name, doc, received))
+
+    return query.on_snapshot(on_snapshot)
+
+
+# polling fallback: every `interval` seconds read the documents past the
+# watermark with the incremental export's ordered query. only new documents
+# are seen, and one written late with an older CreatedAt is missed, as in an
+# incremental export
+def poll(db, kind, collection, field, mark, events, stop, interval=POLL_INTERVAL):
+    watermark = Watermark(field, mark)
+    while not stop.is_set():
+        try:
+            snapshots = list(query_since(db, collection, field, watermark.mark))
+        except RETRYABLE as e:
+            print(f"Polling {collection} failed, retrying: {e}")
+            snapshots = []
+        received = time.time()
+        for snapshot in snapshots:
+            doc = doc_to_json(snapshot)
+            watermark.update(doc)
+            events.put((kind, "ADDED", doc, received))
+        stop.wait(interval)
+
+
+# block until `batch_size` changes are queued or the oldest queued change is
+# `max_wait` seconds old; returns what is there once `stop` is set
+def next_batch(events, stop, batch_size=BATCH_SIZE, max_wait=MAX_WAIT):
+    batch, deadline = [], None
+    while len(batch) < batch_size:
+        if deadline is None:
+            timeout = 0.2
+        else:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+        try:
+            item = events.get(timeout=timeout)
+        except queue.Empty:
+            if stop.is_set():
+                break
+            continue
+        batch.append(item)
+        if deadline is None:
+            deadline = time.monotonic() + max_wait
+    return batch
+
+
+# the csvs opened for appending; a missing table is created with its header.
+# compressed tables cannot be appended to.
+#
+# <output_dir>/live_checkpoint.json holds, after every complete batch, the
+# size and hash of each csv and the marks to resume from. on open, csvs whose
+# first `size` bytes still hash to the checkpoint are cut back to that size,
+# which drops the rows of a batch interrupted part way through. csvs that do
+# not match (rewritten by a batch transform, or no checkpoint yet) are kept
+# whole and the marks are read from their rows instead
+class LiveTables:
+
+    def __init__(self, output_dir="data_transform"):
+        os.makedirs(output_dir, exist_ok=True)
+        self.checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+        paths = {table: os.path.join(output_dir, table) for table in TABLES}
+        for table, header in TABLES.items():
+            path = paths[table]
+            if compression_for(find_artifact(path)):
+                raise ValueError(f"{find_artifact(path)}: live ingestion only appends to plain csvs")
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                with open(path, "w", newline="", encoding="utf-8") as f:
+                    csv.writer(f).writerow(header)
+
+        checkpoint = read_json(self.checkpoint_path)
+        self.hashes, self.sizes = {}, {}
+        if checkpoint:
+            for table, path in paths.items():
+                saved = checkpoint["tables"][table]
+                self.hashes[table], self.sizes[table] = _hash_prefix(path, saved["size"])
+                if self.sizes[table] != saved["size"] or self.hashes[table].hexdigest() != saved["hash"]:
+                    print(f"{path} no longer matches {self.checkpoint_path}; resuming from its rows")
+                    checkpoint = None
+                    break
+        if checkpoint:
+            for table, path in paths.items():
+                if os.path.getsize(path) > self.sizes[table]:
+                    print(f"Dropping the rows of an unfinished batch from {path}")
+                    os.truncate(path, self.sizes[table])
+            self.marks = checkpoint["marks"]
+        else:
+            for table, path in paths.items():
+                self.hashes[table], self.sizes[table] = _hash_prefix(path)
+            self.marks = csv_marks(output_dir)
+
+        self.files = {table: open(path, "a", newline="", encoding="utf-8")
+                      for table, path in paths.items()}
+        self.start = {kind: Watermark(field, self.marks[kind]) for kind, _, field, _ in SOURCES}
+        self.watermarks = {kind: Watermark(field, self.marks[kind]) for kind, _, field, _ in SOURCES}
+        self.seen = {kind: set() for kind, _, _, _ in SOURCES}
+        self.counts = Counter()
+
+    # whether a document is new: past the marks the ingester started from and
+    # not taken since. listeners redeliver ADDED documents on reconnects and
+    # resumed streams; the ids taken since start are kept to drop those
+    def claim(self, kind, doc):
+        if doc["id"] in self.seen[kind] or not self.start[kind].newer(doc):
+            return False
+        self.seen[kind].add(doc["id"])
+        self.watermarks[kind].update(doc)
+        return True
+
+    # children before their recipe, so a reader that sees a recipe row also
+    # sees its ingredients and steps
+    def append(self, recipes, interactions):
+        for table, rows in (("ingredients.csv", [i for _, ings, _ in recipes for i in ings]),
+                            ("steps.csv", [s for _, _, steps in recipes for s in steps]),
+                            ("recipe.csv", [recipe for recipe, _, _ in recipes]),
+                            ("interactions.csv", interactions)):
+            if rows:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                data = buffer.getvalue()
+                self.files[table].write(data)
+                self.files[table].flush()
+                data = data.encode("utf-8")
+                self.hashes[table].update(data)
+                self.sizes[table] += len(data)
+                self.counts[table] += len(rows)
+
+    # record the csvs as they are after a complete batch
+    def checkpoint(self):
+        write_json_atomic(self.checkpoint_path, {
+            "marks": {kind: watermark.mark for kind, watermark in self.watermarks.items()},
+            "tables": {table: {"size": self.sizes[table], "hash": self.hashes[table].hexdigest()}
+                       for table in TABLES},
+        })
+
+    def close(self):
+        for fp in self.files.values():
+            fp.close()
+
+
+# rows as the validator reads them back from the csvs: text, None as ""
+def _text_frame(rows, header):
+    return pd.DataFrame([["" if v is None else str(v) for v in row] for row in rows],
+                        columns=header, dtype=str)
+
+
+# run the validator's rules over one batch of rows; returns the invalid
+# records (recipe_id + errors, as in the validation report) and the failures
+# per rule
+def validate_batch(recipes, interactions):
+    empty = {"ingredients": _text_frame([], INGREDIENT_HEADER), "steps": _text_frame([], STEP_HEADER),
+             "interactions": _text_frame([], INTERACTION_HEADER)}
+    runs = []
+    if recipes:
+        runs.append((RECIPE_PLAN, dict(
+            empty,
+            recipe=unique_recipes(_text_frame([recipe for recipe, _, _ in recipes], RECIPE_HEADER)),
+            ingredients=_text_frame([i for _, ings, _ in recipes for i in ings], INGREDIENT_HEADER),
+            steps=_text_frame([s for _, _, steps in recipes for s in steps], STEP_HEADER),
+        )))
+    if interactions:
+        frame = _text_frame(interactions, INTERACTION_HEADER)
+        runs.append((INTERACTION_PLAN, dict(
+            empty, recipe=pd.DataFrame({"recipe_id": pd.unique(frame["recipe_id"])}), interactions=frame,
+        )))
+
+    records, failures = [], Counter()
+    for plan, tables in runs:
+        found, stats = plan.run(tables)
+        ids = tables["recipe"]["recipe_id"].tolist()
+        for pos, errors in iter_messages(found, "error"):
+            records.append({"recipe_id": ids[pos], "errors": [m for _, m in errors]})
+        for name, stat in stats.items():
+            failures[name] += stat["failures"]
+    return records, failures
+
+
+# seconds from a document's CreatedAt until `now`; naive timestamps are local
+def _age(doc, now):
+    value = doc.get("CreatedAt")
+    if not value:
+        return None
+    return (now - datetime.fromisoformat(value).astimezone()).total_seconds()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else None
+
+
+# transform, validate and append one batch; returns its metrics
+def process_batch(batch, tables, invalid_fp):
+    start = time.perf_counter()
+    docs = {"recipes": [], "interactions": []}
+    skipped = Counter()
+    duplicates = 0
+    for kind, change, doc, _ in batch:
+        if change != "ADDED":
+            skipped[change] += 1
+        elif tables.claim(kind, doc):
+            docs[kind].append(doc)
+        else:
+            duplicates += 1
+
+    recipes = [recipe_rows(r) for r in docs["recipes"]]
+    interactions = [interaction_row(inter) for inter in docs["interactions"]]
+    records, failures = validate_batch(recipes, interactions)
+    tables.append(recipes, interactions)
+    for record in records:
+        invalid_fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+    invalid_fp.flush()
+    tables.checkpoint()
+
+    appended = time.time()
+    now = datetime.now(timezone.utc)
+    ages = [age for kind in docs for age in (_age(doc, now) for doc in docs[kind]) if age is not None]
+    seconds = time.perf_counter() - start
+    count = len(docs["recipes"]) + len(docs["interactions"])
+    return {
+        "docs": count,
+        "recipes": len(docs["recipes"]),
+        "interactions": len(docs["interactions"]),
+        "skipped_changes": dict(skipped),
+        "duplicates": duplicates,
+        "invalid_records": len(records),
+        "rule_failures": {name: n for name, n in failures.items() if n},
+        "seconds": seconds,
+        "docs_per_sec": count / seconds if seconds > 0 else None,
+        "lag_p50_seconds": _percentile(ages, 50),
+        "lag_max_seconds": max(ages) if ages else None,
+        "wait_max_seconds": max(appended - received for _, _, _, received in batch),
+        "timestamp_seconds": appended,
+    }
+
+
+# running totals plus the last RECENT_BATCHES batches, rewritten after every
+# batch as pipeline_metrics/live_ingest.json and live_ingest.prom
+class LiveMetrics:
+
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.totals = {"batches": 0, "docs": 0, "recipes": 0, "interactions": 0,
+                       "invalid_records": 0, "skipped_changes": 0, "duplicates": 0}
+        self.recent = deque(maxlen=RECENT_BATCHES)
+
+    def add(self, stats):
+        totals = self.totals
+        totals["batches"] += 1
+        for key in ("docs", "recipes", "interactions", "invalid_records", "duplicates"):
+            totals[key] += stats[key]
+        totals["skipped_changes"] += sum(stats["skipped_changes"].values())
+        self.recent.append(stats)
+        self.write()
+
+    def report(self):
+        uptime = time.perf_counter() - self._start
+        return {
+            "started_at": self.started_at.isoformat(),
+            "uptime_seconds": uptime,
+            "totals": dict(self.totals, docs_per_sec=self.totals["docs"] / uptime if uptime > 0 else None),
+            "last_batch": self.recent[-1] if self.recent else None,
+            "recent_batches": list(self.recent),
+        }
+
+    def write(self):
+        report = self.report()
+        write_json_atomic(os.path.join(self.metrics_dir, "live_ingest.json"), report)
+        write_live_prometheus(os.path.join(self.metrics_dir, "live_ingest.prom"), report)
+        return report
+
+
+def _print_batch(n, stats):
+    lag = stats["lag_p50_seconds"]
+    skipped = sum(stats["skipped_changes"].values())
+    print(f"Batch {n}: {stats['recipes']} recipes, {stats['interactions']} interactions "
+          f"in {stats['seconds'] * 1000:.0f} ms, {stats['invalid_records']} invalid"
+          + (f", {skipped} edits/deletes skipped" if skipped else "")
+          + (f", {stats['duplicates']} redelivered documents dropped" if stats["duplicates"] else "")
+          + (f"; lag p50 {lag:.2f}s, max {stats['lag_max_seconds']:.2f}s" if lag is not None else ""))
+
+
+# follow both collections until `stop` is set (or `duration` seconds pass,
+# or ctrl-c), appending every micro-batch to the csvs in output_dir. the
+# listeners are used when the client has them unless use_poll is set.
+# returns the final metrics report
+def ingest(db=None, output_dir="data_transform", batch_size=BATCH_SIZE, max_wait=MAX_WAIT,
+           use_poll=False, poll_interval=POLL_INTERVAL, invalid_path=INVALID_PATH,
+           metrics_dir=METRICS_DIR, duration=None, stop=None):
+    db = db or get_db()
+    stop = stop or threading.Event()
+    tables = LiveTables(output_dir)
+    marks = tables.marks
+    os.makedirs(os.path.dirname(invalid_path) or ".", exist_ok=True)
+    invalid_fp = open(invalid_path, "a", encoding="utf-8")
+    metrics = LiveMetrics(metrics_dir)
+    events = queue.Queue()
+
+    watches, pollers = [], []
+    for kind, collection, field, _ in SOURCES:
+        polled = use_poll or not hasattr(db.collection(collection), "on_snapshot")
+        if polled:
+            pollers.append(threading.Thread(target=poll, name=f"poll-{kind}", daemon=True,
+                                            args=(db, kind, collection, field, marks[kind], events,
+                                                  stop, poll_interval)))
+            pollers[-1].start()
+        else:
+            watches.append(listen(db, kind, collection, field, marks[kind], events))
+        print(f"Following {collection} with {'polling' if polled else 'a listener'} from "
+              f"{marks[kind]['value'] if marks[kind] else 'the beginning'}")
+    timer = threading.Timer(duration, stop.set) if duration else None
+    if timer:
+        timer.start()
+
+    try:
+        while not stop.is_set():
+            batch = next_batch(events, stop, batch_size, max_wait)
+            if batch:
+                metrics.add(process_batch(batch, tables, invalid_fp))
+                _print_batch(metrics.totals["batches"], metrics.recent[-1])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if timer:
+            timer.cancel()
+        for watch in watches:
+            watch.unsubscribe()
+        for poller in pollers:
+            poller.join()
+        rest = []
+        while not events.empty():
+            rest.append(events.get_nowait())
+        if rest:
+            metrics.add(process_batch(rest, tables, invalid_fp))
+            _print_batch(metrics.totals["batches"], metrics.recent[-1])
+        tables.close()
+        invalid_fp.close()
+
+    report = metrics.write()
+    totals = report["totals"]
+    print(f"Live ingestion stopped: {totals['docs']} documents in {totals['batches']} batches "
+          f"({totals['recipes']} recipes, {totals['interactions']} interactions), "
+          f"{totals['invalid_records']} invalid, {totals['skipped_changes']} edits/deletes skipped")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Follow Recipe/Interaction in Firestore and append new documents to the CSVs in micro-batches")
+    parser.add_argument("--output-dir", default="data_transform")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="documents per micro-batch at most")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT, metavar="SECONDS",
+                        help="append a batch once its oldest change has waited this long")
+    parser.add_argument("--poll", action="store_true",
+                        help="poll for new documents instead of using on_snapshot listeners")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, metavar="SECONDS")
+    parser.add_argument("--duration", type=float, metavar="SECONDS",
+                        help="stop after this long (default: run until interrupted)")
+    parser.add_argument("--invalid-records", default=INVALID_PATH,
+                        help="ndjson file the invalid records of every batch are appended to")
+    parser.add_argument("--metrics-dir", default=METRICS_DIR)
+    parser.add_argument("--fake-source", metavar="DIR",
+                        help="follow an in-process fake firestore loaded from the extracts in DIR "
+                             "(polled, since the fake has no listeners)")
+    parser.add_argument("--fake-writes", type=float, default=0.0, metavar="DOCS_PER_SEC",
+                        help="with --fake-source, keep writing new documents to the fake at this rate")
+    args = parser.parse_args(argv)
+
+    db, stop = None, threading.Event()
+    if args.fake_source:
+        import fake_firestore
+        db = fake_firestore.from_extracts(
+            *(find_artifact(os.path.join(args.fake_source, f"{kind}.json")) for kind, _, _, _ in SOURCES))
+        if args.fake_writes > 0:
+            threading.Thread(target=fake_firestore.simulate_writes, args=(db, args.fake_writes, stop),
+                             daemon=True).start()
+
+    ingest(db, args.output_dir, args.batch_size, args.max_wait, args.poll, args.poll_interval,
+           args.invalid_records, args.metrics_dir, args.duration, stop)
+
+
+if __name__ == "__main__":
+    main()
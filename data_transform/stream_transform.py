@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_extract.firestore_export import doc_to_json, get_async_db
+from data_transform.transform_to_csv import (INGREDIENT_HEADER, INTERACTION_HEADER, RECIPE_HEADER,
+                                             STEP_HEADER, interaction_row, open_csv, recipe_rows,
+                                             restore_previous, snapshot_previous, write_changes)
+from pipeline_io import JsonStreamWriter, remove_variants
+
+
+# extract and transform overlapped on one event loop: a reader task per
+# collection streams documents from firestore's AsyncClient in batches into a
+# bounded queue, and transform workers turn the batches into csv rows while
+# the reads continue. a full queue suspends the readers (backpressure), so at
+# most QUEUE_BATCHES + workers batches are held at once and the run takes
+# about max(extract, transform) instead of their sum. rows are computed on a
+# process pool and written in the order firestore returned the documents, so
+# the csvs match an export followed by transform_to_csv.py
+
+BATCH_SIZE = 500
+QUEUE_BATCHES = 8
+
+# (kind, firestore collection, extract file)
+SOURCES = [
+    ("recipes", "Recipe", "recipes.json"),
+    ("interactions", "Interaction", "interactions.json"),
+]
+
+
+# rows for one batch of documents; runs in a worker process. returns the
+# rows and the seconds spent, which add up to the transform time
+def transform_batch(kind, docs):
+    start = time.perf_counter()
+    if kind == "recipes":
+        rows = [recipe_rows(r) for r in docs]
+    else:
+        rows = [interaction_row(inter) for inter in docs]
+    return rows, time.perf_counter() - start
+
+
+class CsvTables:
+
+    def __init__(self, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.files = {}
+        self.writers = {}
+        for table, header in (("recipe.csv", RECIPE_HEADER), ("ingredients.csv", INGREDIENT_HEADER),
+                              ("steps.csv", STEP_HEADER), ("interactions.csv", INTERACTION_HEADER)):
+            self.files[table], self.writers[table] = open_csv(os.path.join(output_dir, table), header)
+        self.counts = {"recipe_docs": 0, "interaction_docs": 0, "recipe.csv": 0,
+                       "ingredients.csv": 0, "steps.csv": 0, "interactions.csv": 0}
+
+    def write(self, kind, rows):
+        counts = self.counts
+        if kind == "recipes":
+            for recipe, ingredients, steps in rows:
+                self.writers["recipe.csv"].writerow(recipe)
+                self.writers["ingredients.csv"].writerows(ingredients)
+                self.writers["steps.csv"].writerows(steps)
+                counts["ingredients.csv"] += len(ingredients)
+                counts["steps.csv"] += len(steps)
+            counts["recipe_docs"] += len(rows)
+            counts["recipe.csv"] += len(rows)
+        else:
+            self.writers["interactions.csv"].writerows(rows)
+            counts["interaction_docs"] += len(rows)
+            counts["interactions.csv"] += len(rows)
+
+    def close(self):
+        for table, fp in self.files.items():
+            fp.close()
+            remove_variants(os.path.join(self.output_dir, table))
+
+
+# stream one collection into the queue as numbered batches; with an extract
+# path every document is also written there as it arrives
+async def read_collection(db, kind, collection, queue, extract_path=None, batch_size=BATCH_SIZE):
+    writer = JsonStreamWriter(extract_path, label=kind) if extract_path else None
+    if writer:
+        writer.open()
+    seq, batch = 0, []
+    try:
+        async for snapshot in db.collection(collection).stream():
+            doc = doc_to_json(snapshot)
+            if writer:
+                writer.write(doc)
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await queue.put((kind, seq, batch))
+                seq, batch = seq + 1, []
+        if batch:
+            await queue.put((kind, seq, batch))
+    except BaseException:
+        if writer:
+            writer.abort()
+        raise
+    if writer:
+        writer.close()
+
+
+# take batches off the queue until the sentinel, transform them on the pool
+# and write each one once every earlier batch of its kind is written. a
+# worker waiting for its turn takes no new batch, so finished batches never
+# pile up behind a slow one
+async def transform_worker(queue, pool, tables, turns, busy):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        kind, seq, docs = item
+        if pool is None:
+            rows, seconds = transform_batch(kind, docs)
+        else:
+            rows, seconds = await loop.run_in_executor(pool, transform_batch, kind, docs)
+        busy.append(seconds)
+        turn = turns[kind]
+        async with turn["ready"]:
+            await turn["ready"].wait_for(lambda: turn["next"] == seq)
+            tables.write(kind, rows)
+            turn["next"] += 1
+            turn["ready"].notify_all()
+
+
+async def run(db, output_dir, extract_dir, pool, workers, batch_size, queue_batches):
+    queue = asyncio.Queue(maxsize=queue_batches)
+    tables = CsvTables(output_dir)
+    turns = {kind: {"next": 0, "ready": asyncio.Condition()} for kind, _, _ in SOURCES}
+    busy = []
+    timings = {}
+    start = time.perf_counter()
+
+    async def extract():
+        await asyncio.gather(*(
+            read_collection(db, kind, collection, queue,
+                            os.path.join(extract_dir, name) if extract_dir else None, batch_size)
+            for kind, collection, name in SOURCES
+        ))
+        timings["extract"] = time.perf_counter() - start
+        for _ in range(workers):
+            await queue.put(None)
+
+    tasks = [asyncio.create_task(extract())]
+    tasks += [asyncio.create_task(transform_worker(queue, pool, tables, turns, busy))
+              for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        tables.close()
+    timings["transform"] = sum(busy)
+    timings["wall"] = time.perf_counter() - start
+    return tables.counts, timings
+
+
+# extract + transform in one pass. `db` is an AsyncClient (or the fake's
+# async view); by default it is opened after the worker processes exist,
+# since grpc does not survive a fork. workers=0 transforms on the event loop
+# itself, which stalls the reads while a batch is converted
+def stream_transform(output_dir="data_transform", extract_dir="data_extract", db=None,
+                     workers=2, batch_size=BATCH_SIZE, queue_batches=QUEUE_BATCHES):
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    try:
+        if pool is not None:
+            pool.submit(int).result()
+        db = db or get_async_db()
+        counts, timings = asyncio.run(run(db, output_dir, extract_dir, pool, max(workers, 1),
+                                          batch_size, queue_batches))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    print(f"Stream transform complete! CSVs created inside {output_dir}/")
+    print(f"  {counts['recipe_docs']} recipes, {counts['interaction_docs']} interactions; "
+          f"extract {timings['extract']:.2f}s, transform {timings['transform']:.2f}s "
+          f"(summed over workers), wall {timings['wall']:.2f}s")
+    return counts, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export Recipe/Interaction from Firestore and transform them to CSV in one overlapped pass")
+    parser.add_argument("--output-dir", default="data_transform")
+    parser.add_argument("--extract-dir", default="data_extract",
+                        help="also write recipes.json / interactions.json here as they stream in")
+    parser.add_argument("--no-extracts", action="store_true",
+                        help="do not keep the json extracts")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="transform worker processes (0 = transform on the event loop)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="documents per queued batch")
+    parser.add_argument("--queue-batches", type=int, default=QUEUE_BATCHES,
+                        help="batches the queue holds before the readers wait")
+    parser.add_argument("--changes", action="store_true",
+                        help="also write the rows changed since the last run to <output-dir>/changes/")
+    parser.add_argument("--fake-source", metavar="DIR",
+                        help="read from an in-process fake firestore loaded from the extracts in DIR")
+    parser.add_argument("--fake-latency", type=float, default=0.0, metavar="SECONDS",
+                        help="with --fake-source, wait this long per page of 300 documents")
+    args = parser.parse_args(argv)
+
+    db = None
+    if args.fake_source:
+        import fake_firestore
+        db = fake_firestore.AsyncFakeFirestore(
+            fake_firestore.from_extracts(*(os.path.join(args.fake_source, name) for _, _, name in SOURCES)),
+            latency=args.fake_latency,
+        )
+    if args.changes:
+        snapshot_previous(args.output_dir)
+
+    try:
+        stream_transform(args.output_dir, None if args.no_extracts else args.extract_dir, db,
+                         args.workers, args.batch_size, args.queue_batches)
+
+        if args.changes:
+            write_changes(args.output_dir)
+    except BaseException:
+        if args.changes:
+            restore_previous(args.output_dir)
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,48 @@
+import argparse
+import hashlib
 import json
 import csv
+import sys
 import uuid
 import re
 import os
-from datetime import datetime
+import shutil
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_io import (CODEC_EXTENSIONS, find_artifact, iter_json_docs, open_artifact, remove_variants,
+                         write_json_atomic)
+from pipeline_cache import hash_file
+
+
+WRITE_BUFFER = 1024 * 1024
+
+# namespace for the uuid5 ids the transform derives, so identical input
+# always produces identical ids
+ID_NAMESPACE = uuid.UUID("6f1c3e0a-5b7d-4c2e-9a8f-3d4b5c6e7f80")
+
+RECIPE_HEADER = [
+    "recipe_id", "title", "description", "prep_time",
+    "cook_time", "total_time", "difficulty",
+    "author_id", "author_name", "view_count",
+    "like_count", "rating_count", "created_at"
+]
+
+INGREDIENT_HEADER = [
+    "ingredient_id", "recipe_id", "name", "quantity", "unit", "optional"
+]
+
+STEP_HEADER = [
+    "step_id", "recipe_id", "step_number", "instruction",
+    "duration_seconds", "duration_raw"
+]
+
+INTERACTION_HEADER = [
+    "interaction_id", "recipe_id", "user_id",
+    "username", "type", "rating", "cooknote",
+    "recipe_title", "created_at"
+]
 
 
 def parse_duration_to_seconds(d):
@@ -30,132 +69,555 @@ def parse_duration_to_seconds(d):
     return None
 
 
+def content_hash(value):
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
 
-# transform the recipe, interaction json file
-def transform(
-    recipes_json="data_extract/recipes.json",
-    interactions_json="data_extract/interactions.json"
-):
 
-    os.makedirs("data_transform", exist_ok=True)
+def stable_id(*parts):
+    return str(uuid.uuid5(ID_NAMESPACE, "/".join(str(p) for p in parts)))
 
-    # Load recipes
-    with open(recipes_json, "r", encoding="utf-8") as f:
-        recipes = json.load(f)
 
-    # Load interactions
-    with open(interactions_json, "r", encoding="utf-8") as f:
-        interactions = json.load(f)
+# turn one recipe document into its recipe, ingredient and step rows.
+# child ids come from (recipe_id, position, content hash), so re-running on
+# the same input gives the same ids and any edit to an item gives a new one
+def recipe_rows(r):
+    rid = r.get("id") or stable_id("recipe", content_hash(r))
 
-    # Open CSV writers
-    r_fp = open("data_transform/recipe.csv", "w", newline="", encoding="utf-8")
-    i_fp = open("data_transform/ingredients.csv", "w", newline="", encoding="utf-8")
-    s_fp = open("data_transform/steps.csv", "w", newline="", encoding="utf-8")
-    inter_fp = open("data_transform/interactions.csv", "w", newline="", encoding="utf-8")
-
-    r_writer = csv.writer(r_fp)
-    i_writer = csv.writer(i_fp)
-    s_writer = csv.writer(s_fp)
-    inter_writer = csv.writer(inter_fp)
-
-    # CSV headers
-    r_writer.writerow([
-        "recipe_id", "title", "description", "prep_time",
-        "cook_time", "total_time", "difficulty",
-        "author_id", "author_name", "view_count",
-        "like_count", "rating_count", "created_at"
-    ])
-
-    i_writer.writerow([
-        "ingredient_id", "recipe_id", "name", "quantity", "unit", "optional"
-    ])
-
-    s_writer.writerow([
-        "step_id", "recipe_id", "step_number", "instruction",
-        "duration_seconds", "duration_raw"
-    ])
-
-    inter_writer.writerow([
-        "interaction_id", "recipe_id", "user_id",
-        "username", "type", "rating", "cooknote",
-        "recipe_title", "created_at"
-    ])
+    title = r.get("Title")
+    desc = r.get("Description")
+    tr = r.get("TimeRequired", {})
+    stats = r.get("Statistics", {})
 
-    # process the recipe json
-    for r in recipes:
-        rid = r.get("id") or str(uuid.uuid4())
+    prep = tr.get("PrepTime")
+    cook = tr.get("CookTime")
+    total = tr.get("TotalTime")
 
-        title = r.get("Title")
-        desc = r.get("Description")
-        tr = r.get("TimeRequired", {})
-        stats = r.get("Statistics", {})
+    difficulty = r.get("Difficulty")
+    author_id = r.get("AuthorID")
+    author_name = r.get("AuthorName")
 
-        prep = tr.get("PrepTime")
-        cook = tr.get("CookTime")
-        total = tr.get("TotalTime")
+    view_count = stats.get("ViewCount", 0)
+    like_count = stats.get("LikeCount", 0)
+    rating_count = stats.get("RatingCount", 0)
 
-        difficulty = r.get("Difficulty")
-        author_id = r.get("AuthorID")
-        author_name = r.get("AuthorName")
+    created_at = r.get("CreatedAt")
 
-        view_count = stats.get("ViewCount", 0)
-        like_count = stats.get("LikeCount", 0)
-        rating_count = stats.get("RatingCount", 0)
+    recipe = [
+        rid, title, desc, prep, cook, total, difficulty,
+        author_id, author_name, view_count, like_count,
+        rating_count, created_at
+    ]
 
-        created_at = r.get("CreatedAt")
+    # process the ingredient json
+    ingredients = []
+    for pos, ing in enumerate(r.get("Ingredients", [])):
+        iid = stable_id(rid, "ingredient", pos, content_hash(ing))
+        ingredients.append([
+            iid, rid,
+            ing.get("Name"),
+            ing.get("Quantity"),
+            ing.get("Unit"),
+            ing.get("Optional", False)
+        ])
 
-        # write data into recipe csv
-        r_writer.writerow([
-            rid, title, desc, prep, cook, total, difficulty,
-            author_id, author_name, view_count, like_count,
-            rating_count, created_at
+    # process steps json
+    steps = []
+    for pos, st in enumerate(r.get("Steps", [])):
+        sid = stable_id(rid, "step", pos, content_hash(st))
+        step_no = st.get("StepNumber")
+        instr = st.get("Instruction")
+        dur_raw = st.get("Duration")
+        dur_sec = parse_duration_to_seconds(dur_raw)
+
+        steps.append([
+            sid, rid, step_no, instr, dur_sec, dur_raw
         ])
 
-        # process the ingredient json
-        for ing in r.get("Ingredients", []):
-            iid = str(uuid.uuid4())
-            i_writer.writerow([
-                iid, rid,
-                ing.get("Name"),
-                ing.get("Quantity"),
-                ing.get("Unit"),
-                ing.get("Optional", False)
-            ])
-
-        
-        # process steps json
-        for st in r.get("Steps", []):
-            sid = str(uuid.uuid4())
-            step_no = st.get("StepNumber")
-            instr = st.get("Instruction")
-            dur_raw = st.get("Duration")
-            dur_sec = parse_duration_to_seconds(dur_raw)
-
-            s_writer.writerow([
-                sid, rid, step_no, instr, dur_sec, dur_raw
-            ])
+    return recipe, ingredients, steps
+
+
+def interaction_row(inter):
+    return [
+        inter.get("id") or stable_id("interaction", content_hash(inter)),
+        inter.get("RecipeId"),
+        inter.get("UserId"),
+        inter.get("Username"),
+        inter.get("Type"),
+        inter.get("Rating"),
+        inter.get("Cooknote"),
+        inter.get("RecipeTitle"),
+        inter.get("CreatedAt")
+    ]
+
+
+# output file name -> header, in the order the tables are written
+TABLES = {
+    "recipe.csv": RECIPE_HEADER,
+    "ingredients.csv": INGREDIENT_HEADER,
+    "steps.csv": STEP_HEADER,
+    "interactions.csv": INTERACTION_HEADER,
+}
+
+
+# declared column types for the parquet target; quantity stays text because
+# the validator checks its raw form. every table is partitioned by the date
+# of created_at (the parent recipe's for ingredients and steps)
+PARQUET_SCHEMAS = {
+    "recipe": [
+        ("recipe_id", "string"), ("title", "string"), ("description", "string"),
+        ("prep_time", "float"), ("cook_time", "float"), ("total_time", "float"),
+        ("difficulty", "string"), ("author_id", "string"), ("author_name", "string"),
+        ("view_count", "int"), ("like_count", "int"), ("rating_count", "int"),
+        ("created_at", "timestamp"),
+    ],
+    "ingredients": [
+        ("ingredient_id", "string"), ("recipe_id", "string"), ("name", "string"),
+        ("quantity", "string"), ("unit", "string"), ("optional", "bool"),
+    ],
+    "steps": [
+        ("step_id", "string"), ("recipe_id", "string"), ("step_number", "int"),
+        ("instruction", "string"), ("duration_seconds", "int"), ("duration_raw", "string"),
+    ],
+    "interactions": [
+        ("interaction_id", "string"), ("recipe_id", "string"), ("user_id", "string"),
+        ("username", "string"), ("type", "string"), ("rating", "float"),
+        ("cooknote", "string"), ("recipe_title", "string"), ("created_at", "timestamp"),
+    ],
+}
+
+PARTITION_COLUMN = "created_date"
+
+
+def _to_string(v):
+    return None if v is None else str(v)
+
+
+def _to_float(v):
+    if v is None or v == "":
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
 
-    # process interaction json
-    for inter in interactions:
-        inter_writer.writerow([
-            inter.get("id") or str(uuid.uuid4()),
-            inter.get("RecipeId"),
-            inter.get("UserId"),
-            inter.get("Username"),
-            inter.get("Type"),
-            inter.get("Rating"),
-            inter.get("Cooknote"),
-            inter.get("RecipeTitle"),
-            inter.get("CreatedAt")
-        ])
+def _to_int(v):
+    f = _to_float(v)
+    return int(f) if f is not None and f.is_integer() else None
 
-    r_fp.close()
-    i_fp.close()
-    s_fp.close()
-    inter_fp.close()
 
-    print("Transform complete! CSVs created inside data_transform/")
+def _to_bool(v):
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, str) and v.strip().lower() in ("true", "false"):
+        return v.strip().lower() == "true"
+    return None
+
+
+def _to_timestamp(v):
+    if not v:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(v))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+CONVERTERS = {
+    "string": _to_string,
+    "float": _to_float,
+    "int": _to_int,
+    "bool": _to_bool,
+    "timestamp": _to_timestamp,
+}
+
+
+# buffers typed rows for one table and appends them to a hive partitioned
+# parquet dataset (<root>/created_date=YYYY-MM-DD/part-N.parquet)
+class ParquetTableWriter:
+
+    def __init__(self, root, columns, batch_rows=100000):
+        import pyarrow as pa
+
+        arrow_types = {
+            "string": pa.string(),
+            "float": pa.float64(),
+            "int": pa.int64(),
+            "bool": pa.bool_(),
+            "timestamp": pa.timestamp("us", tz="UTC"),
+        }
+        self.root = root
+        self.columns = columns
+        self.converters = [CONVERTERS[kind] for _, kind in columns]
+        self.schema = pa.schema(
+            [(name, arrow_types[kind]) for name, kind in columns]
+            + [(PARTITION_COLUMN, pa.string())]
+        )
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.parts = 0
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root, exist_ok=True)
+
+    def write(self, row, created_at):
+        ts = _to_timestamp(created_at)
+        typed = {name: convert(v) for (name, _), convert, v in zip(self.columns, self.converters, row)}
+        typed[PARTITION_COLUMN] = ts.date().isoformat() if ts else None
+        self.rows.append(typed)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def writerows(self, rows, created_at):
+        for row in rows:
+            self.write(row, created_at)
+
+    def flush(self):
+        if not self.rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(self.rows, schema=self.schema)
+        pq.write_to_dataset(
+            table, self.root, partition_cols=[PARTITION_COLUMN],
+            basename_template=f"part-{self.parts}-{{i}}.parquet",
+        )
+        self.parts += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def open_parquet_tables(output_dir):
+    root = os.path.join(output_dir, "parquet")
+    return {name: ParquetTableWriter(os.path.join(root, name), columns)
+            for name, columns in PARQUET_SCHEMAS.items()}
+
+
+# a .gz / .zst path is compressed while it is written
+def open_csv(path, header):
+    fp = open_artifact(path, "wt", newline="")
+    writer = csv.writer(fp)
+    writer.writerow(header)
+    return fp, writer
+
+
+# transform the recipe, interaction json file
+# both inputs are parsed one document at a time (json array or ndjson) and
+# rows are written as they are produced, so memory is bounded by one recipe.
+# output_format "parquet" writes typed tables under <output_dir>/parquet,
+# "both" writes them alongside the csvs. returns the number of documents read
+# and rows written per table. the extracts may be compressed (.gz / .zst,
+# found next to the given path too); compression "gzip" / "zstd" writes the
+# csvs as recipe.csv.gz, ... and removes the other encodings of each table
+def transform(
+    recipes_json="data_extract/recipes.json",
+    interactions_json="data_extract/interactions.json",
+    output_dir="data_transform",
+    output_format="csv",
+    compression=None
+):
+
+    os.makedirs(output_dir, exist_ok=True)
+    write_csv = output_format in ("csv", "both")
+    parquet = open_parquet_tables(output_dir) if output_format in ("parquet", "both") else None
+    paths = {table: os.path.join(output_dir, table + CODEC_EXTENSIONS.get(compression, ""))
+             for table in TABLES}
+
+    # Open CSV writers
+    if write_csv:
+        r_fp, r_writer = open_csv(paths["recipe.csv"], RECIPE_HEADER)
+        i_fp, i_writer = open_csv(paths["ingredients.csv"], INGREDIENT_HEADER)
+        s_fp, s_writer = open_csv(paths["steps.csv"], STEP_HEADER)
+        inter_fp, inter_writer = open_csv(paths["interactions.csv"], INTERACTION_HEADER)
+
+    counts = {"recipe_docs": 0, "interaction_docs": 0, "recipe.csv": 0,
+              "ingredients.csv": 0, "steps.csv": 0, "interactions.csv": 0}
+
+    # process the recipe json
+    for r in iter_json_docs(find_artifact(recipes_json)):
+        recipe, ingredients, steps = recipe_rows(r)
+        counts["recipe_docs"] += 1
+        counts["recipe.csv"] += 1
+        counts["ingredients.csv"] += len(ingredients)
+        counts["steps.csv"] += len(steps)
+        if write_csv:
+            r_writer.writerow(recipe)
+            i_writer.writerows(ingredients)
+            s_writer.writerows(steps)
+        if parquet:
+            created_at = r.get("CreatedAt")
+            parquet["recipe"].write(recipe, created_at)
+            parquet["ingredients"].writerows(ingredients, created_at)
+            parquet["steps"].writerows(steps, created_at)
+
+    # process interaction json
+    for inter in iter_json_docs(find_artifact(interactions_json)):
+        row = interaction_row(inter)
+        counts["interaction_docs"] += 1
+        counts["interactions.csv"] += 1
+        if write_csv:
+            inter_writer.writerow(row)
+        if parquet:
+            parquet["interactions"].write(row, inter.get("CreatedAt"))
+
+    if write_csv:
+        r_fp.close()
+        i_fp.close()
+        s_fp.close()
+        inter_fp.close()
+        for path in paths.values():
+            remove_variants(path)
+    if parquet:
+        for writer in parquet.values():
+            writer.close()
+
+    label = {"csv": "CSVs", "parquet": "Parquet tables", "both": "CSVs and Parquet tables"}[output_format]
+    print(f"Transform complete! {label} created inside {output_dir}/")
+    return counts
+
+
+def chunked(docs, size):
+    chunk = []
+    for doc in docs:
+        chunk.append(doc)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# transform one chunk of documents into its own shard of csvs (runs in a worker
+# process). recipe chunks fill recipe/ingredients/steps, interaction chunks
+# fill interactions; every shard file carries the header so it stands alone
+def transform_chunk(kind, docs, part_dir):
+    os.makedirs(part_dir, exist_ok=True)
+    if kind == "recipes":
+        r_fp, r_writer = open_csv(os.path.join(part_dir, "recipe.csv"), RECIPE_HEADER)
+        i_fp, i_writer = open_csv(os.path.join(part_dir, "ingredients.csv"), INGREDIENT_HEADER)
+        s_fp, s_writer = open_csv(os.path.join(part_dir, "steps.csv"), STEP_HEADER)
+        for r in docs:
+            recipe, ingredients, steps = recipe_rows(r)
+            r_writer.writerow(recipe)
+            i_writer.writerows(ingredients)
+            s_writer.writerows(steps)
+        r_fp.close()
+        i_fp.close()
+        s_fp.close()
+    else:
+        inter_fp, inter_writer = open_csv(os.path.join(part_dir, "interactions.csv"), INTERACTION_HEADER)
+        inter_writer.writerows(interaction_row(inter) for inter in docs)
+        inter_fp.close()
+    return part_dir
+
+
+# concatenate the shard files table by table in part order, dropping the
+# repeated headers, so the result has the serial path's rows in its order
+def merge_shards(shard_dir, output_dir="data_transform"):
+    names = sorted(
+        (name for name in os.listdir(shard_dir) if name.startswith("part-")),
+        key=lambda name: int(name[len("part-"):])
+    )
+    parts = [os.path.join(shard_dir, name) for name in names]
+    for table, header in TABLES.items():
+        out_fp, _ = open_csv(os.path.join(output_dir, table), header)
+        for part in parts:
+            path = os.path.join(part, table)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                f.readline()
+                shutil.copyfileobj(f, out_fp, WRITE_BUFFER)
+        out_fp.close()
+        remove_variants(os.path.join(output_dir, table))
+
+
+# split both inputs into chunks and transform them on a process pool; the
+# parent keeps at most two chunks per worker in flight so memory stays bounded
+def transform_parallel(
+    recipes_json="data_extract/recipes.json",
+    interactions_json="data_extract/interactions.json",
+    output_dir="data_transform",
+    workers=2,
+    chunk_size=1000,
+    merge=True
+):
+    shard_dir = os.path.join(output_dir, "shards")
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    inputs = [("recipes", recipes_json), ("interactions", interactions_json)]
+    index = 0
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for kind, path in inputs:
+            for chunk in chunked(iter_json_docs(find_artifact(path)), chunk_size):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                part_dir = os.path.join(shard_dir, f"part-{index:05d}")
+                pending.add(pool.submit(transform_chunk, kind, chunk, part_dir))
+                index += 1
+        for future in pending:
+            future.result()
+
+    if merge:
+        merge_shards(shard_dir, output_dir)
+        shutil.rmtree(shard_dir)
+        print(f"Transform complete! {index} chunks on {workers} workers merged into {output_dir}/")
+    else:
+        print(f"Transform complete! {index} shard parts written inside {shard_dir}/")
+
+
+# move the current csvs aside as <table>.prev so the next run can be diffed.
+# a .prev left by a run that was killed before write_changes is the last
+# complete output, so it is kept and the partial csv next to it is not
+def snapshot_previous(output_dir="data_transform"):
+    for table in TABLES:
+        path = os.path.join(output_dir, table)
+        if os.path.exists(path) and not os.path.exists(path + ".prev"):
+            os.replace(path, path + ".prev")
+
+
+# put the .prev csvs back after a run that failed before write_changes
+# finished, so the outputs and the next --changes run start from them again
+def restore_previous(output_dir="data_transform"):
+    for table in TABLES:
+        path = os.path.join(output_dir, table)
+        if os.path.exists(path + ".prev"):
+            os.replace(path + ".prev", path)
+
+
+def _row_digest(row):
+    return hashlib.blake2b("\x1f".join(row).encode("utf-8"), digest_size=16).digest()
+
+
+def _iter_csv(path):
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        yield from reader
+
+
+# compare one table against its previous output by id (first column) and
+# write the inserted, updated and deleted rows. the old version of every
+# updated row follows as a "previous" row, so consumers holding aggregates
+# can retract it. only ids and row digests of the previous output are kept
+# in memory
+def diff_table(prev_path, new_path, out_path, header):
+    previous = {}
+    if os.path.exists(prev_path):
+        for row in _iter_csv(prev_path):
+            previous[row[0]] = _row_digest(row)
+
+    counts = {"insert": 0, "update": 0, "delete": 0}
+    updated = set()
+    out_fp, writer = open_csv(out_path, ["change"] + header)
+    for row in _iter_csv(new_path):
+        digest = previous.pop(row[0], None)
+        if digest is None:
+            change = "insert"
+        elif digest != _row_digest(row):
+            change = "update"
+            updated.add(row[0])
+        else:
+            continue
+        writer.writerow([change] + row)
+        counts[change] += 1
+
+    if previous or updated:
+        for row in _iter_csv(prev_path):
+            if row[0] in previous:
+                writer.writerow(["delete"] + row)
+                counts["delete"] += 1
+            elif row[0] in updated:
+                writer.writerow(["previous"] + row)
+    out_fp.close()
+    return counts
+
+
+# write data_transform/changes/<table>.csv for every table and drop the .prev
+# files once all of them are written. changes/manifest.json records content hashes of the tables the
+# changes start from ("base") and lead to ("result"), so a consumer can tell
+# whether its own state is the base they apply to
+def write_changes(output_dir="data_transform"):
+    changes_dir = os.path.join(output_dir, "changes")
+    os.makedirs(changes_dir, exist_ok=True)
+    summary = {}
+    manifest = {"base": {}, "result": {}}
+    for table, header in TABLES.items():
+        path = os.path.join(output_dir, table)
+        summary[table] = diff_table(path + ".prev", path, os.path.join(changes_dir, table), header)
+        manifest["base"][table] = hash_file(path + ".prev") if os.path.exists(path + ".prev") else None
+        manifest["result"][table] = hash_file(path)
+    write_json_atomic(os.path.join(changes_dir, "manifest.json"), manifest)
+    for table in TABLES:
+        path = os.path.join(output_dir, table)
+        if os.path.exists(path + ".prev"):
+            os.remove(path + ".prev")
+
+    for table, counts in summary.items():
+        print(f"Changes in {table}: +{counts['insert']} ~{counts['update']} -{counts['delete']}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transform extracted JSON into CSV tables")
+    parser.add_argument("--recipes", default="data_extract/recipes.json",
+                        help="recipes extract (.json array or .ndjson, optionally .gz / .zst)")
+    parser.add_argument("--interactions", default="data_extract/interactions.json",
+                        help="interactions extract (.json array or .ndjson, optionally .gz / .zst)")
+    parser.add_argument("--output-dir", default="data_transform")
+    parser.add_argument("--output-format", choices=["csv", "parquet", "both"], default="csv",
+                        help="csv tables, typed parquet tables under <output-dir>/parquet, or both")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="transform chunks on N worker processes")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="documents per chunk in --workers mode")
+    parser.add_argument("--no-merge", action="store_true",
+                        help="leave the per-chunk shard csvs in <output-dir>/shards")
+    parser.add_argument("--changes", action="store_true",
+                        help="also write the rows inserted/updated/deleted since the last run "
+                             "to <output-dir>/changes/ (csv output only)")
+    parser.add_argument("--merge-only", action="store_true",
+                        help="only merge shards left by an earlier --no-merge run")
+    parser.add_argument("--compression", choices=sorted(CODEC_EXTENSIONS),
+                        help="compress the csvs while they are written (recipe.csv.gz, ...)")
+    args = parser.parse_args(argv)
+    if args.compression and (args.workers > 1 or args.changes or args.merge_only):
+        parser.error("--compression is only supported by the single process transform without --changes")
+    if args.workers > 1 and args.output_format != "csv":
+        parser.error("--workers only supports --output-format csv")
+    if args.changes and args.output_format == "parquet":
+        parser.error("--changes compares the csv output")
+    if args.changes and (args.no_merge or args.merge_only):
+        parser.error("--changes compares the merged csvs of a full run, not shards")
+    if args.changes:
+        snapshot_previous(args.output_dir)
+
+    try:
+        if args.merge_only:
+            merge_shards(os.path.join(args.output_dir, "shards"), args.output_dir)
+            print(f"Merged shards into {args.output_dir}/")
+        elif args.workers > 1:
+            transform_parallel(args.recipes, args.interactions, args.output_dir,
+                               args.workers, args.chunk_size, not args.no_merge)
+        else:
+            transform(args.recipes, args.interactions, args.output_dir, args.output_format,
+                      args.compression)
+
+        if args.changes:
+            write_changes(args.output_dir)
+    except BaseException:
+        if args.changes:
+            restore_previous(args.output_dir)
+        raise
 
 
 if __name__ == "__main__":
-    transform()
+    main()
@@ -1,133 +1,545 @@
-import json, csv, re, os
-from collections import defaultdict
+import argparse
+import itertools
+import json, os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_io import find_artifact
 
 VALID_DIFFICULTY = {"Easy", "Medium", "Hard"}
 
+REPORT_PATH = "data_validation/validation_report.json"
+RECORDS_PATH = "data_validation/invalid_records.ndjson"
+# rows checked, failures and seconds per rule; kept out of the report, whose
+# schema stays fixed and which should not change between runs on the same data
+RULE_STATS_PATH = "data_validation/rule_stats.json"
+
+QUANTITY_PATTERN = r"^\d+(\.\d+)?$"
+
 def is_positive_number(v):
     try:
         return float(v) > 0
     except:
         return False
 
+
+# load one transformed table, from its csv (every column as text, empty
+# cells as "", decompressed while parsing when only a .gz / .zst copy
+# exists) or from its typed parquet dataset
+def load_table(csv_path, fmt="csv"):
+    if fmt == "parquet":
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        df = pd.read_parquet(os.path.join(os.path.dirname(csv_path), "parquet", name))
+        return df.drop(columns=["created_date"], errors="ignore")
+    return pd.read_csv(find_artifact(csv_path), dtype=str, keep_default_na=False)
+
+
+# text of a column with missing values as "", the way the csv reader sees them
+def as_text(col):
+    if col.dtype == object:
+        return col.fillna("").astype(str)
+    return col.astype(str).where(col.notna(), "")
+
+
+# parse a column the way float() would: returns (values, missing, bad) where
+# missing marks empty cells and bad marks text float() rejects. text columns
+# are parsed once per distinct value, so repeated values cost nothing
+def parse_numbers(col):
+    if col.dtype != object:
+        values = col.astype(float).to_numpy()
+        missing = np.isnan(values)
+        return values, missing, np.zeros(len(col), dtype=bool)
+
+    text = col.fillna("")
+    codes, uniques = pd.factorize(text)
+    parsed = np.empty(len(uniques), dtype=float)
+    bad_unique = np.zeros(len(uniques), dtype=bool)
+    for i, v in enumerate(uniques):
+        try:
+            parsed[i] = float(v) if v != "" else np.nan
+        except (TypeError, ValueError):
+            parsed[i] = np.nan
+            bad_unique[i] = True
+    values = parsed[codes] if len(codes) else np.empty(0)
+    missing = (text == "").to_numpy()
+    bad = bad_unique[codes] if len(codes) else np.zeros(0, dtype=bool)
+    return values, missing, bad
+
+
+# regex match evaluated once per distinct value
+def match_pattern(text, pattern):
+    codes, uniques = pd.factorize(text)
+    hits = pd.Series(uniques, dtype=object).str.match(pattern).to_numpy(dtype=bool)
+    return hits[codes] if len(codes) else np.zeros(0, dtype=bool)
+
+
+# one validation rule: `check(ctx, rows)` returns a failure mask for the given
+# row numbers of `table`, and `message` is a string or `message(ctx, rows)`
+# giving one message per failing row. a rule only sees the rows that passed
+# every rule in `requires`; rules in the same `group` share one slot in the
+# per-recipe error order, with child table rows kept in row order
+class Rule:
+
+    def __init__(self, name, table, field, check, message, severity="error",
+                 requires=(), group=None):
+        self.name = name
+        self.table = table
+        self.field = field
+        self.check = check
+        self.message = message
+        self.severity = severity
+        self.requires = tuple(requires)
+        self.group = group or name
+
+
+TABLES = ("recipe", "ingredients", "steps", "interactions")
+SEVERITIES = ("error", "warning")
+
+
+# tables for one run plus everything derived from them (child rows linked to
+# their recipe, text and parsed columns), each computed once and shared by
+# every rule that asks for it
+class RuleContext:
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.index = pd.Index(tables["recipe"]["recipe_id"])
+        self._cache = {}
+
+    def cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    # child rows are joined to recipes once, by turning their recipe_id into
+    # the recipe's row position; rows of unknown recipes are dropped
+    def _link(self, table):
+        def compute():
+            df = self.tables[table]
+            if table == "recipe":
+                return df, np.arange(len(df))
+            pos = self.index.get_indexer(df["recipe_id"])
+            keep = pos >= 0
+            return df[keep].reset_index(drop=True), pos[keep]
+        return self.cached(("link", table), compute)
+
+    def frame(self, table):
+        return self._link(table)[0]
+
+    def positions(self, table):
+        return self._link(table)[1]
+
+    def text(self, table, field):
+        return self.cached(("text", table, field), lambda: as_text(self.frame(table)[field]))
+
+    def number(self, table, field):
+        return self.cached(("number", table, field), lambda: parse_numbers(self.frame(table)[field]))
+
+    def child_counts(self, table):
+        return self.cached(("counts", table), lambda: np.bincount(
+            self.positions(table), minlength=len(self.index)))
+
+    # a value float() rejects in any of the three times drops all three
+    def times(self):
+        def compute():
+            prep, prep_missing, prep_bad = self.number("recipe", "prep_time")
+            cook, cook_missing, cook_bad = self.number("recipe", "cook_time")
+            total, total_missing, total_bad = self.number("recipe", "total_time")
+            unparsable = prep_bad | cook_bad | total_bad
+            return {
+                "prep": prep, "prep_none": prep_missing | unparsable,
+                "cook": cook, "cook_none": cook_missing | unparsable,
+                "total": total, "total_none": total_missing | unparsable,
+            }
+        return self.cached("times", compute)
+
+    def difficulty(self):
+        return self.cached("difficulty", lambda: self.text("recipe", "difficulty").str.strip())
+
+    # empty and zero ratings are skipped, like the truthiness check on raw values
+    def ratings(self):
+        def compute():
+            rating = self.frame("interactions")["rating"]
+            values, missing, bad = self.number("interactions", "rating")
+            with np.errstate(invalid="ignore"):
+                checked = ~missing if rating.dtype == object else ~missing & (values != 0)
+            return values, checked, bad
+        return self.cached("ratings", compute)
+
+
+def _missing_title(ctx, rows):
+    return (ctx.text("recipe", "title") == "").to_numpy()[rows]
+
+
+def _prep_not_positive(ctx, rows):
+    t = ctx.times()
+    with np.errstate(invalid="ignore"):
+        return (t["prep_none"] | (t["prep"] <= 0))[rows]
+
+
+def _cook_negative(ctx, rows):
+    t = ctx.times()
+    with np.errstate(invalid="ignore"):
+        return (t["cook_none"] | (t["cook"] < 0))[rows]
+
+
+def _total_missing(ctx, rows):
+    return ctx.times()["total_none"][rows]
+
+
+def _total_below_parts(ctx, rows):
+    t = ctx.times()
+    prep, cook, total = t["prep"][rows], t["cook"][rows], t["total"][rows]
+    with np.errstate(invalid="ignore"):
+        parts_set = ~t["prep_none"][rows] & (prep != 0) & ~t["cook_none"][rows] & (cook != 0)
+        return parts_set & (total < prep + cook)
+
+
+def _bad_difficulty(ctx, rows):
+    return ~ctx.difficulty().isin(VALID_DIFFICULTY).to_numpy()[rows]
+
+
+def _difficulty_message(ctx, rows):
+    return ("Invalid Difficulty: " + ctx.difficulty().iloc[rows]).to_numpy()
+
+
+def _no_ingredients(ctx, rows):
+    return ctx.child_counts("ingredients")[rows] == 0
+
+
+def _quantity_format(ctx, rows):
+    qty = ctx.text("ingredients", "quantity").iloc[rows]
+    return ((qty != "").to_numpy() & ~match_pattern(qty, QUANTITY_PATTERN))
+
+
+def _quantity_format_message(ctx, rows):
+    return ("Ingredient quantity invalid: " + ctx.text("ingredients", "quantity").iloc[rows]).to_numpy()
+
+
+def _quantity_not_positive(ctx, rows):
+    values, missing, _ = ctx.number("ingredients", "quantity")
+    with np.errstate(invalid="ignore"):
+        return ~missing[rows] & (values[rows] <= 0)
+
+
+def _quantity_positive_message(ctx, rows):
+    return ("Ingredient quantity must be positive: " + ctx.text("ingredients", "quantity").iloc[rows]).to_numpy()
+
+
+def _no_steps(ctx, rows):
+    return ctx.child_counts("steps")[rows] == 0
+
+
+def _rating_not_number(ctx, rows):
+    _, checked, bad = ctx.ratings()
+    return (checked & bad)[rows]
+
+
+def _rating_number_message(ctx, rows):
+    return ("Invalid interaction rating: " + ctx.text("interactions", "rating").iloc[rows]).to_numpy()
+
+
+def _rating_out_of_range(ctx, rows):
+    values, checked, _ = ctx.ratings()
+    with np.errstate(invalid="ignore"):
+        return checked[rows] & ((values[rows] < 0) | (values[rows] > 5))
+
+
+def _rating_range_message(ctx, rows):
+    values, _, _ = ctx.ratings()
+    return [f"Interaction rating out of range (0–5): {float(v)}" for v in values[rows]]
+
+
+# the rule registry; errors for a recipe are reported in this order
+RULES = [
+    Rule("missing_title", "recipe", "title", _missing_title, "Missing Title"),
+    Rule("prep_time_positive", "recipe", "prep_time", _prep_not_positive, "PrepTime must be > 0"),
+    Rule("cook_time_non_negative", "recipe", "cook_time", _cook_negative, "CookTime must be >= 0"),
+    Rule("total_time_present", "recipe", "total_time", _total_missing, "TotalTime missing"),
+    Rule("total_time_covers_parts", "recipe", "total_time", _total_below_parts,
+         "TotalTime < PrepTime + CookTime", requires=["total_time_present"]),
+    Rule("valid_difficulty", "recipe", "difficulty", _bad_difficulty, _difficulty_message),
+    Rule("has_ingredients", "recipe", "recipe_id", _no_ingredients, "No ingredients found",
+         group="ingredients"),
+    Rule("quantity_format", "ingredients", "quantity", _quantity_format, _quantity_format_message,
+         group="ingredients"),
+    Rule("quantity_positive", "ingredients", "quantity", _quantity_not_positive, _quantity_positive_message,
+         requires=["quantity_format"], group="ingredients"),
+    Rule("has_steps", "recipe", "recipe_id", _no_steps, "No steps found"),
+    Rule("rating_is_number", "interactions", "rating", _rating_not_number, _rating_number_message,
+         group="interaction_rating"),
+    Rule("rating_in_range", "interactions", "rating", _rating_out_of_range, _rating_range_message,
+         requires=["rating_is_number"], group="interaction_rating"),
+]
+
+
+# a compiled rule set: checked once up front, then run against the tables
+# rule by rule, timing each one
+class RulePlan:
+
+    def __init__(self, rules):
+        names = set()
+        self.group_order = {}
+        self.columns = {table: set() for table in TABLES}
+        for rule in rules:
+            if rule.name in names:
+                raise ValueError(f"duplicate rule: {rule.name}")
+            if rule.table not in TABLES:
+                raise ValueError(f"rule {rule.name}: unknown table {rule.table}")
+            if rule.severity not in SEVERITIES:
+                raise ValueError(f"rule {rule.name}: unknown severity {rule.severity}")
+            for req in rule.requires:
+                if req not in names:
+                    raise ValueError(f"rule {rule.name}: requires {req}, which must come earlier")
+            names.add(rule.name)
+            self.group_order.setdefault(rule.group, len(self.group_order))
+            self.columns[rule.table].add(rule.field)
+        self.rules = list(rules)
+        self.tables = {rule.name: rule.table for rule in rules}
+        for rule in rules:
+            for req in rule.requires:
+                if self.tables[req] != rule.table:
+                    raise ValueError(f"rule {rule.name}: requires {req} on another table")
+        self.has_warnings = any(rule.severity == "warning" for rule in rules)
+
+    # returns a frame of (position, group, seq, severity, rule, message) rows and
+    # per rule stats (rows checked, failures, seconds)
+    def run(self, tables):
+        for table, columns in self.columns.items():
+            missing = columns - set(tables[table].columns)
+            if missing:
+                raise ValueError(f"{table} is missing columns: {sorted(missing)}")
+
+        ctx = RuleContext(tables)
+        passed = {}
+        found = []
+        stats = {}
+        for rule in self.rules:
+            start = time.perf_counter()
+            active = np.ones(len(ctx.frame(rule.table)), dtype=bool)
+            for req in rule.requires:
+                active &= passed[req]
+            rows = np.flatnonzero(active)
+
+            failed = rows[np.asarray(rule.check(ctx, rows), dtype=bool)]
+            active[failed] = False
+            passed[rule.name] = active
+
+            if len(failed):
+                messages = rule.message if isinstance(rule.message, str) else rule.message(ctx, failed)
+                found.append(pd.DataFrame({
+                    "position": ctx.positions(rule.table)[failed],
+                    "group": self.group_order[rule.group],
+                    "seq": failed if rule.table != "recipe" else 0,
+                    "severity": rule.severity,
+                    "rule": rule.name,
+                    "message": messages,
+                }))
+            stats[rule.name] = {
+                "table": rule.table,
+                "severity": rule.severity,
+                "rows_checked": int(len(rows)),
+                "failures": int(len(failed)),
+                "seconds": round(time.perf_counter() - start, 6),
+            }
+
+        columns = ["position", "group", "seq", "severity", "rule", "message"]
+        errors = pd.concat(found, ignore_index=True) if found else pd.DataFrame(columns=columns)
+        return errors, stats
+
+
+def compile_rules(rules=None):
+    return RulePlan(RULES if rules is None else rules)
+
+
+# (position, [(rule, message), ...]) per recipe for one severity, in recipe,
+# group, row order; yielded one recipe at a time
+def iter_messages(found, severity):
+    found = found[found["severity"] == severity]
+    found = found.sort_values(["position", "group", "seq"], kind="mergesort")
+    rows = zip(found["position"].to_numpy(), found["rule"].to_numpy(), found["message"].to_numpy())
+    for pos, items in itertools.groupby(rows, key=lambda row: row[0]):
+        yield int(pos), [(rule, str(message)) for _, rule, message in items]
+
+
+# the classic report: every invalid record and every valid id, written as
+# one json document at the end
+class FullReport:
+
+    def __init__(self, path=REPORT_PATH):
+        self.path = path
+        self.invalid_records = []
+        self.warnings = []
+
+    def add_invalid(self, recipe_id, errors):
+        self.invalid_records.append({"recipe_id": recipe_id, "errors": [m for _, m in errors]})
+
+    def add_warnings(self, recipe_id, warnings):
+        self.warnings.append({"recipe_id": recipe_id, "warnings": [m for _, m in warnings]})
+
+    def finish(self, recipe_ids, invalid_positions, has_warnings):
+        invalid = set(invalid_positions)
+
+        # Final report structure
+        report = {
+            "summary": {
+                "total_recipes": len(recipe_ids),
+                "valid_recipes": 0,
+                "invalid_recipes": 0
+            },
+            "invalid_records": self.invalid_records,
+            "valid_records": [rid for pos, rid in enumerate(recipe_ids) if pos not in invalid]
+        }
+        if has_warnings:
+            report["warnings"] = self.warnings
+
+        report["summary"]["valid_recipes"] = len(report["valid_records"])
+        report["summary"]["invalid_recipes"] = len(report["invalid_records"])
+
+        write_report(self.path, report)
+        return report
+
+
+# report whose own output is bounded: invalid records go straight to an
+# ndjson file as they are produced, and the report keeps only counters, a
+# histogram per rule and a reservoir sample of at most `sample_size`
+# failures per rule. validate_recipes still loads every table and the frame
+# of all failures before the report sees them, so the run as a whole is not
+# bounded by the sample size; this saves the per-record lists FullReport
+# builds and keeps validation_report.json small
+class StreamingReport:
+
+    def __init__(self, path=REPORT_PATH, records_path=RECORDS_PATH, sample_size=20, seed=0):
+        self.path = path
+        self.records_path = records_path
+        self.sample_size = sample_size
+        self.rng = random.Random(seed)
+        self.invalid = 0
+        self.histograms = {"error": Counter(), "warning": Counter()}
+        self.samples = defaultdict(list)
+        os.makedirs(os.path.dirname(records_path) or ".", exist_ok=True)
+        self._fp = open(records_path, "w", encoding="utf-8")
+
+    def _count(self, severity, recipe_id, messages):
+        for rule, message in messages:
+            self.histograms[severity][rule] += 1
+            seen = self.histograms[severity][rule]
+            sample = self.samples[rule]
+            item = {"recipe_id": recipe_id, "message": message}
+            if len(sample) < self.sample_size:
+                sample.append(item)
+            else:
+                j = self.rng.randrange(seen)
+                if j < self.sample_size:
+                    sample[j] = item
+
+    def add_invalid(self, recipe_id, errors):
+        self._fp.write(json.dumps({"recipe_id": recipe_id, "errors": [m for _, m in errors]},
+                                  ensure_ascii=False) + "\n")
+        self.invalid += 1
+        self._count("error", recipe_id, errors)
+
+    def add_warnings(self, recipe_id, warnings):
+        self._count("warning", recipe_id, warnings)
+
+    def finish(self, recipe_ids, invalid_positions, has_warnings):
+        self._fp.close()
+        report = {
+            "summary": {
+                "total_recipes": len(recipe_ids),
+                "valid_recipes": len(recipe_ids) - self.invalid,
+                "invalid_recipes": self.invalid
+            },
+            "invalid_records_path": self.records_path,
+            "error_histogram": dict(self.histograms["error"].most_common()),
+            "samples": dict(self.samples)
+        }
+        if has_warnings:
+            report["warning_histogram"] = dict(self.histograms["warning"].most_common())
+
+        write_report(self.path, report)
+        return report
+
+
+# recipes keyed by id like a dict would: the last row for an id wins and
+# keeps the position where that id first appeared
+def unique_recipes(recipes):
+    order = pd.unique(recipes["recipe_id"])
+    last = recipes.drop_duplicates("recipe_id", keep="last").set_index("recipe_id", drop=False)
+    return last.loc[order].reset_index(drop=True)
+
+
+def write_report(path, report):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+DEFAULT_PLAN = compile_rules()
+
+
 def validate_recipes(
     csv_path="data_transform/recipe.csv",
     ingredients_path="data_transform/ingredients.csv",
     steps_path="data_transform/steps.csv",
-    interactions_path="data_transform/interactions.csv"
+    interactions_path="data_transform/interactions.csv",
+    fmt="csv",
+    plan=None,
+    report=None,
+    stats_path=RULE_STATS_PATH
 ):
 
-    # Load recipes
-    recipes = {}
-    with open(csv_path, encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            recipes[row["recipe_id"]] = row
-
-    # Load ingredients
-    ingredients = defaultdict(list)
-    with open(ingredients_path, encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            ingredients[row["recipe_id"]].append(row)
-
-    # Load steps
-    steps = defaultdict(list)
-    with open(steps_path, encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            steps[row["recipe_id"]].append(row)
-
-    # Load interactions
-    interactions = defaultdict(list)
-    with open(interactions_path, encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            interactions[row["recipe_id"]].append(row)
-
-    # Final report structure
-    report = {
-        "summary": {
-            "total_recipes": len(recipes),
-            "valid_recipes": 0,
-            "invalid_recipes": 0
-        },
-        "invalid_records": [],
-        "valid_records": []
-    }
-
-    # Validate each recipe
-    for rid, rec in recipes.items():
-        errors = []
-
-        if not rec.get("title"):
-            errors.append("Missing Title")
+    recipes = unique_recipes(load_table(csv_path, fmt))
+    ingredients = load_table(ingredients_path, fmt)
+    steps = load_table(steps_path, fmt)
+    interactions = load_table(interactions_path, fmt)
 
-        try:
-            prep = float(rec.get("prep_time")) if rec.get("prep_time") else None
-            cook = float(rec.get("cook_time")) if rec.get("cook_time") else None
-            total = float(rec.get("total_time")) if rec.get("total_time") else None
-        except:
-            prep, cook, total = None, None, None
-
-        if prep is None or prep <= 0:
-            errors.append("PrepTime must be > 0")
-
-        if cook is None or cook < 0:
-            errors.append("CookTime must be >= 0")
-
-        if total is None:
-            errors.append("TotalTime missing")
-        else:
-            if prep and cook:
-                if total < prep + cook:
-                    errors.append("TotalTime < PrepTime + CookTime")
-
-
-        diff = (rec.get("difficulty") or "").strip()
-        if diff not in VALID_DIFFICULTY:
-            errors.append(f"Invalid Difficulty: {diff}")
-
-        if len(ingredients[rid]) == 0:
-            errors.append("No ingredients found")
-        else:
-            for ing in ingredients[rid]:
-                qty = ing.get("quantity")
-                if qty:
-                    if not re.match(r"^\d+(\.\d+)?$", str(qty)):
-                        errors.append(f"Ingredient quantity invalid: {qty}")
-                    else:
-                        if float(qty) <= 0:
-                            errors.append(f"Ingredient quantity must be positive: {qty}")
-
-        if len(steps[rid]) == 0:
-            errors.append("No steps found")
-
-        for inter in interactions.get(rid, []):
-            rstr = inter.get("rating")
-            if rstr:
-                try:
-                    rv = float(rstr)
-                    if rv < 0 or rv > 5:
-                        errors.append(f"Interaction rating out of range (0–5): {rv}")
-                except:
-                    errors.append(f"Invalid interaction rating: {rstr}")
-
-        if errors:
-            report["invalid_records"].append({"recipe_id": rid, "errors": errors})
-        else:
-            report["valid_records"].append(rid)
-
-    report["summary"]["valid_recipes"] = len(report["valid_records"])
-    report["summary"]["invalid_recipes"] = len(report["invalid_records"])
-
-    os.makedirs("data_validation", exist_ok=True)
-
-    with open("data_validation/validation_report.json", "w", encoding="utf-8") as f:
-        json.dump(report, f, indent=2)
+    plan = plan or DEFAULT_PLAN
+    found, rule_stats = plan.run({
+        "recipe": recipes, "ingredients": ingredients,
+        "steps": steps, "interactions": interactions,
+    })
+    report = report or FullReport()
+
+    ids = recipes["recipe_id"].tolist()
+    invalid_positions = []
+    for pos, errors in iter_messages(found, "error"):
+        invalid_positions.append(pos)
+        report.add_invalid(ids[pos], errors)
+    if plan.has_warnings:
+        for pos, warnings in iter_messages(found, "warning"):
+            report.add_warnings(ids[pos], warnings)
+
+    report = report.finish(ids, invalid_positions, plan.has_warnings)
+    write_report(stats_path, rule_stats)
 
     print("Validation Complete.")
     print("Summary:", report["summary"])
+    slowest = sorted(rule_stats.items(), key=lambda kv: kv[1]["seconds"], reverse=True)
+    print("Time per rule:", ", ".join(f"{name} {stat['seconds']:.3f}s" for name, stat in slowest))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate the transformed tables")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="read data_transform/*.csv or the typed data_transform/parquet tables")
+    parser.add_argument("--stream-report", action="store_true",
+                        help="write invalid records to data_validation/invalid_records.ndjson as they are "
+                             "found and keep only counts, histograms and samples in the report")
+    parser.add_argument("--sample-size", type=int, default=20,
+                        help="example failures kept per rule in --stream-report mode")
+    args = parser.parse_args(argv)
+
+    report = StreamingReport(sample_size=args.sample_size) if args.stream_report else None
+    validate_recipes(fmt=args.format, report=report)
 
 
 if __name__ == "__main__":
-    validate_recipes()
+    main()
@@ -0,0 +1,434 @@
+import asyncio
+import copy
+import random
+import string
+import threading
+from datetime import datetime
+
+
+# small in-process stand-in for the firestore client, covering the calls the
+# pipeline makes (collections, subcollections, collection groups, ordered and
+# ranged queries, batches, bulk writers). used to run the exporters and
+# seeders offline.
+
+AUTO_ID_CHARS = string.ascii_letters + string.digits
+_MISSING = object()
+
+
+def auto_id(rng=random):
+    return "".join(rng.choice(AUTO_ID_CHARS) for _ in range(20))
+
+
+def _sort_key(value):
+    # firestore orders values by type first, then by value
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, FakeDocumentReference):
+        return (5, value.path)
+    return (6, str(value))
+
+
+class FakeDocumentSnapshot:
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+
+    def __init__(self, client, parent, doc_id):
+        self._client = client
+        self.parent = parent
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self.parent.path}/{self.id}"
+
+    def collection(self, name):
+        return FakeCollectionReference(self._client, name, self)
+
+    def set(self, data, merge=False):
+        self._client._set(self, data, merge)
+
+    def update(self, data):
+        self._client._set(self, data, True)
+
+    def delete(self):
+        self._client._delete(self)
+
+    def get(self):
+        return FakeDocumentSnapshot(self, self._client._docs.get(self.path))
+
+
+class FakeQuery:
+
+    def __init__(self, client, parent=None, collection_id=None, all_descendants=False,
+                 filters=(), orders=(), start=None, end=None, limit=None):
+        self._client = client
+        self._parent = parent
+        self._collection_id = collection_id
+        self._all_descendants = all_descendants
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._start = start
+        self._end = end
+        self._limit = limit
+
+    def _copy(self, **changes):
+        kwargs = dict(
+            parent=self._parent, collection_id=self._collection_id,
+            all_descendants=self._all_descendants, filters=self._filters,
+            orders=self._orders, start=self._start, end=self._end, limit=self._limit,
+        )
+        kwargs.update(changes)
+        return FakeQuery(self._client, **kwargs)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_at(self, values):
+        return self._copy(start=(values, True))
+
+    def start_after(self, values):
+        return self._copy(start=(values, False))
+
+    def end_before(self, values):
+        return self._copy(end=(values, False))
+
+    def end_at(self, values):
+        return self._copy(end=(values, True))
+
+    def _field(self, snapshot, field):
+        if field == "__name__":
+            return snapshot.reference.path
+        return (snapshot._data or {}).get(field, _MISSING)
+
+    def _cursor_values(self, cursor):
+        values, inclusive = cursor
+        if isinstance(values, dict):
+            values = [values[f] for f, _ in self._effective_orders()[:len(values)]]
+        out = []
+        for (field, _), value in zip(self._effective_orders(), values):
+            if field == "__name__" and isinstance(value, str) and "/" not in value:
+                value = self._resolve_name(value)
+            elif field == "__name__" and isinstance(value, FakeDocumentReference):
+                value = value.path
+            out.append(value)
+        return out, inclusive
+
+    def _resolve_name(self, doc_id):
+        return f"{self._parent_path()}/{doc_id}"
+
+    def _parent_path(self):
+        base = self._parent.path + "/" if self._parent is not None else ""
+        return base + self._collection_id
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        if "__name__" not in [f for f, _ in orders]:
+            direction = orders[-1][1] if orders else "ASCENDING"
+            orders.append(("__name__", direction))
+        return orders
+
+    def _matches(self, snapshot):
+        for field, op, value in self._filters:
+            actual = self._field(snapshot, field)
+            if actual is _MISSING:
+                return False
+            if field == "__name__" and isinstance(value, FakeDocumentReference):
+                value = value.path
+            a, b = _sort_key(actual), _sort_key(value)
+            if op == "==" and not a == b:
+                return False
+            if op == "<" and not a < b:
+                return False
+            if op == "<=" and not a <= b:
+                return False
+            if op == ">" and not a > b:
+                return False
+            if op == ">=" and not a >= b:
+                return False
+            if op == "in" and actual not in value:
+                return False
+        for field, _ in self._orders:
+            if self._field(snapshot, field) is _MISSING:
+                return False
+        return True
+
+    def _key(self, snapshot):
+        return [_sort_key(self._field(snapshot, f)) for f, _ in self._effective_orders()]
+
+    def _compare_cursor(self, snapshot, cursor):
+        values, _ = self._cursor_values(cursor)
+        key = self._key(snapshot)[:len(values)]
+        target = [_sort_key(v) for v in values]
+        return (key > target) - (key < target)
+
+    def stream(self, transaction=None):
+        snapshots = [s for s in self._client._scan(self) if self._matches(s)]
+        orders = self._effective_orders()
+        for index in reversed(range(len(orders))):
+            field, direction = orders[index]
+            snapshots.sort(key=lambda s: _sort_key(self._field(s, field)),
+                           reverse=direction == "DESCENDING")
+        if self._start is not None:
+            inclusive = self._start[1]
+            snapshots = [s for s in snapshots
+                         if self._compare_cursor(s, self._start) > (-1 if inclusive else 0)]
+        if self._end is not None:
+            inclusive = self._end[1]
+            snapshots = [s for s in snapshots
+                         if self._compare_cursor(s, self._end) < (1 if inclusive else 0)]
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+
+    def __init__(self, client, collection_id, parent=None):
+        super().__init__(client, parent=parent, collection_id=collection_id)
+        self.id = collection_id
+
+    @property
+    def path(self):
+        return self._parent_path()
+
+    @property
+    def parent(self):
+        return self._parent
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self, doc_id or auto_id(self._client.rng))
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeWriteBatch:
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference, data, merge))
+
+    def commit(self):
+        with self._client._lock:
+            for reference, data, merge in self._writes:
+                self._client._set(reference, data, merge)
+        self._client.commits += 1
+        writes, self._writes = self._writes, []
+        return writes
+
+    def __len__(self):
+        return len(self._writes)
+
+
+# writes land as soon as they are queued; the options are accepted and ignored
+class FakeBulkWriter:
+
+    def __init__(self, client, options=None):
+        self._client = client
+        self._on_success = None
+
+    def on_write_result(self, callback):
+        self._on_success = callback
+
+    def set(self, reference, data, merge=False):
+        self._client._set(reference, data, merge)
+        if self._on_success:
+            self._on_success(reference, None, self)
+
+    def create(self, reference, data):
+        self.set(reference, data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeFirestore:
+
+    def __init__(self, seed=0):
+        self._docs = {}
+        self._refs = {}
+        self._lock = threading.RLock()
+        self.rng = random.Random(seed)
+        self.commits = 0
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def collection_group(self, collection_id):
+        return FakeQuery(self, collection_id=collection_id, all_descendants=True)
+
+    def document(self, path):
+        parts = path.split("/")
+        ref = None
+        for col, doc_id in zip(parts[::2], parts[1::2]):
+            ref = (ref.collection(col) if ref else self.collection(col)).document(doc_id)
+        return ref
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def bulk_writer(self, options=None):
+        return FakeBulkWriter(self, options)
+
+    def _set(self, reference, data, merge):
+        with self._lock:
+            current = self._docs.get(reference.path) if merge else None
+            new = dict(current or {})
+            new.update(copy.deepcopy(data))
+            self._docs[reference.path] = new
+            self._refs[reference.path] = reference
+
+    def _delete(self, reference):
+        with self._lock:
+            self._docs.pop(reference.path, None)
+            self._refs.pop(reference.path, None)
+
+    def _scan(self, query):
+        with self._lock:
+            items = list(self._docs.items())
+        for path, data in items:
+            ref = self._refs[path]
+            if query._all_descendants:
+                if ref.parent.id != query._collection_id:
+                    continue
+            elif ref.parent.path != query._parent_path():
+                continue
+            yield FakeDocumentSnapshot(ref, data)
+
+    def count(self, collection):
+        return sum(1 for _ in self.collection(collection).stream())
+
+
+# parse the iso timestamps the exporter writes back into datetimes
+def _revive(doc, fields=("CreatedAt", "JoinedAt")):
+    doc = dict(doc)
+    for field in fields:
+        if isinstance(doc.get(field), str):
+            doc[field] = datetime.fromisoformat(doc[field])
+    return doc
+
+
+# fake client pre-filled from extract files (recipes/interactions/users),
+# handy for running the exporter end to end without credentials
+def from_extracts(recipes=None, interactions=None, users=None, seed=0):
+    from pipeline_io import iter_json_docs
+
+    db = FakeFirestore(seed)
+    for path, collection in ((recipes, "Recipe"), (interactions, "Interaction")):
+        if path:
+            for doc in iter_json_docs(path):
+                doc = _revive(doc)
+                db.collection(collection).document(doc.pop("id")).set(doc)
+    if users:
+        for doc in iter_json_docs(users):
+            doc = _revive(doc)
+            activities = doc.pop("Activities", [])
+            user_ref = db.collection("Users").document(doc.pop("id"))
+            user_ref.set(doc)
+            for act in activities:
+                act = _revive(act)
+                user_ref.collection("Activities").document(act.pop("id")).set(act)
+    return db
+
+
+
+# asyncio view of a fake client, shaped like firestore's AsyncClient for the
+# calls the streaming reader makes (collection(...).stream() as an async
+# iterator). to stand in for a network stream, page k of `page_size`
+# documents only arrives `latency` * k seconds after the query started; a
+# consumer that falls behind finds the next pages already there
+class AsyncFakeFirestore:
+
+    def __init__(self, db, page_size=300, latency=0.0):
+        self.db = db
+        self.page_size = page_size
+        self.latency = latency
+
+    def collection(self, name):
+        return AsyncFakeQuery(self, self.db.collection(name))
+
+
+class AsyncFakeQuery:
+
+    def __init__(self, client, query):
+        self._client = client
+        self._query = query
+
+    async def stream(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for i, snapshot in enumerate(self._query.stream()):
+            if i % self._client.page_size == 0:
+                page = i // self._client.page_size + 1
+                await asyncio.sleep(max(0.0, start + page * self._client.latency - loop.time()))
+            yield snapshot
+
+
+# stand-in for app traffic when trying out live ingestion offline: keeps
+# writing copies of existing interactions (and every tenth document a copy
+# of a recipe) with fresh ids and CreatedAt set to now, at about `rate`
+# documents per second until `stop` is set
+def simulate_writes(db, rate, stop, seed=0):
+    from datetime import timezone
+
+    rng = random.Random(seed)
+    recipes = [s.to_dict() for s in db.collection("Recipe").limit(1000).stream()]
+    interactions = [s.to_dict() for s in db.collection("Interaction").limit(1000).stream()]
+    recipe_ids = [s.id for s in db.collection("Recipe").stream()]
+    written = 0
+    while not stop.wait(1 / rate):
+        now = datetime.now(timezone.utc)
+        if (written % 10 == 0 and recipes) or not interactions:
+            ref = db.collection("Recipe").document(auto_id(rng))
+            ref.set(dict(rng.choice(recipes), CreatedAt=now))
+            recipe_ids.append(ref.id)
+        else:
+            doc = dict(rng.choice(interactions), CreatedAt=now)
+            if recipe_ids:
+                doc["RecipeId"] = rng.choice(recipe_ids)
+            db.collection("Interaction").document(auto_id(rng)).set(doc)
+        written += 1
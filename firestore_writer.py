@@ -0,0 +1,209 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as api_exceptions
+
+
+# firestore rejects batches with more writes than this
+MAX_BATCH_SIZE = 500
+
+# errors worth retrying: contention, timeouts, throttling, transient outages
+RETRYABLE = (
+    api_exceptions.Aborted,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.InternalServerError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+# firestore client for the seeders: the in-process fake, the emulator when
+# FIRESTORE_EMULATOR_HOST is set, or the real project via config/projectKey.json
+def connect(fake=False, seed=0):
+    if fake:
+        from fake_firestore import FakeFirestore
+        return FakeFirestore(seed)
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore as gcloud_firestore
+        return gcloud_firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-etl"))
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(os.path.join("config", "projectKey.json")))
+    return firestore.client()
+
+
+class _Progress:
+
+    def __init__(self, label, report_every):
+        self.label = label
+        self.report_every = report_every
+        self.count = 0
+        self.retries = 0
+        self._next_report = report_every
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, docs=0, retries=0):
+        with self._lock:
+            self.count += docs
+            self.retries += retries
+            due = self.report_every and self.count >= self._next_report
+            if due:
+                self._next_report += self.report_every
+        if due:
+            self.report()
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def report(self, final=False):
+        elapsed = self.elapsed()
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        status = "done" if final else "progress"
+        print(f"[{self.label}] {status}: {self.count} docs written, {rate:.0f} docs/sec, "
+              f"{self.retries} retries")
+
+
+# groups set() calls into write batches and commits them on a thread pool.
+# at most 2 * concurrency batches are queued, so a fast producer blocks
+# instead of buffering millions of documents. failed commits are retried
+# with exponential backoff and jitter; a batch is atomic, so replaying it is safe
+class BatchWriter:
+
+    def __init__(self, db, batch_size=MAX_BATCH_SIZE, concurrency=4, max_retries=5,
+                 backoff=0.5, label="docs", report_every=10000):
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}")
+        self.db = db
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.progress = _Progress(label, report_every)
+        self._pending = []
+        self._futures = set()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def count(self):
+        return self.progress.count
+
+    def set(self, reference, data, merge=False):
+        self._pending.append((reference, data, merge))
+        if len(self._pending) >= self.batch_size:
+            self._submit()
+
+    def _submit(self):
+        writes, self._pending = self._pending, []
+        self._slots.acquire()
+        future = self._pool.submit(self._commit, writes)
+        future.add_done_callback(lambda f: self._slots.release())
+        # drop finished batches as we go, surfacing the first failure
+        done = {f for f in self._futures if f.done()}
+        self._futures -= done
+        self._futures.add(future)
+        for f in done:
+            f.result()
+
+    def _commit(self, writes):
+        for attempt in range(self.max_retries + 1):
+            batch = self.db.batch()
+            for reference, data, merge in writes:
+                batch.set(reference, data, merge=merge)
+            try:
+                batch.commit()
+                break
+            except RETRYABLE:
+                if attempt == self.max_retries:
+                    raise
+                self.progress.add(retries=1)
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.0))
+        self.progress.add(docs=len(writes))
+
+    # commit whatever is buffered and wait for every batch in flight
+    def flush(self):
+        if self._pending:
+            self._submit()
+        futures, self._futures = self._futures, set()
+        for f in futures:
+            f.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+        self.progress.report(final=True)
+
+
+# the same interface on top of the client's BulkWriter, which does its own
+# batching, retries and 500/50/5 ramp up
+class BulkWriter:
+
+    def __init__(self, db, max_ops_per_second=500, label="docs", report_every=10000):
+        from google.cloud.firestore_v1.bulk_writer import BulkRetry, BulkWriterOptions
+
+        options = BulkWriterOptions(
+            initial_ops_per_second=min(500, max_ops_per_second),
+            max_ops_per_second=max_ops_per_second,
+            retry=BulkRetry.exponential,
+        )
+        self.progress = _Progress(label, report_every)
+        self._writer = db.bulk_writer(options=options)
+        self._writer.on_write_result(lambda ref, result, bw: self.progress.add(docs=1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def count(self):
+        return self.progress.count
+
+    def set(self, reference, data, merge=False):
+        self._writer.set(reference, data, merge=merge)
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+        self.progress.report(final=True)
+
+
+def open_writer(db, mode="batch", batch_size=MAX_BATCH_SIZE, concurrency=4,
+                max_ops_per_second=500, label="docs", report_every=10000):
+    if mode == "bulk":
+        return BulkWriter(db, max_ops_per_second, label, report_every)
+    return BatchWriter(db, batch_size, concurrency, label=label, report_every=report_every)
+
+
+def add_writer_args(parser):
+    parser.add_argument("--mode", choices=["batch", "bulk"], default="batch",
+                        help="write batches on a thread pool, or the client's BulkWriter")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help=f"writes per batch (max {MAX_BATCH_SIZE})")
+    parser.add_argument("--concurrency", type=int, default=4, help="batches committed in parallel")
+    parser.add_argument("--max-ops", type=int, default=500,
+                        help="ops/sec ceiling for --mode bulk")
+    parser.add_argument("--fake", action="store_true",
+                        help="write to an in-process fake instead of Firestore; "
+                             "set FIRESTORE_EMULATOR_HOST to use the emulator")
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from pipeline_io import read_json, write_json_atomic
+
+
+CACHE_DIR = ".pipeline_cache"
+HASH_BUFFER = 1024 * 1024
+
+
+# content hash of a file, streamed so large extracts are never loaded whole
+def hash_file(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BUFFER), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# local cache of stage outputs keyed by a fingerprint of everything the stage
+# depends on: its input files, its code, its parameters and the fingerprints
+# of the stages before it. the manifest lives in <root>/manifest.json and the
+# cached copies of each entry's outputs under <root>/objects/<fingerprint>/
+class StageCache:
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        manifest = read_json(self.manifest_path, {})
+        self.entries = manifest.get("entries", {})
+        # content hashes remembered by (size, mtime) so unchanged files are
+        # not re-read on every run
+        self.files = manifest.get("files", {})
+
+    def file_hash(self, path):
+        st = os.stat(path)
+        with self._lock:
+            known = self.files.get(path)
+        if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+            return known["hash"]
+        digest = hash_file(path)
+        with self._lock:
+            self.files[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": digest}
+        return digest
+
+    def _hash_or_missing(self, path):
+        return self.file_hash(path) if os.path.exists(path) else None
+
+    def fingerprint(self, name, inputs=(), code=(), params=None, upstream=()):
+        h = hashlib.blake2b(digest_size=16)
+        parts = {
+            "stage": name,
+            "inputs": {p: self._hash_or_missing(p) for p in sorted(inputs)},
+            "code": {p: self._hash_or_missing(p) for p in sorted(code)},
+            "params": params or {},
+            "upstream": list(upstream),
+        }
+        h.update(json.dumps(parts, sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def _object_path(self, fp, path):
+        return os.path.join(self.root, "objects", fp, os.path.normpath(path))
+
+    # put the cached outputs for `fp` back in place. returns False when there
+    # is no usable entry, in which case the stage has to run
+    def restore(self, fp, outputs):
+        with self._lock:
+            entry = self.entries.get(fp)
+        if entry is None or sorted(entry["outputs"]) != sorted(outputs):
+            return False
+        if not all(os.path.exists(self._object_path(fp, p)) for p in outputs):
+            return False
+
+        for path, digest in entry["outputs"].items():
+            if os.path.exists(path) and self.file_hash(path) == digest:
+                continue
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            shutil.copyfile(self._object_path(fp, path), tmp)
+            os.replace(tmp, path)
+
+        with self._lock:
+            entry["last_used"] = time.time()
+        return True
+
+    # copy the outputs a stage just wrote into the cache under `fp`
+    def store(self, fp, outputs):
+        recorded, size = {}, 0
+        for path in outputs:
+            target = self._object_path(fp, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(path, target)
+            recorded[path] = self.file_hash(path)
+            size += os.path.getsize(target)
+
+        now = time.time()
+        with self._lock:
+            self.entries[fp] = {"outputs": recorded, "size": size, "created": now, "last_used": now}
+        self.save()
+
+    def _drop(self, fp):
+        self.entries.pop(fp, None)
+        shutil.rmtree(os.path.join(self.root, "objects", fp), ignore_errors=True)
+
+    # drop entries unused for longer than max_age seconds, then the least
+    # recently used ones until the cache fits in max_bytes
+    def evict(self, max_bytes=None, max_age=None):
+        evicted = []
+        with self._lock:
+            if max_age is not None:
+                cutoff = time.time() - max_age
+                for fp, entry in list(self.entries.items()):
+                    if entry["last_used"] < cutoff:
+                        self._drop(fp)
+                        evicted.append(fp)
+            if max_bytes is not None:
+                by_age = sorted(self.entries.items(), key=lambda item: item[1]["last_used"])
+                total = sum(entry["size"] for _, entry in by_age)
+                for fp, entry in by_age:
+                    if total <= max_bytes:
+                        break
+                    total -= entry["size"]
+                    self._drop(fp)
+                    evicted.append(fp)
+            # forget hashes of files that no longer exist
+            self.files = {p: v for p, v in self.files.items() if os.path.exists(p)}
+        self.save()
+        return evicted
+
+    def size(self):
+        with self._lock:
+            return sum(entry["size"] for entry in self.entries.values())
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                manifest = {"entries": dict(self.entries), "files": dict(self.files)}
+            write_json_atomic(self.manifest_path, manifest)
@@ -0,0 +1,269 @@
+import gzip
+import io
+import json
+import os
+import time
+
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+# artifacts ending in one of these are compressed with that codec
+# (recipes.json.gz, recipe.csv.zst, ...)
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+CODEC_EXTENSIONS = {codec: ext for ext, codec in COMPRESSION_EXTENSIONS.items()}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+IO_BUFFER = 1024 * 1024
+
+
+def compression_for(path):
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1])
+
+
+def strip_compression(path):
+    root, ext = os.path.splitext(path)
+    return root if ext in COMPRESSION_EXTENSIONS else path
+
+
+# open a file for streaming reads or writes ("rb", "wb", "rt", "wt"),
+# compressing or decompressing on the fly when `compression` (by default
+# the one the extension names) is set. data passes through in buffer sized
+# pieces, so a compressed file is never inflated in memory as a whole
+def open_artifact(path, mode="rb", compression=None, encoding="utf-8", newline=None):
+    compression = compression or compression_for(path)
+    writing = mode[0] == "w"
+    if compression is None:
+        if "b" in mode:
+            return open(path, mode[0] + "b", buffering=IO_BUFFER)
+        return open(path, mode[0], buffering=IO_BUFFER, encoding=encoding, newline=newline)
+
+    if compression == "gzip":
+        stream = gzip.open(path, mode[0] + "b", compresslevel=GZIP_LEVEL)
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"{path}: zstd artifacts need the zstandard package") from None
+        fp = open(path, mode[0] + "b")
+        if writing:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            stream = compressor.stream_writer(fp, closefd=True, write_return_read=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(fp, read_across_frames=True, closefd=True)
+    else:
+        raise ValueError(f"unknown compression {compression!r}")
+    stream = io.BufferedWriter(stream, IO_BUFFER) if writing else io.BufferedReader(stream, IO_BUFFER)
+    if "b" in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+
+
+# the artifact at `path`, or its compressed variant when only that exists
+def find_artifact(path):
+    for candidate in [path] + [path + ext for ext in COMPRESSION_EXTENSIONS]:
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+
+# delete the other encodings of an artifact just written to `path`, so
+# readers going through find_artifact never pick up a stale one
+def remove_variants(path):
+    base = strip_compression(path)
+    for candidate in [base] + [base + ext for ext in COMPRESSION_EXTENSIONS]:
+        if candidate != path and os.path.exists(candidate):
+            os.remove(candidate)
+
+
+# pick the on-disk layout from the file extension when not given
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return "ndjson" if strip_compression(path).endswith(NDJSON_EXTENSIONS) else "json"
+
+
+# writes json documents one at a time, either as ndjson or as a json array,
+# so the caller never has to hold the whole collection in memory. a .gz /
+# .zst path is compressed as it is written; indent=None writes compact
+# arrays. an atomic writer also removes the other encodings of its path
+class JsonStreamWriter:
+
+    def __init__(self, path, fmt=None, label="docs", report_every=10000, indent=2, atomic=True):
+        self.path = path
+        self.atomic = atomic
+        self.fmt = detect_format(path, fmt)
+        self.label = label
+        self.report_every = report_every
+        self.indent = indent
+        self.count = 0
+        self.bytes_written = 0
+        self.disk_bytes = None
+        self._fp = None
+        self._start = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    # atomic writers fill a temp file and only replace the target on close,
+    # so a crashed export never leaves a half written extract behind
+    def _target(self):
+        return self.path + ".tmp" if self.atomic else self.path
+
+    def open(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._fp = open_artifact(self._target(), "wb", compression_for(self.path))
+        self._start = time.perf_counter()
+        if self.fmt == "json":
+            self._write("[")
+
+    def _write(self, text):
+        data = text.encode("utf-8")
+        self._fp.write(data)
+        self.bytes_written += len(data)
+
+    def write(self, doc):
+        if self.fmt == "ndjson":
+            self._write(json.dumps(doc, ensure_ascii=False) + "\n")
+        else:
+            # same layout json.dump(list, indent=2) would give, one item at a time
+            if self.indent:
+                pad = " " * self.indent
+                item = json.dumps(doc, indent=self.indent, ensure_ascii=False)
+                item = "\n" + pad + item.replace("\n", "\n" + pad)
+            else:
+                item = json.dumps(doc, ensure_ascii=False)
+            self._write(item if self.count == 0 else "," + item)
+
+        self.count += 1
+        if self.report_every and self.count % self.report_every == 0:
+            self.report()
+
+    def close(self):
+        if self._fp is None:
+            return
+        if self.fmt == "json":
+            self._write("\n]" if self.count and self.indent else "]")
+        self._fp.close()
+        self._fp = None
+        if self.atomic:
+            os.replace(self._target(), self.path)
+            remove_variants(self.path)
+        if compression_for(self.path):
+            self.disk_bytes = os.path.getsize(self.path)
+        self.report(final=True)
+
+    def abort(self):
+        if self._fp is None:
+            return
+        self._fp.close()
+        self._fp = None
+        if self.atomic and os.path.exists(self._target()):
+            os.remove(self._target())
+
+    def elapsed(self):
+        return time.perf_counter() - self._start if self._start else 0.0
+
+    # print docs/sec and bytes written so far
+    def report(self, final=False):
+        elapsed = self.elapsed()
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        status = "done" if final else "progress"
+        disk = f" ({self.disk_bytes / (1024 * 1024):.2f} MB on disk)" if self.disk_bytes is not None else ""
+        print(
+            f"[{self.label}] {status}: {self.count} docs, "
+            f"{self.bytes_written / (1024 * 1024):.2f} MB written{disk}, "
+            f"{rate:.0f} docs/sec"
+        )
+
+
+JSON_WHITESPACE = " \t\r\n"
+
+
+# yield the elements of a top level json array one at a time, decoding from
+# fixed size chunks so only the current element is ever held in memory
+def iter_json_array(f, chunk_size=64 * 1024):
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        buf = buf[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    skip(JSON_WHITESPACE)
+    if buf[pos:pos + 1] != "[":
+        raise ValueError("expected a json array")
+    pos += 1
+
+    while True:
+        skip(JSON_WHITESPACE + ",")
+        if pos >= len(buf):
+            raise ValueError("unterminated json array")
+        if buf[pos] == "]":
+            return
+
+        # an element cut at the buffer edge may still decode (a number like
+        # "1.5" from "1.5e3"), so only accept it once a separator follows it
+        while True:
+            try:
+                doc, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) and buf[end] in JSON_WHITESPACE + ",]":
+                    break
+                if eof:
+                    raise ValueError("malformed json array")
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+        pos = end
+        yield doc
+
+
+# read documents back from an ndjson file or a json array file, one at a
+# time, decompressing .gz / .zst files as they are read
+def iter_json_docs(path):
+    with open_artifact(path, "rt") as f:
+        if detect_format(path) == "ndjson":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# write to a temp file, fsync, then rename over the target in one step
+def write_json_atomic(path, data):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
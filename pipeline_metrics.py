@@ -0,0 +1,335 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from pipeline_io import write_json_atomic
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+METRICS_DIR = "pipeline_metrics"
+PROM_PREFIX = "etl"
+RSS_INTERVAL = 0.05
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = None
+
+_local = threading.local()
+
+
+# peak resident set size of the whole process so far, in bytes
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# resident set size of the process right now, in bytes; None where
+# /proc/self/statm does not exist (macos, windows)
+def current_rss_bytes():
+    if PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# samples the process rss every `interval` seconds on a background thread
+# and keeps the highest value, so a stage reports its own peak instead of
+# the process high-water mark an earlier, heavier stage left behind. the
+# rss is the process's, so stages running at the same time share it
+class RssSampler:
+
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.peak = current_rss_bytes()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    # stop sampling; returns the peak, or None where rss cannot be read
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        return self.peak
+
+
+# cpu seconds of the whole process (every thread) plus its finished child
+# processes, such as worker pools that have been shut down
+def process_cpu_seconds():
+    if resource is None:
+        return time.process_time()
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _total_size(paths):
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+
+# add row counts (or any other counter) to the stage running on this thread;
+# does nothing outside a measured stage
+def record(**counters):
+    profile = getattr(_local, "current", None)
+    if profile is None:
+        return
+    for key, value in counters.items():
+        if value is not None:
+            profile.counters[key] = profile.counters.get(key, 0) + value
+
+
+# measures one stage: wall time, cpu time of the stage's thread and of the
+# whole process and its worker processes, bytes of the files it reads and
+# writes, the peak rss sampled while it ran and any counters passed to
+# record().
+# with profile_dir set it also dumps a cProfile file and, when tracemalloc is
+# tracing, the top allocation sites
+class StageProfile:
+
+    def __init__(self, name, reads=(), writes=(), profile_dir=None, cprofile=False):
+        self.name = name
+        self.reads = tuple(reads)
+        self.writes = tuple(writes)
+        self.profile_dir = profile_dir
+        self.cprofile = cprofile
+        self.status = "ok"
+        self.counters = {}
+        self.metrics = {}
+        self._profiler = None
+
+    def __enter__(self):
+        self._previous = getattr(_local, "current", None)
+        _local.current = self
+        self.started_at = datetime.now(timezone.utc)
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        self._process_cpu = process_cpu_seconds()
+        self._rss = RssSampler().start()
+        if self.cprofile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profiler is not None:
+            self._profiler.disable()
+        stage_peak_rss = self._rss.stop()
+        _local.current = self._previous
+        if exc_type is not None:
+            self.status = "failed"
+
+        self.metrics = {
+            "stage": self.name,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": time.perf_counter() - self._wall,
+            "cpu_seconds": time.thread_time() - self._cpu,
+            "process_cpu_seconds": process_cpu_seconds() - self._process_cpu,
+            "rows_in": self.counters.pop("rows_in", None),
+            "rows_out": self.counters.pop("rows_out", None),
+            "bytes_read": _total_size(self.reads) if self.reads else None,
+            "bytes_written": _total_size(self.writes) if self.writes and self.status != "failed" else None,
+            "peak_rss_bytes": stage_peak_rss,
+            "process_peak_rss_bytes": peak_rss_bytes(),
+        }
+        if self.counters:
+            self.metrics["counters"] = dict(self.counters)
+        if tracemalloc.is_tracing():
+            self.metrics["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        self._dump()
+
+    def _dump(self):
+        if self.profile_dir is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self._profiler is not None:
+            path = os.path.join(self.profile_dir, f"{self.name}.prof")
+            self._profiler.dump_stats(path)
+            self.metrics["cprofile"] = path
+        if tracemalloc.is_tracing():
+            path = os.path.join(self.profile_dir, f"{self.name}.tracemalloc.txt")
+            top = tracemalloc.take_snapshot().statistics("lineno")[:25]
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(str(stat) for stat in top) + "\n")
+            self.metrics["tracemalloc"] = path
+
+
+# collects the metrics of every stage in a run and writes them out as a json
+# run report and a prometheus textfile (for node_exporter's textfile collector)
+class RunMetrics:
+
+    def __init__(self, metrics_dir=METRICS_DIR, cprofile=False, trace_memory=False):
+        self.metrics_dir = metrics_dir
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self._wall = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _profile_dir(self):
+        if self.cprofile or self.trace_memory:
+            return os.path.join(self.metrics_dir, "profiles")
+        return None
+
+    def stage(self, name, reads=(), writes=()):
+        return StageProfile(name, reads, writes, self._profile_dir(), self.cprofile)
+
+    def add(self, profile):
+        with self._lock:
+            self.stages[profile.name] = profile.metrics
+
+    # a stage that did not run this time (cached, skipped or not needed)
+    def add_status(self, name, status, **extra):
+        with self._lock:
+            self.stages[name] = {"stage": name, "status": status, **extra}
+
+    def report(self, status):
+        return {
+            "run_id": self.started_at.strftime("%Y%m%dT%H%M%S%fZ"),
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": time.perf_counter() - self._wall,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "success": all(s in ("ok", "cached", "unused") for s in status.values()),
+            "stages": [dict(self.stages.get(name, {"stage": name}), status=state)
+                       for name, state in status.items()],
+        }
+
+    # run_report.json holds the latest run, runs/<run_id>.json keeps history
+    def write(self, status):
+        report = self.report(status)
+        write_json_atomic(os.path.join(self.metrics_dir, "run_report.json"), report)
+        write_json_atomic(os.path.join(self.metrics_dir, "runs", f"{report['run_id']}.json"), report)
+        write_prometheus(os.path.join(self.metrics_dir, "pipeline.prom"), report)
+        return report
+
+
+STAGE_GAUGES = [
+    ("wall_seconds", "Wall clock seconds spent in the stage."),
+    ("cpu_seconds", "CPU seconds used by the thread running the stage (calling thread only; "
+                    "work on worker threads or processes is not included)."),
+    ("process_cpu_seconds", "CPU seconds used by the whole process and its finished worker processes "
+                            "while the stage ran; includes stages running at the same time."),
+    ("rows_in", "Rows or documents read by the stage."),
+    ("rows_out", "Rows or documents produced by the stage."),
+    ("bytes_read", "Bytes of input files read by the stage."),
+    ("bytes_written", "Bytes of output files written by the stage."),
+    ("peak_rss_bytes", f"Highest resident set size sampled every {RSS_INTERVAL:g}s while the stage ran; "
+                       "includes stages running at the same time."),
+    ("process_peak_rss_bytes", "Peak resident set size of the process since it started, when the stage "
+                               "finished."),
+]
+
+
+def _prom_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def _gauge(lines, name, help_text, samples):
+    lines.append(f"# HELP {PROM_PREFIX}_{name} {help_text}")
+    lines.append(f"# TYPE {PROM_PREFIX}_{name} gauge")
+    for labels, value in samples:
+        label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        lines.append(f"{PROM_PREFIX}_{name}{{{label_text}}} {_prom_value(value)}"
+                     if label_text else f"{PROM_PREFIX}_{name} {_prom_value(value)}")
+
+
+# written atomically so the collector never scrapes a partial file
+def _write_lines(path, lines):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+
+
+# prometheus text exposition format
+def write_prometheus(path, report):
+    lines = []
+
+    def gauge(name, help_text, samples):
+        _gauge(lines, name, help_text, samples)
+
+    gauge("run_success", "1 if every stage of the last run succeeded.", [({}, int(report["success"]))])
+    gauge("run_wall_seconds", "Wall clock seconds of the last run.", [({}, report["wall_seconds"])])
+    gauge("run_timestamp_seconds", "Start time of the last run.",
+          [({}, datetime.fromisoformat(report["started_at"]).timestamp())])
+
+    stages = report["stages"]
+    gauge("stage_status", "1 for the status each stage ended the last run with.",
+          [({"stage": s["stage"], "status": s["status"]}, 1) for s in stages])
+    for key, help_text in STAGE_GAUGES:
+        samples = [({"stage": s["stage"]}, s[key]) for s in stages if s.get(key) is not None]
+        if samples:
+            gauge(f"stage_{key}", help_text, samples)
+
+    _write_lines(path, lines)
+
+
+LIVE_GAUGES = [
+    ("batches", "Micro-batches appended since the live ingester started."),
+    ("docs", "Documents appended since the live ingester started."),
+    ("invalid_records", "Invalid records (recipe ids with errors) found in the appended batches."),
+    ("skipped_changes", "Edits and deletes seen but not applied, since the outputs are append only."),
+    ("duplicates", "Documents dropped because they were already appended (listener redeliveries)."),
+    ("docs_per_sec", "Documents appended per second since the live ingester started."),
+]
+
+LIVE_BATCH_GAUGES = [
+    ("docs", "Documents in the last micro-batch."),
+    ("seconds", "Seconds spent transforming, validating and appending the last micro-batch."),
+    ("docs_per_sec", "Documents per second through the last micro-batch."),
+    ("lag_p50_seconds", "Median seconds from a document's CreatedAt to its rows being appended."),
+    ("lag_max_seconds", "Largest seconds from a document's CreatedAt to its rows being appended."),
+    ("wait_max_seconds", "Largest seconds a change waited between arriving and being appended."),
+    ("timestamp_seconds", "When the last micro-batch was appended."),
+]
+
+
+# the live ingester's totals and last batch, in the same textfile format
+def write_live_prometheus(path, report):
+    lines = []
+    totals, last = report["totals"], report.get("last_batch") or {}
+    for key, help_text in LIVE_GAUGES:
+        if totals.get(key) is not None:
+            _gauge(lines, f"live_{key}", help_text, [({}, totals[key])])
+    for key, help_text in LIVE_BATCH_GAUGES:
+        if last.get(key) is not None:
+            _gauge(lines, f"live_batch_{key}", help_text, [({}, last[key])])
+    _write_lines(path, lines)
@@ -1,7 +1,16 @@
-import subprocess
+import argparse
 import logging
 import sys
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline_cache import CACHE_DIR, StageCache
+from pipeline_metrics import METRICS_DIR, RunMetrics, record
+
+# charts are drawn from worker threads, which needs a non-gui backend
+os.environ.setdefault("MPLBACKEND", "Agg")
 
 logging.basicConfig(
     filename="pipeline.log",
@@ -9,33 +18,436 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-def run_script(script_name):
-    try:
-        logging.info(f"Running: {script_name}")
-        result = subprocess.run(["python", script_name], capture_output=True, text=True)
 
-        if result.returncode != 0:
-            logging.error(f"{script_name} FAILED:\n{result.stderr}")
-            print(result.stderr)
-        else:
-            logging.info(f"{script_name} completed successfully")
-            print(result.stdout)
+OK_STATES = ("ok", "cached", "unused")
+
+
+# one step of the pipeline: `func(inputs)` gets a dict with the return value
+# of every stage listed in `deps`. stages with `outputs` are cached on disk
+# under a fingerprint of `inputs` (files), `code` (source files), `params` and
+# the upstream fingerprints; stages without outputs hand their result over
+# in memory and only run when a dependent actually needs it
+class Stage:
+
+    def __init__(self, name, func, deps=(), inputs=(), outputs=(), code=(), params=None, cache=True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.code = tuple(code)
+        self.params = params or {}
+        self.cache = cache
+
+    @property
+    def lazy(self):
+        return self.cache and not self.outputs
+
+
+# stages in an order where every stage comes after its dependencies
+def topo_order(stages):
+    by_name = {s.name: s for s in stages}
+    order, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"pipeline has a cycle through {name}")
+        if name not in by_name:
+            raise ValueError(f"unknown stage: {name}")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(by_name[name])
+
+    for s in stages:
+        visit(s.name)
+    return order
+
+
+class UpstreamFailed(Exception):
+    pass
+
+
+# result of an in-memory stage, computed the first time a dependent asks
+class Deferred:
+
+    def __init__(self, compute):
+        self._compute = compute
+        self._lock = threading.Lock()
+        self._done = False
+        self._failed = False
+        self._value = None
+
+    def get(self):
+        with self._lock:
+            if not self._done:
+                try:
+                    self._value = self._compute()
+                except Exception:
+                    self._failed = True
+                self._done = True
+        if self._failed:
+            raise UpstreamFailed()
+        return self._value
+
+
+# run the stages in process. each stage starts as soon as its dependencies
+# finish, so independent branches run concurrently; results are handed to
+# dependents in memory; when a stage fails everything downstream is skipped.
+# with a cache, a stage whose fingerprint matches a previous run restores its
+# outputs instead of running, and `force` names stages that always rebuild.
+# every stage that runs is measured into `metrics`
+def run_dag(stages, cache=None, force=(), metrics=None):
+    order = topo_order(stages)
+    metrics = metrics or RunMetrics()
+    values, status, fingerprints = {}, {}, {}
+    lock = threading.Lock()
+
+    def mark(name, state):
+        with lock:
+            status[name] = state
+
+    def resolve(dep):
+        value = values.get(dep)
+        return value.get() if isinstance(value, Deferred) else value
+
+    def execute(stage):
+        try:
+            inputs = {dep: resolve(dep) for dep in stage.deps}
+        except UpstreamFailed:
+            logging.warning(f"{stage.name} skipped: an upstream stage did not succeed")
+            print(f"[{stage.name}] skipped (upstream failed)")
+            mark(stage.name, "skipped")
+            raise
+
+        logging.info(f"Running: {stage.name}")
+        print(f"[{stage.name}] running")
+        profile = metrics.stage(stage.name, reads=stage.inputs, writes=stage.outputs)
+        try:
+            with profile:
+                result = stage.func(inputs)
+        except Exception as e:
+            logging.exception(f"{stage.name} FAILED: {e}")
+            print(f"[{stage.name}] FAILED: {e}")
+            mark(stage.name, "failed")
+            raise
+        finally:
+            metrics.add(profile)
+
+        m = profile.metrics
+        logging.info(f"{stage.name} completed successfully in {m['wall_seconds']:.2f}s "
+                     f"(cpu {m['cpu_seconds']:.2f}s on the stage thread, "
+                     f"{m['process_cpu_seconds']:.2f}s process wide, "
+                     f"rows in {m['rows_in']}, rows out {m['rows_out']}, "
+                     f"{m['bytes_read']} bytes read, {m['bytes_written']} bytes written)")
+        print(f"[{stage.name}] done in {m['wall_seconds']:.2f}s")
+        mark(stage.name, "ok")
+        return result
+
+    def run(stage, dep_futures):
+        for future in dep_futures:
+            future.result()
+        with lock:
+            blocked = [dep for dep in stage.deps if status.get(dep) in ("failed", "skipped")]
+        if blocked:
+            logging.warning(f"{stage.name} skipped: upstream {', '.join(blocked)} did not succeed")
+            print(f"[{stage.name}] skipped (upstream failed)")
+            mark(stage.name, "skipped")
+            return
+
+        fp = None
+        if cache is not None and stage.cache:
+            fp = cache.fingerprint(stage.name, stage.inputs, stage.code, stage.params,
+                                   [fingerprints.get(dep) for dep in stage.deps])
+            fingerprints[stage.name] = fp
+
+        if stage.lazy:
+            values[stage.name] = Deferred(lambda: execute(stage))
+            mark(stage.name, "deferred")
+            return
+
+        start = time.perf_counter()
+        if fp and stage.name not in force and cache.restore(fp, stage.outputs):
+            metrics.add_status(stage.name, "cached", wall_seconds=time.perf_counter() - start)
+            logging.info(f"{stage.name} unchanged, reused cached outputs ({fp})")
+            print(f"[{stage.name}] unchanged, reused cached outputs")
+            mark(stage.name, "cached")
+            return
+
+        try:
+            values[stage.name] = execute(stage)
+        except Exception:
+            return
+        if fp:
+            cache.store(fp, stage.outputs)
+
+    # one thread per stage, so a stage waiting on its dependencies never
+    # holds up a stage that could run
+    futures = {}
+    with ThreadPoolExecutor(max_workers=len(order)) as pool:
+        for stage in order:
+            futures[stage.name] = pool.submit(run, stage, [futures[d] for d in stage.deps])
+
+    # in-memory stages nothing downstream needed this time
+    for name, state in status.items():
+        if state == "deferred":
+            status[name] = "unused"
+    return status
+
+
+def extract_stage(args):
+    def run(inputs):
+        from data_extract import firestore_export
+        counts = firestore_export.export_all(incremental=args.incremental)
+        record(rows_in=sum(counts.values()), rows_out=sum(counts.values()))
+        return counts
+    return run
+
 
-    except Exception as e:
-        logging.error(f"Error running {script_name}: {e}")
-        print(f"Error running {script_name}: {e}")
+# export and transform in one overlapped asyncio pass (stream_transform.py)
+def stream_stage(inputs):
+    from data_transform import stream_transform
+    counts, _ = stream_transform.stream_transform()
+    record(rows_in=counts["recipe_docs"] + counts["interaction_docs"],
+           rows_out=sum(n for table, n in counts.items() if table.endswith(".csv")))
 
-def main():
+
+def transform_stage(inputs):
+    from data_transform import transform_to_csv
+    counts = transform_to_csv.transform()
+    record(rows_in=counts["recipe_docs"] + counts["interaction_docs"],
+           rows_out=sum(n for table, n in counts.items() if table.endswith(".csv")))
+
+
+def validate_stage(inputs):
+    from data_validation import validator
+    summary = validator.validate_recipes()["summary"]
+    record(rows_in=summary["total_recipes"], rows_out=summary["valid_recipes"])
+
+
+def load_tables_stage(inputs):
+    from analytics import analytics
+    tables = analytics.load_csvs()
+    rows = sum(len(table) for table in tables)
+    record(rows_in=rows, rows_out=rows)
+    return tables
+
+
+def ratings_stage(inputs):
+    from analytics import analytics
+    recipes, ingredients, steps, interactions = inputs["load_tables"]
+    record(rows_in=len(interactions), rows_out=len(recipes))
+    return analytics.rated_recipes(recipes, interactions)
+
+
+def insights_stage(inputs):
+    from analytics import analytics
+    tables = inputs["load_tables"]
+    record(rows_in=sum(len(table) for table in tables))
+    return analytics.compute_insights(*tables, merged=inputs["ratings"])
+
+
+def load_db_stage(inputs):
+    from data_load import load_to_sqlite
+    summary = load_to_sqlite.load()
+    rows = sum(counts.get("rows", counts.get("upserted", 0)) for counts in summary.values())
+    record(rows_in=rows, rows_out=rows)
+
+
+def sql_insights_stage(inputs):
+    from analytics import analytics
+    return analytics.compute_insights_sql()
+
+
+def save_insights_stage(inputs):
+    from analytics import analytics
+    out = inputs["insights"]
+    analytics.save_insights(out)
+    rows = len(out["most_common_ingredients"]) + len(out["top_rated_recipes"])
+    record(rows_in=rows, rows_out=rows)
+
+
+def charts_stage(inputs):
+    from analytics import analytics
+    recipes, ingredients, steps, interactions = inputs["load_tables"]
+    record(rows_in=len(recipes) + len(ingredients) + len(interactions))
+    analytics.generate_charts(recipes, ingredients, interactions, inputs["insights"],
+                              merged=inputs["ratings"])
+
+
+# snapshot of the insights and per recipe / ingredient stats for the
+# serving layer (analytics/analytics_serving.py)
+def publish_stage(inputs):
+    from analytics import analytics_serving
+    recipes, names = analytics_serving.serving_frames(*inputs["load_tables"])
+    record(rows_in=len(recipes) + len(names), rows_out=len(recipes) + len(names))
+    analytics_serving.publish(inputs["insights"], recipes, names)
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+# stage code lives next to this file, wherever the pipeline is run from
+def source(*paths):
+    return [os.path.join(ROOT, p) for p in paths]
+
+
+TRANSFORM_OUTPUTS = [
+    "data_transform/recipe.csv",
+    "data_transform/ingredients.csv",
+    "data_transform/steps.csv",
+    "data_transform/interactions.csv",
+]
+# every analytics stage imports analytics.py, which pulls in the chart
+# rendering (the charts stage draws with it)
+ANALYTICS_CODE = source("analytics/analytics.py", "analytics/analytics_state.py",
+                        "analytics/analytics_charts.py")
+DB_PATH = "data_load/recipes.db"
+
+
+# extract -> transform -> (validate | load_tables -> ratings -> insights -> (save_insights | charts))
+# with --load-db, transform -> load_db as well; with --sql-insights the
+# insights are computed from load_db instead of the in-memory tables. with
+# --stream, recipes and interactions are exported and transformed by one
+# uncached "transform" stage that overlaps the two
+def build_pipeline(args):
+    stages = []
+    transform_deps = []
+    if args.stream:
+        stages.append(Stage("transform", stream_stage, cache=False,
+                            outputs=TRANSFORM_OUTPUTS + ["data_extract/recipes.json",
+                                                         "data_extract/interactions.json"]))
+    else:
+        if not args.skip_extract:
+            # firestore has no cheap fingerprint, so the export always runs; the
+            # stages after it are skipped when the extracts come out unchanged
+            stages.append(Stage("extract", extract_stage(args), cache=False,
+                                outputs=["data_extract/recipes.json", "data_extract/interactions.json",
+                                         "data_extract/users.json"]))
+            transform_deps = ["extract"]
+        stages.append(Stage("transform", transform_stage, transform_deps,
+                            inputs=["data_extract/recipes.json", "data_extract/interactions.json"],
+                            outputs=TRANSFORM_OUTPUTS,
+                            code=source("data_transform/transform_to_csv.py", "pipeline_io.py"),
+                            params={"output_format": "csv"}))
+    stages += [
+        Stage("validate", validate_stage, ["transform"],
+              inputs=TRANSFORM_OUTPUTS,
+              outputs=["data_validation/validation_report.json", "data_validation/rule_stats.json"],
+              code=source("data_validation/validator.py"),
+              params={"format": "csv"}),
+        Stage("load_tables", load_tables_stage, ["transform"],
+              inputs=TRANSFORM_OUTPUTS,
+              code=ANALYTICS_CODE, params={"format": "csv"}),
+        Stage("ratings", ratings_stage, ["load_tables"], code=ANALYTICS_CODE),
+    ]
+    if args.load_db or args.sql_insights:
+        stages.append(Stage("load_db", load_db_stage, ["transform"],
+                            inputs=TRANSFORM_OUTPUTS, outputs=[DB_PATH],
+                            code=source("data_load/load_to_sqlite.py")))
+    if args.sql_insights:
+        stages.append(Stage("insights", sql_insights_stage, ["load_db"],
+                            inputs=[DB_PATH], code=ANALYTICS_CODE + source("analytics/analytics_sql.py")))
+    else:
+        stages.append(Stage("insights", insights_stage, ["load_tables", "ratings"], code=ANALYTICS_CODE))
+    stages += [
+        Stage("save_insights", save_insights_stage, ["insights"],
+              outputs=[
+                  "analytics/most_common_ingredients.csv",
+                  "analytics/top_rated_recipes.csv",
+                  "analytics/analytics_summary.json",
+              ],
+              code=ANALYTICS_CODE),
+        Stage("charts", charts_stage, ["load_tables", "ratings", "insights"],
+              outputs=[
+                  "analytics/charts/difficulty_distribution.png",
+                  "analytics/charts/top_ingredients.png",
+                  "analytics/charts/prep_vs_rating.png",
+              ],
+              code=ANALYTICS_CODE),
+    ]
+    if args.publish:
+        # the snapshot is versioned by content, so re-publishing unchanged
+        # results is a no-op; it is never restored from the stage cache
+        stages.append(Stage("publish", publish_stage, ["load_tables", "insights"], cache=False,
+                            outputs=["analytics/serving/current.json"]))
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the ETL + analytics pipeline in process")
+    parser.add_argument("--skip-extract", action="store_true",
+                        help="reuse the extracts already in data_extract/")
+    parser.add_argument("--incremental", action="store_true",
+                        help="extract only documents newer than the saved watermarks")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="run every stage and leave the stage cache alone")
+    parser.add_argument("--force", nargs="*", metavar="STAGE",
+                        help="rebuild these stages even if unchanged (all stages when none are given)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--cache-max-size", type=float, metavar="MB",
+                        help="after the run, evict least recently used cache entries above this size")
+    parser.add_argument("--cache-max-age", type=float, metavar="DAYS",
+                        help="after the run, evict cache entries unused for this many days")
+    parser.add_argument("--metrics-dir", default=METRICS_DIR,
+                        help="where the json run report and prometheus textfile are written")
+    parser.add_argument("--profile", action="store_true",
+                        help="dump a cProfile file per stage into <metrics-dir>/profiles")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="trace allocations and dump the top allocation sites per stage")
+    parser.add_argument("--load-db", action="store_true",
+                        help=f"also load the transformed tables into {DB_PATH}")
+    parser.add_argument("--sql-insights", action="store_true",
+                        help="compute the insights with sql against the loaded database (implies --load-db)")
+    parser.add_argument("--publish", action="store_true",
+                        help="publish the results for the serving layer (analytics/analytics_serving.py)")
+    parser.add_argument("--stream", action="store_true",
+                        help="export recipes/interactions and transform them in one overlapped "
+                             "asyncio pass (users are not exported)")
+    args = parser.parse_args(argv)
+    if args.stream and (args.skip_extract or args.incremental):
+        parser.error("--stream always reads the full collections from firestore")
+
+    stages = build_pipeline(args)
+    if args.force is None:
+        force = set()
+    else:
+        force = set(args.force) or {s.name for s in stages}
+        unknown = force - {s.name for s in stages}
+        if unknown:
+            parser.error(f"unknown stage(s) for --force: {', '.join(sorted(unknown))}")
+    cache = None if args.no_cache else StageCache(args.cache_dir)
 
     print("starting full ETL + Analytics pipeline...\n")
     logging.info("pipeline execution started")
-    run_script("data_extract\firestore_export.py")
-    run_script("data_transform\transform_to_csv.py")
-    run_script("data_validation\validator.py")
-    run_script("analytics\analytics.py")
+    metrics = RunMetrics(args.metrics_dir, cprofile=args.profile, trace_memory=args.tracemalloc)
+    status = run_dag(stages, cache=cache, force=force, metrics=metrics)
+    metrics.write(status)
+    print(f"Run report written to {args.metrics_dir}/run_report.json")
+
+    if cache is not None:
+        cache.save()
+        if args.cache_max_size is not None or args.cache_max_age is not None:
+            evicted = cache.evict(
+                max_bytes=args.cache_max_size * 1024 * 1024 if args.cache_max_size is not None else None,
+                max_age=args.cache_max_age * 86400 if args.cache_max_age is not None else None,
+            )
+            print(f"Cache: evicted {len(evicted)} entries, {cache.size() / (1024 * 1024):.2f} MB kept")
 
-    logging.info("Ppipeline execution completed")
+    failed = [name for name, state in status.items() if state not in OK_STATES]
+    if failed:
+        logging.error(f"pipeline execution stopped: {', '.join(failed)} did not complete")
+        print(f"\n Pipeline failed: {', '.join(failed)} did not complete. See pipeline.log")
+        return 1
+
+    logging.info("pipeline execution completed")
     print("\n Pipeline Completed Successfully! Check analytics folder for results.")
+    return 0
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
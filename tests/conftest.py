@@ -0,0 +1,188 @@
+import json
+import math
+import os
+import random
+import shutil
+import string
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the analytics modules import each other by bare name, like the scripts do
+sys.path.insert(0, os.path.join(ROOT, "analytics"))
+sys.path.insert(1, ROOT)
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DIFFICULTIES = ["Easy", "Medium", "Hard"]
+INGREDIENTS = ["Salt", "Oil", "Onion", "Garlic", "Rice", "Egg", "Chicken", "Tomato", "Butter", "Flour",
+               "Cumin", "Ginger", "Milk", "Sugar", "Lemon"]
+USERS = [(f"user_{k:03d}", f"cook{k}") for k in range(12)]
+ID_CHARS = string.ascii_letters + string.digits
+
+
+def doc_id(rng):
+    return "".join(rng.choice(ID_CHARS) for _ in range(20))
+
+
+# two documents share every CreatedAt, so ties on the watermark are common
+def created_at(i):
+    return (START + timedelta(minutes=i // 2)).isoformat()
+
+
+# recipes in the exporter's layout; every 23rd record breaks one validator rule
+def make_recipes(n, seed=0):
+    rng = random.Random(f"recipes:{seed}")
+    recipes = []
+    for i in range(n):
+        user_id, username = rng.choice(USERS)
+        prep, cook = rng.randint(5, 30), rng.randint(10, 60)
+        recipe = {
+            "CreatedAt": created_at(i),
+            "AuthorName": username,
+            "TimeRequired": {"CookTime": cook, "PrepTime": prep,
+                             "TotalTime": prep + cook + rng.randint(0, 3)},
+            "Difficulty": rng.choice(DIFFICULTIES),
+            "Description": f"Recipe number {i}.",
+            "Steps": [{"StepNumber": k, "Instruction": f"Step {k}.",
+                       "Duration": f"{rng.randint(1, 9)} min"}
+                      for k in range(1, rng.randint(2, 6))],
+            "Ingredients": [{"Name": name, "Quantity": rng.randint(1, 400), "Unit": "g",
+                             "Optional": rng.random() < 0.3}
+                            for name in rng.sample(INGREDIENTS, rng.randint(2, 6))],
+            "Statistics": {"ViewCount": rng.randint(0, 50), "LikeCount": rng.randint(0, 20),
+                           "RatingCount": rng.randint(0, 10)},
+            "Title": f"Recipe {i % 40}",
+            "AuthorID": user_id,
+            "id": doc_id(rng),
+        }
+        kind = i % 23
+        if kind == 1:
+            recipe["Difficulty"] = "Extreme"
+        elif kind == 2:
+            recipe["TimeRequired"]["PrepTime"] = 0
+        elif kind == 3:
+            recipe["Ingredients"][0]["Quantity"] = "abc"
+        elif kind == 4:
+            recipe["Ingredients"][-1]["Quantity"] = "-2"
+        elif kind == 5:
+            recipe["Steps"] = []
+        elif kind == 6:
+            recipe["Title"] = ""
+            recipe["Ingredients"] = []
+        elif kind == 7:
+            recipe["TimeRequired"]["TotalTime"] = 1
+        recipes.append(recipe)
+    return recipes
+
+
+# interactions on the recipes, skewed towards the first ones so the top
+# lists have ties; every 31st rating is unparseable or out of range
+def make_interactions(recipes, n, seed=0):
+    rng = random.Random(f"interactions:{seed}")
+    interactions = []
+    for i in range(n):
+        recipe = recipes[min(int(rng.expovariate(1 / 15)), len(recipes) - 1)]
+        user_id, username = rng.choice(USERS)
+        rating = str(rng.randint(1, 5))
+        if i % 31 == 1:
+            rating = "abc"
+        elif i % 31 == 2:
+            rating = "9"
+        interactions.append({
+            "UserId": user_id,
+            "Username": username,
+            "CreatedAt": created_at(i),
+            "Rating": rating,
+            "Type": rng.choice(["rating", "view", "comment"]),
+            "RecipeTitle": recipe["Title"],
+            "Cooknote": "Amazing taste!" if rng.random() < 0.5 else "",
+            "RecipeId": recipe["id"],
+            "id": doc_id(rng),
+        })
+    return interactions
+
+
+# users with their Activities subcollection inlined, as the nested export
+# writes them; some users have no activities at all
+def make_users(interactions, seed=0):
+    rng = random.Random(f"users:{seed}")
+    users = []
+    for k, (user_id, username) in enumerate(USERS):
+        mine = [inter for inter in interactions if inter["UserId"] == user_id][:k]
+        users.append({
+            "UserID": user_id,
+            "Email": f"{username}@example.com",
+            "JoinedAt": created_at(k),
+            "UserName": username,
+            "SkillLevel": rng.choice(["Beginner", "Intermediate", "Expert"]),
+            "id": user_id,
+            "Activities": [{"CreatedAt": inter["CreatedAt"], "Type": inter["Type"],
+                            "RecipeName": inter["RecipeTitle"], "InteractionID": inter["id"],
+                            "id": doc_id(rng)} for inter in mine],
+        })
+    return users
+
+
+def write_json(path, docs):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(docs, f, indent=2)
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# insights from two code paths agree: same keys, order and types, floats
+# equal up to rounding (the paths sum in different orders), nan matching nan
+def assert_same_insights(actual, expected, path="insights"):
+    if hasattr(actual, "item"):
+        actual = actual.item()
+    if hasattr(expected, "item"):
+        expected = expected.item()
+    assert type(actual) is type(expected), f"{path}: {actual!r} != {expected!r}"
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected), path
+        for key in expected:
+            assert_same_insights(actual[key], expected[key], f"{path}.{key}")
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected), path
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            assert_same_insights(a, e, f"{path}[{i}]")
+    elif isinstance(expected, float):
+        assert math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-12) or (
+            math.isnan(actual) and math.isnan(expected)), f"{path}: {actual!r} != {expected!r}"
+    else:
+        assert actual == expected, f"{path}: {actual!r} != {expected!r}"
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    recipes = make_recipes(120)
+    return {"recipes": recipes, "interactions": make_interactions(recipes, 300)}
+
+
+# the dataset as data_extract/*.json files
+@pytest.fixture(scope="session")
+def extracts(tmp_path_factory, dataset):
+    path = tmp_path_factory.mktemp("extracts")
+    for name, docs in dataset.items():
+        write_json(str(path / f"{name}.json"), docs)
+    return path
+
+
+# a fresh working directory holding data_extract/, so the scripts' relative
+# default paths point into it
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, extracts):
+    shutil.copytree(extracts, tmp_path / "data_extract")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
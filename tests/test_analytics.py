@@ -0,0 +1,76 @@
+from conftest import assert_same_insights
+from analytics import compute_insights, load_csvs, update_state
+from analytics_chunked import compute_insights_chunked
+from analytics_sql import compute_insights_sql
+from analytics_state import STATE_DIR, AnalyticsState
+from data_load.load_to_sqlite import load
+from data_transform.transform_to_csv import snapshot_previous, transform, write_changes
+from pipeline_io import JsonStreamWriter, iter_json_docs
+
+
+def write_docs(path, docs):
+    with JsonStreamWriter(path, report_every=0) as writer:
+        for doc in docs:
+            writer.write(doc)
+
+
+# add, edit and delete recipes and interactions in the extracts
+def change_extracts():
+    recipes = list(iter_json_docs("data_extract/recipes.json"))
+    recipes[10]["Difficulty"] = "Hard"
+    recipes[10]["TimeRequired"]["TotalTime"] = 500
+    recipes[11]["Ingredients"] = recipes[11]["Ingredients"][:2]
+    recipes[11]["Steps"] = recipes[11]["Steps"][:1]
+    added = [dict(recipes[20], id=f"new-recipe-{k}", Title=f"New recipe {k}") for k in range(2)]
+    recipes = [r for i, r in enumerate(recipes) if i not in (3, 40)] + added
+    write_docs("data_extract/recipes.json", recipes)
+
+    interactions = list(iter_json_docs("data_extract/interactions.json"))
+    for inter in interactions[::19]:
+        inter["Rating"] = "1"
+        inter["Cooknote"] = ""
+    interactions = [inter for i, inter in enumerate(interactions) if i % 17 != 5]
+    interactions += [dict(interactions[0], id=f"new-interaction-{k}", RecipeId="new-recipe-0",
+                          Rating="5", Cooknote="Loved it") for k in range(3)]
+    write_docs("data_extract/interactions.json", interactions)
+
+
+def test_full_rebuild_matches_compute_insights(workdir):
+    transform()
+    state = update_state(full_rebuild=True)
+    assert_same_insights(state.derive(), compute_insights(*load_csvs()))
+
+
+def test_folded_changes_match_full_insights(workdir, capsys):
+    transform()
+    update_state(full_rebuild=True)
+
+    change_extracts()
+    snapshot_previous()
+    transform()
+    summary = write_changes()
+    assert all(summary["recipe.csv"][change] for change in ("insert", "update", "delete"))
+    assert all(summary["interactions.csv"][change] for change in ("insert", "update", "delete"))
+    capsys.readouterr()
+    state = update_state()
+    assert "Folded" in capsys.readouterr().out
+
+    expected = compute_insights(*load_csvs())
+    assert_same_insights(state.derive(), expected)
+    assert_same_insights(AnalyticsState.load(STATE_DIR).derive(), expected)
+
+
+def test_chunked_insights_match_compute_insights(workdir):
+    transform()
+    rows = {}
+    out, _ = compute_insights_chunked(chunksize=97, rows=rows)
+    assert rows["ingredients"] > 97
+    assert_same_insights(out, compute_insights(*load_csvs()))
+
+
+def test_sql_insights_match_compute_insights(workdir):
+    transform()
+    load("data_transform", "recipes.db")
+    out = compute_insights_sql("recipes.db")
+    assert_same_insights(out, compute_insights(*load_csvs()))
+    assert all(type(r["total_time"]) is int for r in out["longest_total_time"])
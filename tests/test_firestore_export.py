@@ -0,0 +1,143 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import make_users, read_bytes, read_json, write_json
+from data_extract.firestore_export import (AUTO_ID_ALPHABET, SHARD_DIR, STATE_PATH, Watermark,
+                                           export_activities, export_all, export_collection,
+                                           export_users, merge_into_extract, shard_bounds,
+                                           user_converter)
+from fake_firestore import from_extracts
+
+
+def sorted_ids(docs):
+    return sorted(doc["id"] for doc in docs)
+
+
+def test_merge_skips_documents_already_in_the_extract(tmp_path, dataset):
+    path = str(tmp_path / "recipes.json")
+    recipes = dataset["recipes"]
+    write_json(path, recipes[:50])
+
+    # a re-run after a crash fetches part of the old delta again
+    added = merge_into_extract(iter(recipes[40:80]), path)
+
+    assert added == 30
+    assert read_json(path) == recipes[:80]
+
+
+def test_merge_creates_a_missing_extract(tmp_path, dataset):
+    path = str(tmp_path / "interactions.ndjson")
+    assert merge_into_extract(iter(dataset["interactions"][:10]), path) == 10
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 10
+
+
+def test_watermark_tracks_the_newest_document(dataset):
+    recipes = dataset["recipes"]
+    watermark = Watermark("CreatedAt")
+    assert list(watermark.track(iter(recipes[:10]))) == recipes[:10]
+
+    # docs 8 and 9 share a timestamp; the id breaks the tie
+    last = max(recipes[8:10], key=lambda doc: doc["id"])
+    assert watermark.mark == {"field": "CreatedAt", "value": last["CreatedAt"], "id": last["id"]}
+
+
+def test_watermark_resumes_from_a_saved_mark(dataset):
+    recipes = dataset["recipes"]
+    first = Watermark("CreatedAt")
+    list(first.track(iter(recipes[:10])))
+
+    # older documents seen again after a restart do not move the mark back
+    resumed = Watermark("CreatedAt", dict(first.mark))
+    list(resumed.track(iter(recipes[:6])))
+    assert resumed.mark == first.mark
+
+    list(resumed.track(iter(recipes[10:12])))
+    assert resumed.mark["value"] == recipes[11]["CreatedAt"]
+
+
+def test_shard_bounds_cover_the_id_space():
+    assert shard_bounds(1) == [(None, None)]
+    for shards in (2, 3, 7, 64, 5000):
+        bounds = shard_bounds(shards)
+        assert bounds[0][0] is None and bounds[-1][1] is None
+        assert all(hi == lo for (_, hi), (lo, _) in zip(bounds, bounds[1:]))
+        points = [lo for lo, _ in bounds[1:]]
+        assert points == sorted(points) and len(set(points)) == len(points)
+    # bounds are two character prefixes, so extra shards collapse into one per prefix
+    assert len(shard_bounds(5000)) == len(AUTO_ID_ALPHABET) ** 2 + 1
+
+
+def test_sharded_export_matches_single_cursor(extracts, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db = from_extracts(str(extracts / "recipes.json"), str(extracts / "interactions.json"))
+    single = str(tmp_path / "single.json")
+    sharded = str(tmp_path / "sharded.json")
+
+    export_collection("recipes", "Recipe", "CreatedAt", single, db=db)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        count = export_collection("recipes", "Recipe", "CreatedAt", sharded, db=db, shards=5, pool=pool)
+
+    assert count == db.count("Recipe")
+    assert read_bytes(sharded) == read_bytes(single)
+    assert not os.path.exists(SHARD_DIR)
+
+
+def test_incremental_export_resumes_from_the_saved_watermark(workdir, dataset):
+    recipes, interactions = dataset["recipes"], dataset["interactions"]
+    write_json("source/recipes.json", recipes[:70])
+    write_json("source/interactions.json", interactions[:150])
+    export_all(incremental=True, db=from_extracts("source/recipes.json", "source/interactions.json"))
+    state = read_json(STATE_PATH)
+    assert state["recipes"]["id"] in {doc["id"] for doc in recipes[68:70]}
+
+    # the next run only reads what was written after the marks
+    write_json("source/recipes.json", recipes)
+    write_json("source/interactions.json", interactions)
+    db = from_extracts("source/recipes.json", "source/interactions.json")
+    counts = export_all(incremental=True, db=db, workers=2)
+
+    assert counts["recipes"] == len(recipes) - 70
+    assert counts["interactions"] == len(interactions) - 150
+    assert sorted_ids(read_json("data_extract/recipes.json")) == sorted_ids(recipes)
+    assert sorted_ids(read_json("data_extract/interactions.json")) == sorted_ids(interactions)
+
+
+@pytest.fixture
+def users_db(tmp_path, dataset):
+    users = make_users(dataset["interactions"])
+    write_json(str(tmp_path / "users.json"), users)
+    return users, from_extracts(users=str(tmp_path / "users.json"))
+
+
+def test_bulk_activities_match_nested_reads(users_db, tmp_path):
+    users, db = users_db
+    for mode in ("nested", "bulk"):
+        export_collection("users", "Users", "JoinedAt", str(tmp_path / f"{mode}.json"), db=db,
+                          convert=user_converter(db, mode))
+
+    assert read_bytes(tmp_path / "bulk.json") == read_bytes(tmp_path / "nested.json")
+    assert sum(len(u["Activities"]) for u in read_json(tmp_path / "bulk.json")) == \
+        sum(len(u["Activities"]) for u in users)
+
+
+def test_flat_activities_carry_their_user(users_db, tmp_path):
+    users, db = users_db
+    count = export_activities(str(tmp_path / "activities.json"), db=db)
+
+    flat = read_json(tmp_path / "activities.json")
+    assert count == len(flat) == sum(len(u["Activities"]) for u in users)
+    owners = {a["id"]: u["id"] for u in users for a in u["Activities"]}
+    assert {a["id"]: a["UserID"] for a in flat} == owners
+
+
+def test_flat_users_export_writes_the_activities(users_db, tmp_path):
+    users, db = users_db
+    export_users(str(tmp_path / "users.json"), activities="flat",
+                 activities_path=str(tmp_path / "activities.json"), db=db)
+
+    assert all("Activities" not in u for u in read_json(tmp_path / "users.json"))
+    flat = read_json(tmp_path / "activities.json")
+    assert sorted(a["id"] for a in flat) == sorted(a["id"] for u in users for a in u["Activities"])
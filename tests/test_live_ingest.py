@@ -0,0 +1,99 @@
+import csv
+
+from conftest import write_json
+from data_transform.live_ingest import LiveTables, csv_marks, ingest, process_batch
+from data_transform.transform_to_csv import RECIPE_HEADER, TABLES, recipe_rows, transform
+from fake_firestore import from_extracts
+
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+def run(recipes, interactions):
+    write_json("source/recipes.json", recipes)
+    write_json("source/interactions.json", interactions)
+    db = from_extracts("source/recipes.json", "source/interactions.json")
+    return ingest(db, "live", max_wait=0.05, use_poll=True, poll_interval=0.05,
+                  invalid_path="live/invalid.ndjson", metrics_dir="metrics", duration=0.5)
+
+
+# the polled rows are the transform's rows, in (CreatedAt, id) order
+def test_ingest_appends_what_the_transform_writes(workdir, dataset):
+    transform(output_dir="expected")
+    report = run(dataset["recipes"], dataset["interactions"])
+
+    assert report["totals"]["docs"] == len(dataset["recipes"]) + len(dataset["interactions"])
+    for table in TABLES:
+        assert sorted(read_rows(f"live/{table}")) == sorted(read_rows(f"expected/{table}"))
+
+
+# a restart resumes from the newest row in the csvs: nothing is appended
+# twice, and documents written while it was down are picked up
+def test_restart_does_not_append_duplicates(workdir, dataset):
+    recipes, interactions = dataset["recipes"], dataset["interactions"]
+    run(recipes[:60], interactions[:100])
+    marks = csv_marks("live")
+    assert marks["recipes"]["id"] in {doc["id"] for doc in recipes[58:60]}
+
+    assert run(recipes[:60], interactions[:100])["totals"]["docs"] == 0
+    report = run(recipes, interactions)
+    assert report["totals"]["recipes"] == len(recipes) - 60
+    assert report["totals"]["interactions"] == len(interactions) - 100
+
+    transform(output_dir="expected")
+    for table in TABLES:
+        assert sorted(read_rows(f"live/{table}")) == sorted(read_rows(f"expected/{table}"))
+
+
+
+# a crash after the child tables of a batch were written but before its
+# checkpoint: the restart drops those rows and appends the batch once
+def test_restart_drops_a_partly_written_batch(workdir, dataset):
+    recipes, interactions = dataset["recipes"], dataset["interactions"]
+    run(recipes[:60], interactions[:100])
+    with open("live/ingredients.csv", "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(i for r in recipes[60:65] for i in recipe_rows(r)[1])
+
+    run(recipes, interactions)
+    transform(output_dir="expected")
+    for table in TABLES:
+        assert sorted(read_rows(f"live/{table}")) == sorted(read_rows(f"expected/{table}"))
+
+
+# csvs rewritten by a batch transform no longer match the checkpoint; they
+# are kept whole and the marks come from their rows
+def test_rewritten_csvs_resume_from_their_rows(workdir, dataset):
+    recipes, interactions = dataset["recipes"], dataset["interactions"]
+    run(recipes[:60], interactions[:100])
+    transform(output_dir="live")
+
+    assert run(recipes, interactions)["totals"]["docs"] == 0
+    transform(output_dir="expected")
+    for table in TABLES:
+        assert read_rows(f"live/{table}") == read_rows(f"expected/{table}")
+
+
+def test_redelivered_documents_are_dropped(workdir, dataset):
+    recipes = dataset["recipes"]
+    run(recipes[:60], [])
+    tables = LiveTables("live")
+    batch = [("recipes", "ADDED", doc, 0.0) for doc in recipes[58:62] + recipes[60:62]]
+    with open("live/invalid.ndjson", "a", encoding="utf-8") as invalid_fp:
+        stats = process_batch(batch, tables, invalid_fp)
+    tables.close()
+
+    assert (stats["recipes"], stats["duplicates"]) == (2, 4)
+    ids = [row[0] for row in read_rows("live/recipe.csv")]
+    assert len(ids) == len(set(ids)) == 62
+
+
+def test_marks_skip_unreadable_created_at(tmp_path, dataset):
+    transform(output_dir=str(tmp_path))
+    rows = read_rows(tmp_path / "recipe.csv")
+    newest = max(rows, key=lambda row: (row[RECIPE_HEADER.index("created_at")], row[0]))
+    with open(tmp_path / "recipe.csv", "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(["bad-row"] + ["not a date"] * (len(RECIPE_HEADER) - 1))
+
+    assert csv_marks(str(tmp_path))["recipes"]["id"] == newest[0]
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from pipeline_cache import StageCache
+from run_pipeline import Stage, run_dag
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("input.txt", "rows")
+    write("code.py", "v1")
+    return tmp_path
+
+
+def test_fingerprint_follows_inputs_code_params_and_upstream(project):
+    cache = StageCache()
+    base = cache.fingerprint("stage", ["input.txt"], ["code.py"], {"fmt": "csv"}, ["up"])
+    assert cache.fingerprint("stage", ["input.txt"], ["code.py"], {"fmt": "csv"}, ["up"]) == base
+
+    assert cache.fingerprint("other", ["input.txt"], ["code.py"], {"fmt": "csv"}, ["up"]) != base
+    assert cache.fingerprint("stage", ["input.txt"], ["code.py"], {"fmt": "parquet"}, ["up"]) != base
+    assert cache.fingerprint("stage", ["input.txt"], ["code.py"], {"fmt": "csv"}, ["up2"]) != base
+    write("input.txt", "more rows")
+    assert cache.fingerprint("stage", ["input.txt"], ["code.py"], {"fmt": "csv"}, ["up"]) != base
+
+
+def test_restore_puts_stored_outputs_back(project):
+    cache = StageCache()
+    write("out/result.csv", "a,b\n")
+    fp = cache.fingerprint("stage", ["input.txt"])
+    cache.store(fp, ["out/result.csv"])
+
+    os.remove("out/result.csv")
+    assert cache.restore(fp, ["out/result.csv"])
+    assert read("out/result.csv") == "a,b\n"
+
+    # a new cache object reads the manifest back from disk
+    assert StageCache().restore(fp, ["out/result.csv"])
+    assert not cache.restore(cache.fingerprint("stage", ["code.py"]), ["out/result.csv"])
+    assert not cache.restore(fp, ["out/result.csv", "out/other.csv"])
+
+
+def test_evict_drops_least_recently_used(project):
+    cache = StageCache()
+    write("a.txt", "x" * 100)
+    write("b.txt", "y" * 100)
+    cache.store("old", ["a.txt"])
+    cache.store("new", ["b.txt"])
+    cache.entries["old"]["last_used"] -= 10
+
+    assert cache.evict(max_bytes=150) == ["old"]
+    assert list(cache.entries) == ["new"]
+    assert not os.path.exists(os.path.join(cache.root, "objects", "old"))
+
+
+# a two stage pipeline: the first run builds, the second is a cache hit, and
+# changing the input or the code of a stage rebuilds it and what follows
+def test_run_dag_skips_unchanged_stages(project):
+    calls = []
+
+    def upper(inputs):
+        calls.append("upper")
+        write("out/upper.txt", read("input.txt").upper())
+
+    def count(inputs):
+        calls.append("count")
+        write("out/count.txt", str(len(read("out/upper.txt"))))
+
+    def stages():
+        return [
+            Stage("upper", upper, inputs=["input.txt"], outputs=["out/upper.txt"], code=["code.py"]),
+            Stage("count", count, ["upper"], inputs=["out/upper.txt"], outputs=["out/count.txt"]),
+        ]
+
+    assert run_dag(stages(), cache=StageCache()) == {"upper": "ok", "count": "ok"}
+    assert run_dag(stages(), cache=StageCache()) == {"upper": "cached", "count": "cached"}
+    assert calls == ["upper", "count"]
+
+    os.remove("out/count.txt")
+    assert run_dag(stages(), cache=StageCache())["count"] == "cached"
+    assert read("out/count.txt") == "4"
+
+    write("input.txt", "more rows")
+    assert run_dag(stages(), cache=StageCache()) == {"upper": "ok", "count": "ok"}
+    write("code.py", "v2")
+    assert run_dag(stages(), cache=StageCache()) == {"upper": "ok", "count": "ok"}
+    assert run_dag(stages(), cache=StageCache(), force={"count"}) == {"upper": "cached", "count": "ok"}
+    assert calls == ["upper", "count"] * 3 + ["count"]
+    assert read("out/count.txt") == "9"
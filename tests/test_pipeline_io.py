@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from conftest import read_bytes
+from data_transform.transform_to_csv import TABLES, transform
+from pipeline_io import JsonStreamWriter, find_artifact, iter_json_docs, open_artifact
+
+CODECS = [("gzip", ".gz"), ("zstd", ".zst")]
+
+
+@pytest.mark.parametrize("codec, ext", CODECS)
+def test_open_artifact_round_trips(tmp_path, codec, ext):
+    path = str(tmp_path / f"table.csv{ext}")
+    text = "".join(f"{i},row {i},é\n" for i in range(5000))
+    with open_artifact(path, "wt", newline="") as f:
+        f.write(text)
+
+    assert len(read_bytes(path)) < len(text)
+    with open_artifact(path, "rt", newline="") as f:
+        assert f.read() == text
+    with open_artifact(path, "rb", compression=codec) as f:
+        assert f.read() == text.encode("utf-8")
+
+
+@pytest.mark.parametrize("codec, ext", CODECS)
+@pytest.mark.parametrize("name, indent", [("recipes.json", 2), ("recipes.json", None),
+                                          ("recipes.ndjson", None)])
+def test_compressed_extracts_read_back(tmp_path, dataset, codec, ext, name, indent):
+    recipes = dataset["recipes"]
+    plain = str(tmp_path / name)
+    with JsonStreamWriter(plain, report_every=0) as writer:
+        for doc in recipes:
+            writer.write(doc)
+    with JsonStreamWriter(plain + ext, report_every=0, indent=indent) as writer:
+        for doc in recipes:
+            writer.write(doc)
+
+    # the compressed write replaced the plain one
+    assert not os.path.exists(plain)
+    assert find_artifact(plain) == plain + ext
+    assert list(iter_json_docs(plain + ext)) == recipes
+
+
+# gzip extracts in, zstd tables out, with the same rows as the plain run
+def test_compressed_transform_matches_plain(extracts, tmp_path, dataset):
+    for name, docs in dataset.items():
+        with JsonStreamWriter(str(tmp_path / f"{name}.json.gz"), report_every=0) as writer:
+            for doc in docs:
+                writer.write(doc)
+
+    transform(str(extracts / "recipes.json"), str(extracts / "interactions.json"),
+              str(tmp_path / "plain"))
+    transform(str(tmp_path / "recipes.json.gz"), str(tmp_path / "interactions.json.gz"),
+              str(tmp_path / "zstd"), compression="zstd")
+    for table in TABLES:
+        with open_artifact(str(tmp_path / "zstd" / f"{table}.zst"), "rb") as f:
+            assert f.read() == read_bytes(tmp_path / "plain" / table)
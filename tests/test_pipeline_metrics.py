@@ -0,0 +1,20 @@
+import pytest
+
+from pipeline_metrics import StageProfile, current_rss_bytes
+
+MB = 1024 * 1024
+
+
+# a light stage after a heavy one reports its own peak, while the process
+# high-water mark stays where the heavy stage left it
+@pytest.mark.skipif(current_rss_bytes() is None, reason="needs /proc/self/statm")
+def test_stage_peak_rss_is_sampled_per_stage():
+    with StageProfile("heavy") as heavy:
+        block = bytearray(200 * MB)
+        block[::4096] = b"x" * len(block[::4096])
+        del block
+    with StageProfile("light") as light:
+        sum(range(1000))
+
+    assert heavy.metrics["peak_rss_bytes"] >= light.metrics["peak_rss_bytes"] + 150 * MB
+    assert light.metrics["process_peak_rss_bytes"] >= light.metrics["peak_rss_bytes"] + 150 * MB
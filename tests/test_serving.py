@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+from analytics import compute_insights, load_csvs, update_state
+from analytics_serving import KEEP_VERSIONS, QueryError, Snapshot, SnapshotStore, publish, serving_frames
+from data_transform.transform_to_csv import transform
+
+SERVING = "serving"
+
+
+def answer(snapshot, path, **query):
+    return json.loads(snapshot.answer(path, query))
+
+
+@pytest.fixture
+def tables(workdir):
+    transform()
+    return load_csvs()
+
+
+def test_snapshot_answers_match_the_insights(tables):
+    publish(compute_insights(*tables), *serving_frames(*tables), serving_dir=SERVING)
+    snapshot = Snapshot.load(SERVING)
+    expected = update_state(full_rebuild=True).derive()
+
+    assert answer(snapshot, "/summary")["avg_prep_time"] == pytest.approx(expected["avg_prep_time"])
+    counts = answer(snapshot, "/ingredients", k="20")
+    assert {row["name"]: row["count"] for row in counts} == expected["most_common_ingredients"]
+    ratings = answer(snapshot, "/ingredients", k="20", order="rating")
+    assert [row["name"] for row in ratings] == list(expected["ingredients_high_rating"])
+
+    top = answer(snapshot, "/top-rated", k="10")
+    assert [r["recipe_id"] for r in top] == [r["recipe_id"] for r in expected["top_rated_recipes"]]
+    hard = answer(snapshot, "/top-rated", k="1000", difficulty="Hard")
+    assert hard and all(r["difficulty"] == "Hard" for r in hard)
+    ranked = [r["rating"] for r in hard if r["rating"] is not None]
+    assert ranked == sorted(ranked, reverse=True)
+
+    recipe = answer(snapshot, f"/recipes/{top[0]['recipe_id']}")
+    assert recipe["title"] == top[0]["title"] and recipe["rating"] == top[0]["rating"]
+
+
+@pytest.mark.parametrize("path, query, status", [
+    ("/top-rated", {"k": "0"}, 400),
+    ("/top-rated", {"k": "ten"}, 400),
+    ("/ingredients", {"order": "name"}, 400),
+    ("/recipes/missing", {}, 404),
+    ("/nothing", {}, 404),
+])
+def test_bad_queries_are_rejected(tables, path, query, status):
+    publish(compute_insights(*tables), *serving_frames(*tables), serving_dir=SERVING)
+    with pytest.raises(QueryError) as e:
+        Snapshot.load(SERVING).answer(path, query)
+    assert e.value.status == status
+
+
+# a new publish is swapped in on refresh; an unchanged one is not, and
+# only the last KEEP_VERSIONS versions stay on disk
+def test_store_swaps_in_new_snapshots(tables):
+    store = SnapshotStore(SERVING)
+    assert not store.refresh()
+
+    first = publish(compute_insights(*tables), *serving_frames(*tables), serving_dir=SERVING)
+    assert store.refresh() and store.snapshot.version == first
+    old = store.snapshot
+    assert publish(compute_insights(*tables), *serving_frames(*tables), serving_dir=SERVING) == first
+    assert not store.refresh() and store.snapshot is old
+
+    recipes, ingredients, steps, interactions = tables
+    versions = [first]
+    for n in (60, 30):
+        smaller = (recipes.head(n), ingredients, steps, interactions)
+        versions.append(publish(compute_insights(*smaller), *serving_frames(*smaller),
+                                serving_dir=SERVING))
+        assert store.refresh() and store.snapshot.version == versions[-1]
+        assert len(answer(store.snapshot, "/top-rated", k="1000")) == n
+
+    assert store.swaps == 3
+    kept = [v for v in os.listdir(SERVING) if v != "current.json"]
+    assert sorted(kept) == sorted(versions[-KEEP_VERSIONS:])
+    # the snapshot swapped out still answers from its own data
+    assert len(answer(old, "/top-rated", k="1000")) == len(recipes)
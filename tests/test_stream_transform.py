@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from conftest import read_bytes, write_json
+from data_extract.firestore_export import export_collection
+from data_transform.stream_transform import SOURCES, main, stream_transform
+from data_transform.transform_to_csv import TABLES, transform
+from fake_firestore import AsyncFakeFirestore, from_extracts
+
+
+@pytest.fixture(scope="module")
+def db(extracts):
+    return from_extracts(str(extracts / "recipes.json"), str(extracts / "interactions.json"))
+
+
+# export both collections, then transform the extracts: the two step run
+# the overlapped mode replaces
+@pytest.fixture(scope="module")
+def exported(db, tmp_path_factory):
+    path = tmp_path_factory.mktemp("exported")
+    for kind, collection, extract in SOURCES:
+        export_collection(kind, collection, "CreatedAt", str(path / extract), db=db)
+    transform(str(path / "recipes.json"), str(path / "interactions.json"), str(path / "tables"))
+    return path
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_stream_transform_matches_export_then_transform(db, exported, tmp_path, workers):
+    counts, _ = stream_transform(str(tmp_path / "tables"), str(tmp_path / "extract"),
+                                 db=AsyncFakeFirestore(db, page_size=50), workers=workers,
+                                 batch_size=40, queue_batches=2)
+    for table in TABLES:
+        assert read_bytes(tmp_path / "tables" / table) == read_bytes(exported / "tables" / table)
+    for _, _, extract in SOURCES:
+        assert read_bytes(tmp_path / "extract" / extract) == read_bytes(exported / extract)
+    assert counts["recipe_docs"] == db.count("Recipe")
+
+
+# an extract that fails part way through leaves the last complete tables
+def test_failed_changes_run_keeps_the_previous_tables(workdir, dataset):
+    main(["--fake-source", "data_extract", "--workers", "0", "--no-extracts"])
+    before = {table: read_bytes(f"data_transform/{table}") for table in TABLES}
+    broken = [dict(r) for r in dataset["recipes"]]
+    broken[90]["Ingredients"] = 5
+    write_json("source/recipes.json", broken)
+    write_json("source/interactions.json", dataset["interactions"])
+
+    with pytest.raises(TypeError):
+        main(["--fake-source", "source", "--workers", "0", "--no-extracts", "--changes",
+              "--batch-size", "10"])
+    assert {table: read_bytes(f"data_transform/{table}") for table in TABLES} == before
+    assert not os.path.exists("data_transform/recipe.csv.prev")
@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+import os
+
+import pytest
+
+from conftest import read_bytes, write_json
+from data_transform.transform_to_csv import (TABLES, interaction_row, main, recipe_rows, transform,
+                                             transform_parallel)
+from pipeline_io import JsonStreamWriter, iter_json_array
+
+
+def as_text(rows):
+    return [["" if v is None else str(v) for v in row] for row in rows]
+
+
+def read_rows(path):
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+# small chunks cut strings, escapes and numbers at every possible position
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_json_array_streams_like_json_load(extracts, chunk_size):
+    text = (extracts / "recipes.json").read_text(encoding="utf-8")
+    docs = list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+    assert docs == json.loads(text)
+
+
+@pytest.mark.parametrize("text", ["[]", "  [ ]\n", '[1.5e3, "a,]", {"b": [1]}]'])
+def test_json_array_edge_cases(text):
+    assert list(iter_json_array(io.StringIO(text), chunk_size=2)) == json.loads(text)
+
+
+@pytest.mark.parametrize("text", ["", "{}", "[1, 2", '["a'])
+def test_json_array_rejects_malformed_input(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), chunk_size=2))
+
+
+# rows as the transform built them from the whole file in memory
+def test_streamed_transform_matches_loaded_rows(extracts, dataset, tmp_path):
+    transform(str(extracts / "recipes.json"), str(extracts / "interactions.json"), str(tmp_path))
+
+    expected = {table: [] for table in TABLES}
+    for r in dataset["recipes"]:
+        recipe, ingredients, steps = recipe_rows(r)
+        expected["recipe.csv"].append(recipe)
+        expected["ingredients.csv"].extend(ingredients)
+        expected["steps.csv"].extend(steps)
+    expected["interactions.csv"] = [interaction_row(inter) for inter in dataset["interactions"]]
+
+    for table in TABLES:
+        assert read_rows(tmp_path / table) == as_text(expected[table])
+
+
+def test_ndjson_extract_matches_json_array(extracts, dataset, tmp_path):
+    for name, docs in dataset.items():
+        with JsonStreamWriter(str(tmp_path / "nd" / f"{name}.ndjson"), report_every=0) as writer:
+            for doc in docs:
+                writer.write(doc)
+
+    transform(str(extracts / "recipes.json"), str(extracts / "interactions.json"), str(tmp_path / "a"))
+    transform(str(tmp_path / "nd" / "recipes.ndjson"), str(tmp_path / "nd" / "interactions.ndjson"),
+              str(tmp_path / "b"))
+    for table in TABLES:
+        assert read_bytes(tmp_path / "a" / table) == read_bytes(tmp_path / "b" / table)
+
+
+# chunks small enough that both inputs span several shards
+def test_parallel_transform_matches_serial(extracts, tmp_path):
+    recipes, interactions = str(extracts / "recipes.json"), str(extracts / "interactions.json")
+    transform(recipes, interactions, str(tmp_path / "serial"))
+    transform_parallel(recipes, interactions, str(tmp_path / "parallel"), workers=2, chunk_size=37)
+
+    for table in TABLES:
+        assert read_bytes(tmp_path / "parallel" / table) == read_bytes(tmp_path / "serial" / table)
+    assert not (tmp_path / "parallel" / "shards").exists()
+
+
+def test_unmerged_shards_hold_every_row(extracts, tmp_path):
+    recipes, interactions = str(extracts / "recipes.json"), str(extracts / "interactions.json")
+    transform(recipes, interactions, str(tmp_path / "serial"))
+    transform_parallel(recipes, interactions, str(tmp_path / "out"), workers=2, chunk_size=50,
+                       merge=False)
+
+    parts = sorted((tmp_path / "out" / "shards").iterdir())
+    assert len(parts) == 3 + 6
+    for table in TABLES:
+        rows = [row for part in parts if (part / table).exists()
+                for row in read_rows(part / table)]
+        assert rows == read_rows(tmp_path / "serial" / table)
+
+
+def test_transform_ids_are_stable(extracts, tmp_path):
+    recipes, interactions = str(extracts / "recipes.json"), str(extracts / "interactions.json")
+    for out in ("a", "b"):
+        transform(recipes, interactions, str(tmp_path / out))
+    for table in TABLES:
+        assert read_bytes(tmp_path / "a" / table) == read_bytes(tmp_path / "b" / table)
+
+
+def test_changes_list_inserted_updated_and_deleted_rows(workdir, dataset):
+    main([])
+    recipes = [dict(r) for r in dataset["recipes"]]
+    edited, deleted = recipes[5], recipes.pop(7)
+    edited["Title"] = "Renamed"
+    recipes.append(dict(recipes[0], id="new-recipe"))
+    write_json("data_extract/recipes.json", recipes)
+
+    main(["--changes"])
+
+    changes = [(row[0], row[1]) for row in read_rows("data_transform/changes/recipe.csv")]
+    # the old version of an updated row follows the new rows, for consumers to retract
+    assert changes == [("update", edited["id"]), ("insert", "new-recipe"), ("previous", edited["id"]),
+                       ("delete", deleted["id"])]
+    dropped = [row for row in read_rows("data_transform/changes/ingredients.csv") if row[0] == "delete"]
+    assert len(dropped) == len(deleted["Ingredients"])
+    assert read_rows("data_transform/changes/interactions.csv") == []
+    assert not os.path.exists("data_transform/recipe.csv.prev")
+
+
+# a transform that fails part way leaves the last complete tables in place,
+# and the next --changes run diffs against them
+def test_failed_changes_run_keeps_the_previous_tables(workdir, dataset):
+    main([])
+    before = {table: read_bytes(f"data_transform/{table}") for table in TABLES}
+    with open("data_extract/interactions.json", "w", encoding="utf-8") as f:
+        f.write(json.dumps(dataset["interactions"])[:-500])
+
+    with pytest.raises(ValueError):
+        main(["--changes"])
+    assert {table: read_bytes(f"data_transform/{table}") for table in TABLES} == before
+    assert not os.path.exists("data_transform/recipe.csv.prev")
+
+    write_json("data_extract/interactions.json", dataset["interactions"][1:])
+    main(["--changes"])
+    changes = [row[0] for row in read_rows("data_transform/changes/interactions.csv")]
+    assert changes == ["delete"]
+    assert read_rows("data_transform/changes/recipe.csv") == []
+
+
+@pytest.mark.parametrize("flags", [["--workers", "2", "--no-merge"], ["--merge-only"]])
+def test_changes_needs_merged_tables(workdir, flags):
+    main([])
+    with pytest.raises(SystemExit):
+        main(["--changes"] + flags)
+    assert os.path.exists("data_transform/recipe.csv")
@@ -0,0 +1,177 @@
+import csv
+import json
+import re
+from collections import defaultdict
+
+import pytest
+
+from conftest import read_json, write_json
+from data_transform.transform_to_csv import transform
+from data_validation.validator import (RULES, Rule, StreamingReport, compile_rules, main,
+                                       validate_recipes)
+
+VALID_DIFFICULTY = {"Easy", "Medium", "Hard"}
+REPORT = "data_validation/validation_report.json"
+RULE_STATS = "data_validation/rule_stats.json"
+
+
+def read_dicts(path):
+    with open(path, encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+# the row by row validator the table version replaced, kept as the reference
+def legacy_report(tables="data_transform"):
+    recipes = {row["recipe_id"]: row for row in read_dicts(f"{tables}/recipe.csv")}
+    children = {}
+    for table in ("ingredients", "steps", "interactions"):
+        children[table] = defaultdict(list)
+        for row in read_dicts(f"{tables}/{table}.csv"):
+            children[table][row["recipe_id"]].append(row)
+    ingredients, steps = children["ingredients"], children["steps"]
+    interactions = children["interactions"]
+
+    report = {"summary": {"total_recipes": len(recipes), "valid_recipes": 0, "invalid_recipes": 0},
+              "invalid_records": [], "valid_records": []}
+    for rid, rec in recipes.items():
+        errors = []
+
+        if not rec.get("title"):
+            errors.append("Missing Title")
+
+        try:
+            prep = float(rec.get("prep_time")) if rec.get("prep_time") else None
+            cook = float(rec.get("cook_time")) if rec.get("cook_time") else None
+            total = float(rec.get("total_time")) if rec.get("total_time") else None
+        except ValueError:
+            prep, cook, total = None, None, None
+
+        if prep is None or prep <= 0:
+            errors.append("PrepTime must be > 0")
+        if cook is None or cook < 0:
+            errors.append("CookTime must be >= 0")
+        if total is None:
+            errors.append("TotalTime missing")
+        elif prep and cook and total < prep + cook:
+            errors.append("TotalTime < PrepTime + CookTime")
+
+        diff = (rec.get("difficulty") or "").strip()
+        if diff not in VALID_DIFFICULTY:
+            errors.append(f"Invalid Difficulty: {diff}")
+
+        if len(ingredients[rid]) == 0:
+            errors.append("No ingredients found")
+        else:
+            for ing in ingredients[rid]:
+                qty = ing.get("quantity")
+                if qty:
+                    if not re.match(r"^\d+(\.\d+)?$", str(qty)):
+                        errors.append(f"Ingredient quantity invalid: {qty}")
+                    elif float(qty) <= 0:
+                        errors.append(f"Ingredient quantity must be positive: {qty}")
+
+        if len(steps[rid]) == 0:
+            errors.append("No steps found")
+
+        for inter in interactions.get(rid, []):
+            rstr = inter.get("rating")
+            if rstr:
+                try:
+                    rv = float(rstr)
+                    if rv < 0 or rv > 5:
+                        errors.append(f"Interaction rating out of range (0–5): {rv}")
+                except ValueError:
+                    errors.append(f"Invalid interaction rating: {rstr}")
+
+        if errors:
+            report["invalid_records"].append({"recipe_id": rid, "errors": errors})
+        else:
+            report["valid_records"].append(rid)
+
+    report["summary"]["valid_recipes"] = len(report["valid_records"])
+    report["summary"]["invalid_recipes"] = len(report["invalid_records"])
+    return report
+
+
+def test_rule_registry_matches_row_by_row_reference(workdir):
+    transform()
+    validate_recipes()
+    report, expected = read_json(REPORT), legacy_report()
+    assert expected["summary"]["invalid_recipes"] > 0
+    stats = read_json(RULE_STATS)
+    assert report == expected
+    assert list(stats) == [rule.name for rule in RULES]
+    bad_difficulty = [r for r in expected["invalid_records"]
+                      if any(e.startswith("Invalid Difficulty") for e in r["errors"])]
+    assert stats["valid_difficulty"]["failures"] == len(bad_difficulty)
+
+
+# a recipe exported twice: the last row wins but keeps the first position,
+# like the dict the reference loads the recipes into
+def test_duplicate_recipe_rows(workdir, dataset):
+    recipes = dataset["recipes"]
+    write_json("data_extract/recipes.json", recipes + [dict(recipes[10], Title="")])
+    transform()
+    validate_recipes()
+    report = read_json(REPORT)
+    assert report == legacy_report()
+    assert report["summary"]["total_recipes"] == len(recipes)
+    assert {"recipe_id": recipes[10]["id"], "errors": ["Missing Title"]} in report["invalid_records"]
+
+
+# a warning rule reports its rows but leaves them valid
+def test_warning_rules_do_not_invalidate(workdir):
+    transform()
+    slow = Rule("long_total_time", "recipe", "total_time",
+                lambda ctx, rows: ctx.number("recipe", "total_time")[0][rows] > 60,
+                "TotalTime over an hour", severity="warning")
+    validate_recipes(plan=compile_rules(RULES + [slow]))
+    report = read_json(REPORT)
+    warnings = report.pop("warnings")
+
+    assert report == legacy_report()
+    assert warnings and all(w["warnings"] == ["TotalTime over an hour"] for w in warnings)
+
+
+@pytest.mark.parametrize("rules, message", [
+    (RULES + [RULES[0]], "duplicate rule"),
+    ([Rule("r", "recipes", "title", None, "m")], "unknown table"),
+    ([Rule("r", "recipe", "title", None, "m", severity="info")], "unknown severity"),
+    ([Rule("r", "recipe", "title", None, "m", requires=["later"])], "must come earlier"),
+    ([RULES[0], Rule("r", "steps", "step_id", None, "m", requires=["missing_title"])], "another table"),
+])
+def test_compile_rules_rejects_bad_plans(rules, message):
+    with pytest.raises(ValueError, match=message):
+        compile_rules(rules)
+
+
+def test_streaming_report_writes_the_same_records(workdir):
+    transform()
+    validate_recipes(report=StreamingReport(sample_size=3))
+    report, expected = read_json(REPORT), legacy_report()
+
+    assert report["summary"] == expected["summary"]
+    with open(report["invalid_records_path"], encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == expected["invalid_records"]
+
+    # every failure is counted, and the samples are a subset of them
+    messages = [m for r in expected["invalid_records"] for m in r["errors"]]
+    assert sum(report["error_histogram"].values()) == len(messages)
+    for rule, sample in report["samples"].items():
+        assert 0 < len(sample) <= min(3, report["error_histogram"][rule])
+        assert all(item["message"] in messages for item in sample)
+
+
+@pytest.mark.parametrize("argv, streamed", [
+    ([], False),
+    (["--stream-report", "--sample-size", "2"], True),
+])
+def test_main_picks_the_report(workdir, argv, streamed):
+    transform()
+    main(argv)
+    report, expected = read_json(REPORT), legacy_report()
+    if streamed:
+        assert report["summary"] == expected["summary"]
+        assert all(len(sample) <= 2 for sample in report["samples"].values())
+    else:
+        assert report == expected